@@ -0,0 +1,177 @@
+"""
+Calibrazione una tantum dei parametri BM25 (k1, b) dell'indice lessicale.
+
+Copia un campione dell'indice in un indice temporaneo, esegue le query di
+validazione per ogni combinazione della griglia e riporta MRR e latenza.
+Le query di validazione sono in un file JSONL, una per riga:
+
+    {"query": "come configurare l'IVA", "relevant": ["chunk_id_1", "chunk_id_2"]}
+
+Uso:
+    python scripts/tune_bm25.py validation.jsonl --sample 5000 --write-env
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+from pathlib import Path
+from statistics import mean
+from typing import Dict, List, Tuple
+
+# Aggiungi il path dei sorgenti del progetto
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root / "src"))
+
+# Import dopo l'aggiunta dei sorgenti al path
+from loguru import logger  # noqa: E402
+
+from rag_gestionale.retrieval.lexical_search import LexicalSearch  # noqa: E402
+
+K1_GRID = (0.6, 0.9, 1.2, 1.6, 2.0)
+B_GRID = (0.2, 0.4, 0.6, 0.75)
+
+
+def load_queries(path: Path) -> List[Dict]:
+    """Carica le query di validazione con i chunk rilevanti"""
+    with path.open(encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def create_sample_index(
+    lexical: LexicalSearch, source_index: str, sample_size: int
+) -> None:
+    """Crea l'indice temporaneo e vi copia un campione dei documenti"""
+    if await lexical.client.indices.exists(index=lexical.index_name):
+        await lexical.client.indices.delete(index=lexical.index_name)
+
+    await lexical.client.indices.create(
+        index=lexical.index_name, body=lexical._build_index_config()
+    )
+    await lexical.client.reindex(
+        body={
+            "source": {"index": source_index},
+            "dest": {"index": lexical.index_name},
+            "max_docs": sample_size,
+        },
+        wait_for_completion=True,
+        request_timeout=600,
+    )
+    await lexical.client.indices.refresh(index=lexical.index_name)
+
+
+async def set_similarity(lexical: LexicalSearch, k1: float, b: float) -> None:
+    """Aggiorna la similarity di default (richiede indice chiuso)"""
+    await lexical.client.indices.close(index=lexical.index_name)
+    try:
+        await lexical.client.indices.put_settings(
+            index=lexical.index_name,
+            body={
+                "index": {"similarity": {"default": {"type": "BM25", "k1": k1, "b": b}}}
+            },
+        )
+    finally:
+        await lexical.client.indices.open(
+            index=lexical.index_name, wait_for_active_shards=1
+        )
+
+
+async def evaluate(
+    lexical: LexicalSearch, queries: List[Dict], top_k: int
+) -> Tuple[float, float]:
+    """MRR@top_k e latenza media (ms) riportata da OpenSearch"""
+    reciprocal_ranks = []
+    latencies = []
+
+    for item in queries:
+        response = await lexical.client.search(
+            index=lexical.index_name,
+            body=lexical._build_search_query(item["query"]),
+            size=top_k,
+            request_cache=False,
+        )
+        latencies.append(response["took"])
+
+        relevant = set(item["relevant"])
+        rank = next(
+            (
+                position
+                for position, hit in enumerate(response["hits"]["hits"], 1)
+                if hit["_id"] in relevant
+            ),
+            None,
+        )
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+    return mean(reciprocal_ranks), mean(latencies)
+
+
+def write_env(path: Path, values: Dict[str, float]) -> None:
+    """Aggiorna (o aggiunge) le variabili nel file .env"""
+    lines = path.read_text(encoding="utf-8").splitlines() if path.exists() else []
+    remaining = dict(values)
+
+    for i, line in enumerate(lines):
+        key = line.split("=", 1)[0].strip()
+        if key in remaining:
+            lines[i] = f"{key}={remaining.pop(key)}"
+
+    lines.extend(f"{key}={value}" for key, value in remaining.items())
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+async def tune(args: argparse.Namespace) -> None:
+    queries = load_queries(args.queries)
+    lexical = LexicalSearch()
+    source_index = lexical.index_name
+    lexical.index_name = f"{source_index}_bm25_tuning"
+    # Il client è condiviso: serve solo per le chiamate dirette
+    await lexical.initialize()
+
+    try:
+        logger.info(f"Copia di {args.sample} documenti in {lexical.index_name}")
+        await create_sample_index(lexical, source_index, args.sample)
+
+        results = []
+        for k1, b in itertools.product(K1_GRID, B_GRID):
+            await set_similarity(lexical, k1, b)
+            # Primo giro a vuoto per scaldare le cache dei segmenti
+            await evaluate(lexical, queries[:10], args.top_k)
+            mrr, latency = await evaluate(lexical, queries, args.top_k)
+            results.append((k1, b, mrr, latency))
+            logger.info(f"k1={k1} b={b}: MRR@{args.top_k}={mrr:.4f} {latency:.1f}ms")
+
+        # Migliore qualità; a parità, la combinazione più veloce
+        k1, b, mrr, latency = max(results, key=lambda r: (round(r[2], 3), -r[3]))
+        logger.info(f"Migliore: k1={k1} b={b} (MRR={mrr:.4f}, {latency:.1f}ms)")
+
+        values = {"RAG_LEXICAL_SEARCH__BM25_K1": k1, "RAG_LEXICAL_SEARCH__BM25_B": b}
+        if args.write_env:
+            write_env(args.env_file, values)
+            logger.info(f"Parametri salvati in {args.env_file}")
+        else:
+            for key, value in values.items():
+                print(f"{key}={value}")
+
+    finally:
+        await lexical.client.indices.delete(
+            index=lexical.index_name, ignore_unavailable=True
+        )
+        await lexical.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Calibrazione parametri BM25")
+    parser.add_argument("queries", type=Path, help="File JSONL di validazione")
+    parser.add_argument("--sample", type=int, default=5000, help="Documenti campione")
+    parser.add_argument("--top-k", type=int, default=10, help="Cutoff per MRR")
+    parser.add_argument(
+        "--write-env", action="store_true", help="Salva i parametri nel file .env"
+    )
+    parser.add_argument("--env-file", type=Path, default=project_root / ".env")
+    asyncio.run(tune(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
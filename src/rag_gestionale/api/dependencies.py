@@ -6,7 +6,7 @@ from typing import Optional
 
 from fastapi import HTTPException
 
-from ..retrieval.hybrid_retriever import HybridRetriever
+from ..retrieval.hybrid_retriever import HybridRetriever, close_retriever
 from ..generation.generator import ResponseGenerator
 from ..ingest.coordinator import IngestionCoordinator
 
@@ -39,6 +39,8 @@ class RAGComponents:
         """Cleanup componenti"""
         if self.retriever:
             await self.retriever.close()
+        # Retriever condiviso di search_documents, se mai creato
+        await close_retriever()
 
 
 # Istanza globale
@@ -52,6 +52,35 @@ class EmbeddingSettings(BaseModel):
     )
     batch_size_gpu: int = Field(default=128, description="Batch size per embedding GPU")
     max_length: int = Field(default=512, description="Lunghezza massima input")
+    cache_path: Optional[str] = Field(
+        default=None,
+        description="File SQLite della cache persistente degli embedding dei chunk",
+    )
+    query_cache_size: int = Field(
+        default=2048, description="Embedding di query mantenuti in cache"
+    )
+    query_cache_ttl: float = Field(
+        default=3600.0, description="Validità della cache degli embedding (secondi)"
+    )
+
+    # Backend di inferenza: "onnx" usa un modello quantizzato int8 su CPU,
+    # esportato al primo avvio (richiede l'extra 'onnx'); "openvino" usa la
+    # precisione ridotta su CPU (richiede l'extra 'openvino')
+    backend: str = Field(default="torch", description="Backend: torch, onnx o openvino")
+    fp16_on_gpu: bool = Field(default=True, description="Modello in FP16 su GPU")
+    openvino_precision: str = Field(
+        default="bf16", description="Precisione di inferenza OpenVINO (bf16, f32)"
+    )
+    onnx_dir: str = Field(
+        default="./models/embedding-onnx", description="Directory dei modelli ONNX"
+    )
+    onnx_quantization: str = Field(
+        default="avx512_vnni",
+        description="Quantizzazione dinamica: arm64, avx2, avx512 o avx512_vnni",
+    )
+    onnx_min_fidelity: float = Field(
+        default=0.99, description="Similarità coseno minima tra int8 e FP32"
+    )
 
 
 class VectorStoreSettings(BaseModel):
@@ -59,6 +88,9 @@ class VectorStoreSettings(BaseModel):
 
     host: str = Field(default="localhost", description="Host Qdrant")
     port: int = Field(default=6333, description="Porta Qdrant")
+    # gRPC: vettori in protobuf binario invece di float in JSON
+    grpc_port: int = Field(default=6334, description="Porta gRPC Qdrant")
+    prefer_grpc: bool = Field(default=True, description="Usa gRPC verso Qdrant")
     collection_name: str = Field(
         default="gestionale_docs", description="Nome collection"
     )
@@ -66,7 +98,25 @@ class VectorStoreSettings(BaseModel):
     # Parametri HNSW
     hnsw_m: int = Field(default=64, description="Parametro M per HNSW")
     hnsw_ef_construct: int = Field(default=256, description="efConstruction per HNSW")
-    hnsw_ef_search: int = Field(default=64, description="efSearch per HNSW")
+    hnsw_ef_search: int = Field(default=64, description="efSearch minimo per HNSW")
+
+    # Inserimento: batch di punti inviati in parallelo
+    upsert_batch_size: int = Field(default=100, description="Punti per upsert")
+    upsert_concurrency: int = Field(
+        default=4, ge=1, description="Richieste upsert concorrenti"
+    )
+
+    # Quantizzazione scalare int8: vettori quantizzati in RAM, originali su
+    # disco per il rescore dei candidati (solo per collection nuove)
+    scalar_quantization: bool = Field(
+        default=True, description="Quantizzazione int8 dei vettori"
+    )
+    quantization_quantile: float = Field(
+        default=0.99, description="Quantile dei valori usato per la scala int8"
+    )
+    quantization_oversampling: float = Field(
+        default=2.0, description="Candidati extra rivalutati con i vettori originali"
+    )
 
 
 class LexicalSearchSettings(BaseModel):
@@ -75,10 +125,93 @@ class LexicalSearchSettings(BaseModel):
     host: str = Field(default="localhost", description="Host OpenSearch")
     port: int = Field(default=9200, description="Porta OpenSearch")
     index_name: str = Field(default="gestionale_lexical", description="Nome indice")
+    pool_maxsize: int = Field(
+        default=32, description="Connessioni HTTP mantenute verso OpenSearch"
+    )
 
     # Parametri BM25
     bm25_k1: float = Field(default=0.9, description="Parametro k1 per BM25")
-    bm25_b: float = Field(default=0.55, description="Parametro b per BM25")
+    bm25_b: float = Field(default=0.4, description="Parametro b per BM25")
+    # Titoli brevi e di lunghezza simile: normalizzazione ridotta
+    title_bm25_k1: float = Field(default=0.9, description="Parametro k1 per i titoli")
+    title_bm25_b: float = Field(default=0.3, description="Parametro b per i titoli")
+
+    # Analisi testo: lo stemmer leggero ignora le parole sotto i 6 caratteri,
+    # ma tronca prodotti e termini inglesi più lunghi ("database" -> "databas")
+    tech_keywords: List[str] = Field(
+        default=[
+            "cassiopea",
+            "database",
+            "software",
+            "hardware",
+            "template",
+            "service",
+            "release",
+            "update",
+            "device",
+            "online",
+            "office",
+        ],
+        description="Termini esclusi dallo stemming (richiede di ricreare l'indice)",
+    )
+
+    synonyms_path: Optional[str] = Field(
+        default=None,
+        description="File sinonimi relativo alla config dei nodi OpenSearch "
+        "(es. analysis/it_synonyms.txt); se assente, sinonimi predefiniti",
+    )
+
+    icu_folding: bool = Field(
+        default=False,
+        description="Usa icu_folding invece di asciifolding "
+        "(richiede il plugin analysis-icu su OpenSearch)",
+    )
+    use_search_template: bool = Field(
+        default=True, description="Usa il search template memorizzato sul cluster"
+    )
+
+    # Rescore fuzzy sui primi risultati della query esatta
+    fuzzy_rescore_window: int = Field(
+        default=50, description="Risultati ripesati con la query fuzzy"
+    )
+    fuzzy_rescore_weight: float = Field(
+        default=0.6, description="Peso della query fuzzy nel rescore"
+    )
+    # Interruzione anticipata: terminate_after raccoglie i documenti in ordine di
+    # indice, non di score, quindi può escludere risultati migliori
+    terminate_after_factor: int = Field(
+        default=0,
+        description="Documenti raccolti per shard come multiplo di top_k "
+        "(minimo 200, 0 = disattivato)",
+    )
+
+    # Impostazioni indice
+    replicas: int = Field(default=0, description="Repliche dell'indice")
+    refresh_interval: str = Field(
+        default="30s",
+        description=(
+            "Intervallo di refresh fuori dall'ingestione; ingestioni e "
+            "cancellazioni attese forzano un refresh esplicito, le altre "
+            "scritture restano invisibili alle ricerche fino a questo intervallo"
+        ),
+    )
+
+    # Cache dei risultati di ricerca
+    search_cache_size: int = Field(default=1000, description="Ricerche in cache")
+    search_cache_ttl: float = Field(
+        default=300.0, description="Validità della cache di ricerca (secondi)"
+    )
+
+    # Indicizzazione bulk
+    bulk_chunk_size: int = Field(
+        default=500, description="Documenti per richiesta bulk"
+    )
+    bulk_max_chunk_bytes: int = Field(
+        default=10 * 1024 * 1024, description="Dimensione massima di una richiesta bulk"
+    )
+    bulk_concurrency: int = Field(
+        default=4, ge=1, description="Richieste bulk concorrenti"
+    )
 
 
 class RetrievalSettings(BaseModel):
@@ -90,6 +223,14 @@ class RetrievalSettings(BaseModel):
     k_rerank: int = Field(default=30, description="Candidati per reranking")
     k_final: int = Field(default=10, description="Risultati finali")
 
+    # Fusione (TM2C2: combinazione convessa di score normalizzati)
+    fusion_alpha: float = Field(
+        default=0.7, ge=0.0, le=1.0, description="Peso della ricerca densa"
+    )
+    rerank_weight: float = Field(
+        default=0.7, ge=0.0, le=1.0, description="Peso dello score del reranker"
+    )
+
     # Booster per campi
     title_boost: float = Field(default=1.4, description="Boost per titoli")
     breadcrumbs_boost: float = Field(default=1.2, description="Boost per breadcrumbs")
@@ -100,6 +241,22 @@ class RetrievalSettings(BaseModel):
     reranker_model: str = Field(
         default="BAAI/bge-reranker-large", description="Modello reranker"
     )
+    reranker_max_length: int = Field(
+        default=256, description="Token massimi per coppia (query, documento)"
+    )
+    reranker_onnx_path: Optional[str] = Field(
+        default=None, description="Modello ONNX int8 del reranker (opzionale)"
+    )
+    rerank_batch_size: int = Field(default=32, description="Batch size del reranker")
+    rerank_skip_gap: float = Field(
+        default=0.35, description="Distacco di fusione oltre cui saltare il reranking"
+    )
+    rerank_cache_size: int = Field(
+        default=10_000, description="Coppie (query, chunk) in cache del reranker"
+    )
+    rerank_cache_ttl: float = Field(
+        default=900.0, description="Validità cache del reranker (secondi)"
+    )
     diversification_threshold: int = Field(
         default=2, description="Max risultati per sezione"
     )
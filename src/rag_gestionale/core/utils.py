@@ -56,6 +56,21 @@ def compute_content_hash(content: str) -> str:
     return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
 
 
+def compute_bytes_hash(data: bytes) -> str:
+    """
+    Calcola hash BLAKE2b a 128 bit di contenuto binario per deduplicazione.
+
+    Lavora direttamente sui bytes scaricati, senza decodifica né normalizzazione.
+
+    Args:
+        data: Contenuto grezzo
+
+    Returns:
+        Hash BLAKE2b come stringa esadecimale
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
 def extract_breadcrumbs(section_path: str) -> List[str]:
     """
     Estrae breadcrumbs dal percorso della sezione.
@@ -4,7 +4,6 @@ Orchestrazione di crawling, parsing e preprocessing per scalabilità massiva.
 """
 
 import asyncio
-import tempfile
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
@@ -20,7 +19,7 @@ from ..core.models import (
 )
 from ..core.utils import compute_content_hash, extract_breadcrumbs
 from ..config.settings import get_settings
-from .crawler import WebCrawler, CrawlResult
+from .crawler import PDF_TEMP_DIR, WebCrawler, CrawlResult
 from .html_parser import HTMLParser, HTMLSection
 from .pdf_parser import PDFParser, PDFSection
 from .image_service import ImageService
@@ -346,18 +345,23 @@ class IngestionCoordinator:
     ) -> List[DocumentChunk]:
         """Parse documento PDF da risultato crawling"""
         try:
-            # Crea directory temporanea cross-platform
-            temp_dir = Path(tempfile.gettempdir()) / "rag_gestionale_pdfs"
-            temp_dir.mkdir(parents=True, exist_ok=True)
+            if crawl_result.content_path:
+                # PDF già scritto su disco dal crawler in streaming
+                temp_file = crawl_result.content_path
+            else:
+                # Crea directory temporanea cross-platform
+                PDF_TEMP_DIR.mkdir(parents=True, exist_ok=True)
+
+                # Salva PDF temporaneo con nome univoco
+                temp_file = PDF_TEMP_DIR / f"{crawl_result.content_hash}.pdf"
 
-            # Salva PDF temporaneo con nome univoco
-            temp_file = temp_dir / f"{crawl_result.content_hash}.pdf"
+                logger.info(f"Salvando PDF temporaneo in: {temp_file}")
 
-            logger.info(f"Salvando PDF temporaneo in: {temp_file}")
+                if not isinstance(crawl_result.content, bytes):
+                    raise TypeError("Contenuto PDF atteso come bytes")
 
-            with open(temp_file, "wb") as f:
-                # Riconverti da latin-1 a bytes
-                f.write(crawl_result.content.encode("latin-1"))
+                with open(temp_file, "wb") as f:
+                    f.write(crawl_result.content)
 
             logger.info(f"PDF salvato, inizio parsing da {temp_file}")
             chunks = await self._parse_pdf_file(str(temp_file))
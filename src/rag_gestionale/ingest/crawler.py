@@ -4,9 +4,13 @@ Include throttling, whitelisting domini e gestione errori robusti.
 """
 
 import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
 import time
 from pathlib import Path
-from typing import Dict, List, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple, Union
 from urllib.parse import urljoin, urlparse
 
 import aiofiles
@@ -15,7 +19,13 @@ from loguru import logger
 # from playwright.async_api import async_playwright  # Disabilitato temporaneamente
 
 from ..config.settings import get_settings
-from ..core.utils import is_valid_url, compute_content_hash
+from ..core.utils import is_valid_url, compute_bytes_hash
+
+# Directory per i PDF scaricati in streaming (condivisa con il coordinator)
+PDF_TEMP_DIR = Path(tempfile.gettempdir()) / "rag_gestionale_pdfs"
+
+# Dimensione dei blocchi letti dal body HTTP durante lo streaming
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 class CrawlResult:
@@ -24,11 +34,13 @@ class CrawlResult:
     def __init__(
         self,
         url: str,
-        content: str,
+        content: Union[str, bytes],
         content_type: str,
         status_code: int,
         headers: Dict[str, str],
         timestamp: float,
+        content_path: Optional[Path] = None,
+        content_hash: Optional[str] = None,
     ):
         self.url = url
         self.content = content
@@ -36,7 +48,18 @@ class CrawlResult:
         self.status_code = status_code
         self.headers = headers
         self.timestamp = timestamp
-        self.content_hash = compute_content_hash(content)
+        # Per i PDF il body è su disco (content_path) oppure in content come
+        # bytes, mai decodificato in str; l'hash viene calcolato in streaming
+        self.content_path = content_path
+        if not content_hash:
+            raw = content if isinstance(content, bytes) else content.encode("utf-8")
+            content_hash = compute_bytes_hash(raw)
+        self.content_hash = content_hash
+
+    @property
+    def content_digest(self) -> int:
+        """Hash del contenuto come intero a 128 bit (per il set di deduplicazione)"""
+        return int(self.content_hash, 16)
 
     @property
     def is_html(self) -> bool:
@@ -67,10 +90,16 @@ class CrawlResult:
 class WebCrawler:
     """Crawler web asincrono per documenti di gestionali"""
 
+    # Client HTTP condiviso tra le istanze attive: pool di connessioni e
+    # sessioni TLS vengono riusati, chiuso quando l'ultima istanza si ferma
+    _shared_session: Optional[httpx.AsyncClient] = None
+    _shared_session_refs = 0
+
     def __init__(self):
         self.settings = get_settings()
         self.visited_urls: Set[str] = set()
-        self.content_hashes: Set[str] = set()
+        # Digest a 128 bit come int: più compatti delle stringhe esadecimali
+        self.content_hashes: Set[int] = set()
         self.session: Optional[httpx.AsyncClient] = None
         self.browser = None
         self.rate_limiter = RateLimiter(
@@ -89,12 +118,8 @@ class WebCrawler:
 
     async def start(self):
         """Inizializza il crawler"""
-        # HTTP client
-        self.session = httpx.AsyncClient(
-            timeout=httpx.Timeout(30.0),
-            headers={"User-Agent": self.settings.ingest.user_agent},
-            follow_redirects=True,
-        )
+        if self.session is None:
+            self.session = self._acquire_session()
 
         # Browser per JS-heavy pages (disabilitato temporaneamente)
         # playwright = await async_playwright().start()
@@ -106,13 +131,41 @@ class WebCrawler:
     async def stop(self):
         """Chiude il crawler"""
         if self.session:
-            await self.session.aclose()
+            self.session = None
+            await self._release_session()
 
         if self.browser:
             await self.browser.close()
 
         logger.info("Crawler fermato")
 
+    def _acquire_session(self) -> httpx.AsyncClient:
+        """Restituisce il client HTTP condiviso, creandolo se necessario"""
+        if WebCrawler._shared_session is None:
+            # HTTP client con pool dimensionato sulla concorrenza del crawling
+            max_concurrent = self.settings.ingest.max_concurrent_requests
+            WebCrawler._shared_session = httpx.AsyncClient(
+                timeout=httpx.Timeout(30.0),
+                headers={"User-Agent": self.settings.ingest.user_agent},
+                follow_redirects=True,
+                limits=httpx.Limits(
+                    max_connections=max_concurrent,
+                    max_keepalive_connections=max_concurrent,
+                ),
+            )
+        WebCrawler._shared_session_refs += 1
+        return WebCrawler._shared_session
+
+    async def _release_session(self):
+        """Rilascia il client condiviso, chiudendolo all'ultimo riferimento"""
+        WebCrawler._shared_session_refs -= 1
+        if WebCrawler._shared_session_refs <= 0:
+            session = WebCrawler._shared_session
+            WebCrawler._shared_session = None
+            WebCrawler._shared_session_refs = 0
+            if session is not None:
+                await session.aclose()
+
     async def crawl_urls(self, urls: List[str]) -> List[CrawlResult]:
         """
         Crawl di una lista di URL
@@ -125,9 +178,12 @@ class WebCrawler:
         """
         results = []
 
-        # Filtra URL validi
+        # Filtra URL validi (deduplicati mantenendo l'ordine: le richieste
+        # concorrenti non vedrebbero ancora l'URL in visited_urls)
         valid_urls = [
-            url for url in urls if is_valid_url(url, self.settings.allowed_domains)
+            url
+            for url in dict.fromkeys(urls)
+            if is_valid_url(url, self.settings.allowed_domains)
         ]
 
         if not valid_urls:
@@ -184,12 +240,18 @@ class WebCrawler:
                 self.visited_urls.add(url)
 
                 # Controllo deduplicazione
-                if result.content_hash in self.content_hashes:
+                content_digest = result.content_digest
+                if content_digest in self.content_hashes:
                     logger.debug(f"Contenuto duplicato per {url}")
+                    if result.content_path:
+                        result.content_path.unlink(missing_ok=True)
                     return None
 
-                self.content_hashes.add(result.content_hash)
-                logger.debug(f"Scaricato {url} ({len(result.content)} chars)")
+                self.content_hashes.add(content_digest)
+                if result.content_path:
+                    logger.debug(f"Scaricato {url} in {result.content_path}")
+                else:
+                    logger.debug(f"Scaricato {url} ({len(result.content)} chars)")
 
             return result
 
@@ -200,38 +262,76 @@ class WebCrawler:
     async def _fetch_with_http(self, url: str) -> Optional[CrawlResult]:
         """Fetch con HTTP client"""
         try:
-            response = await self.session.get(url)
-            response.raise_for_status()
-
-            content_type = response.headers.get("content-type", "")
-
-            # Controlla se è un tipo supportato
-            if not any(
-                ct in content_type.lower()
-                for ct in ["text/html", "application/pdf", "text/plain"]
-            ):
-                logger.debug(f"Content-type non supportato per {url}: {content_type}")
-                return None
+            # Streaming: il body viene letto solo dopo aver controllato gli header
+            async with self.session.stream("GET", url) as response:
+                response.raise_for_status()
+
+                content_type = response.headers.get("content-type", "")
+
+                # Controlla se è un tipo supportato
+                if not any(
+                    ct in content_type.lower()
+                    for ct in ["text/html", "application/pdf", "text/plain"]
+                ):
+                    logger.debug(
+                        f"Content-type non supportato per {url}: {content_type}"
+                    )
+                    return None
 
-            # Per PDF, mantieni bytes
-            if "application/pdf" in content_type.lower():
-                content = response.content.decode("latin-1")  # Preserva bytes
-            else:
-                content = response.text
-
-            return CrawlResult(
-                url=url,
-                content=content,
-                content_type=content_type,
-                status_code=response.status_code,
-                headers=dict(response.headers),
-                timestamp=time.time(),
-            )
+                # Per PDF, scrivi i bytes su disco senza tenerli in memoria
+                content_path = None
+                content_hash = None
+                if "application/pdf" in content_type.lower():
+                    content = ""
+                    content_path, content_hash = await self._stream_to_file(response)
+                else:
+                    # Hash sui bytes grezzi, senza ricodificare il testo
+                    await response.aread()
+                    content = response.text
+                    content_hash = compute_bytes_hash(response.content)
+
+                return CrawlResult(
+                    url=url,
+                    content=content,
+                    content_type=content_type,
+                    status_code=response.status_code,
+                    headers=dict(response.headers),
+                    timestamp=time.time(),
+                    content_path=content_path,
+                    content_hash=content_hash,
+                )
 
         except httpx.HTTPError as e:
             logger.warning(f"HTTP error per {url}: {e}")
             return None
 
+    async def _stream_to_file(self, response: httpx.Response) -> Tuple[Path, str]:
+        """
+        Scrive il body della response su un file temporaneo a blocchi
+
+        Args:
+            response: Response HTTP aperta in modalità streaming
+
+        Returns:
+            Tuple di (percorso file, hash del contenuto)
+        """
+        PDF_TEMP_DIR.mkdir(parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(suffix=".pdf", dir=PDF_TEMP_DIR)
+        os.close(fd)
+        temp_path = Path(temp_name)
+
+        hasher = hashlib.blake2b(digest_size=16)
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    await f.write(chunk)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+        return temp_path, hasher.hexdigest()
+
     async def _fetch_with_browser(self, url: str) -> Optional[CrawlResult]:
         """Fetch con browser Playwright per pagine JS-heavy"""
         try:
@@ -319,8 +419,18 @@ class WebCrawler:
         filename = f"{result.content_hash}{result.file_extension}"
         file_path = cache_path / filename
 
-        async with aiofiles.open(file_path, "w", encoding="utf-8") as f:
-            await f.write(result.content)
+        if result.content_path:
+            # Contenuto già su disco (PDF in streaming): copia il file
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(
+                None, shutil.copyfile, result.content_path, file_path
+            )
+        elif isinstance(result.content, bytes):
+            async with aiofiles.open(file_path, "wb") as f:
+                await f.write(result.content)
+        else:
+            async with aiofiles.open(file_path, "w", encoding="utf-8") as f:
+                await f.write(result.content)
 
         return str(file_path)
 
@@ -3,8 +3,12 @@ Parser PDF specializzato per manuali tecnici.
 Estrae testo, tabelle e metadati con preservazione della struttura.
 """
 
+import os
 import re
-from typing import Dict, List, Optional, Tuple
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 from pathlib import Path
 
 import fitz  # PyMuPDF
@@ -19,6 +23,9 @@ from ..core.utils import (
     estimate_tokens,
 )
 
+# Prefisso di subset dei font incorporati (es. "ABCDEF+Arial")
+SUBSET_PREFIX_RE = re.compile(r"^[A-Z]{6}\+")
+
 
 class PDFSection:
     """Rappresenta una sezione del documento PDF"""
@@ -38,13 +45,19 @@ class PDFSection:
         self.page_start = page_start
         self.page_end = page_end
         self.bbox = bbox  # Bounding box (x0, y0, x1, y1)
-        # IMPORTANTE: error_codes deve essere inizializzato PRIMA di _classify_content()
-        # perché _classify_content() usa self.error_codes
-        self.error_codes = extract_error_codes(content)
-        self.content_type = self._classify_content()
         self.tables: List[str] = []
         self.figures: List[Dict[str, str]] = []
 
+    @cached_property
+    def error_codes(self) -> List[str]:
+        """Codici errore presenti nel contenuto (calcolati al primo accesso)"""
+        return extract_error_codes(self.content)
+
+    @cached_property
+    def content_type(self) -> ContentType:
+        """Tipo di contenuto (calcolato al primo accesso, sovrascrivibile)"""
+        return self._classify_content()
+
     def _classify_content(self) -> ContentType:
         """Classifica il tipo di contenuto della sezione"""
         content_lower = self.content.lower()
@@ -137,14 +150,43 @@ class PDFParser:
             # Estrai sezioni
             sections = self._extract_sections(doc, font_stats)
 
-            # Estrai tabelle
-            self._extract_tables(pdf_path, sections)
+            # Estrai tabelle solo dalle pagine candidate
+            table_pages = self._find_table_pages(doc)
+            self._extract_tables(pdf_path, sections, table_pages)
 
             return sections, metadata
 
         finally:
             doc.close()
 
+    @classmethod
+    def parse_many(
+        cls, pdf_paths: List[str], workers: Optional[int] = None
+    ) -> List[Tuple[List[PDFSection], Dict]]:
+        """
+        Parse di più PDF in parallelo su processi separati
+
+        Ogni worker apre il proprio fitz.Document, quindi non c'è
+        condivisione di stato tra i processi.
+
+        Args:
+            pdf_paths: Percorsi ai file PDF
+            workers: Numero di processi (default: min(CPU, 4))
+
+        Returns:
+            Lista di (sezioni, metadati) nello stesso ordine dei percorsi
+        """
+        if not pdf_paths:
+            return []
+
+        max_workers = workers or min(os.cpu_count() or 1, 4)
+        if max_workers == 1 or len(pdf_paths) == 1:
+            parser = cls()
+            return [parser.parse_from_path(path) for path in pdf_paths]
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_parse_pdf_worker, pdf_paths))
+
     def _extract_metadata(self, doc: fitz.Document, pdf_path: str) -> Dict:
         """Estrae metadati dal documento PDF"""
         metadata = {
@@ -189,7 +231,10 @@ class PDFParser:
 
     def _analyze_fonts(self, doc: fitz.Document) -> Dict:
         """Analizza i font del documento per identificare i livelli di heading"""
-        font_stats = {}
+        # Chiave (font, size, flags) -> [conteggio, lunghezza media testo]
+        font_stats = defaultdict(lambda: [0, 0])
+        # Pochi font distinti ma migliaia di span: lower() una volta per font
+        font_names: Dict[str, str] = {}
 
         # Analizza prime 5 pagine per campionare i font
         sample_pages = min(5, doc.page_count)
@@ -204,19 +249,17 @@ class PDFParser:
 
                 for line in block["lines"]:
                     for span in line["spans"]:
-                        font_name = span["font"].lower()
+                        font_name = font_names.get(span["font"])
+                        if font_name is None:
+                            font_name = font_names[span["font"]] = span["font"].lower()
                         font_size = span["size"]
                         font_flags = span["flags"]  # Bold, italic, etc.
 
-                        key = (font_name, font_size, font_flags)
-                        if key not in font_stats:
-                            font_stats[key] = {"count": 0, "avg_length": 0}
-
-                        font_stats[key]["count"] += 1
+                        # Un solo accesso al dizionario per span
+                        stats = font_stats[(font_name, font_size, font_flags)]
+                        stats[0] += 1
                         text_length = len(span["text"].strip())
-                        font_stats[key]["avg_length"] = (
-                            font_stats[key]["avg_length"] + text_length
-                        ) / 2
+                        stats[1] = (stats[1] + text_length) / 2
 
         # Identifica font per headings (grandi, poco frequenti, testo breve)
         heading_fonts = {}
@@ -224,16 +267,17 @@ class PDFParser:
             max_size = max(key[1] for key in font_stats.keys())
             avg_size = sum(key[1] for key in font_stats.keys()) / len(font_stats)
 
-            for (font_name, font_size, font_flags), stats in font_stats.items():
+            for key, (count, avg_length) in font_stats.items():
+                font_name, font_size, font_flags = key
                 # Criteri per heading
                 is_large = font_size >= avg_size + self.heading_size_threshold
                 is_bold = font_flags & 2**4  # Bold flag
-                is_short = stats["avg_length"] < 50
-                is_rare = stats["count"] < len(font_stats) * 0.1
+                is_short = avg_length < 50
+                is_rare = count < len(font_stats) * 0.1
 
                 if (is_large or is_bold) and (is_short or is_rare):
                     level = int((max_size - font_size) / 2) + 1
-                    heading_fonts[(font_name, font_size, font_flags)] = min(level, 6)
+                    heading_fonts[key] = min(level, 6)
 
         return heading_fonts
 
@@ -243,47 +287,33 @@ class PDFParser:
         """Estrae sezioni dal documento"""
         sections = []
         current_section = None
+        # Blocchi di testo della sezione corrente, uniti alla chiusura
+        content_parts: List[str] = []
         section_counter = 0
 
+        # Dimensioni dei font di heading: filtro economico prima della
+        # costruzione della chiave completa (font, size, flags)
+        heading_sizes = {font_key[1] for font_key in heading_fonts}
+        heading_font_names = {font_key[0] for font_key in heading_fonts}
+        font_names: Dict[str, str] = {}
+
         for page_num in range(doc.page_count):
             page = doc[page_num]
-            blocks = page.get_text("dict")["blocks"]
+            use_dict = self._page_may_have_headings(page, heading_font_names)
 
-            for block in blocks:
-                if "lines" not in block:
+            for block_text, heading_level, bbox in self._iter_page_blocks(
+                page, heading_fonts, heading_sizes, font_names, use_dict
+            ):
+                if not block_text.strip():
                     continue
 
-                # Estrai testo del blocco
-                block_text = ""
-                is_heading = False
-                heading_level = 0
-                bbox = block.get("bbox")
-
-                for line in block["lines"]:
-                    line_text = ""
-                    for span in line["spans"]:
-                        span_text = span["text"]
-                        line_text += span_text
-
-                        # Verifica se è un heading
-                        font_key = (
-                            span["font"].lower(),
-                            span["size"],
-                            span["flags"],
-                        )
-                        if font_key in heading_fonts:
-                            is_heading = True
-                            heading_level = heading_fonts[font_key]
-
-                    block_text += line_text + "\n"
-
-                block_text = normalize_text(block_text)
-
                 # Se è un heading, inizia nuova sezione
-                if is_heading and len(block_text.strip()) > 0:
+                if heading_level is not None:
                     # Finalizza sezione precedente
                     if current_section:
+                        current_section.content = "\n\n".join(content_parts)
                         sections.append(current_section)
+                    content_parts = []
 
                     # Crea nuova sezione
                     section_counter += 1
@@ -299,14 +329,13 @@ class PDFParser:
                     )
 
                 # Altrimenti aggiungi alla sezione corrente
-                elif current_section and len(block_text.strip()) > 0:
-                    if current_section.content:
-                        current_section.content += "\n\n"
-                    current_section.content += block_text
+                elif current_section:
+                    content_parts.append(block_text)
                     current_section.page_end = page_num + 1
 
         # Aggiungi ultima sezione
         if current_section:
+            current_section.content = "\n\n".join(content_parts)
             sections.append(current_section)
 
         # Filtra sezioni troppo corte e pulisci contenuto
@@ -319,6 +348,78 @@ class PDFParser:
 
         return filtered_sections
 
+    def _page_may_have_headings(
+        self, page: fitz.Page, heading_font_names: Set[str]
+    ) -> bool:
+        """
+        Verifica se la pagina usa almeno uno dei font di heading.
+
+        Nel dubbio (font non elencati, Type3 o senza nome) restituisce True.
+        """
+        if not heading_font_names:
+            return False
+
+        page_fonts = page.get_fonts()
+        if not page_fonts:
+            return True
+
+        for font in page_fonts:
+            font_type, base_font = font[2], font[3]
+            if font_type == "Type3" or not base_font:
+                return True
+            # Negli span PyMuPDF riporta il nome senza prefisso di subset
+            if SUBSET_PREFIX_RE.match(base_font):
+                base_font = base_font[7:]
+            if base_font.lower() in heading_font_names:
+                return True
+
+        return False
+
+    def _iter_page_blocks(
+        self,
+        page: fitz.Page,
+        heading_fonts: Dict,
+        heading_sizes: Set[float],
+        font_names: Dict[str, str],
+        use_dict: bool,
+    ) -> Iterator[Tuple[str, Optional[int], Tuple[float, float, float, float]]]:
+        """
+        Itera i blocchi di testo della pagina
+
+        Yields:
+            Tuple di (testo normalizzato, livello heading o None, bbox)
+        """
+        if not use_dict:
+            # Pagina di solo corpo testo: modalità "blocks", senza span
+            for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks"):
+                if block_type == 0:
+                    yield normalize_text(text), None, (x0, y0, x1, y1)
+            return
+
+        for block in page.get_text("dict")["blocks"]:
+            if "lines" not in block:
+                continue
+
+            # Estrai testo del blocco
+            line_texts = []
+            heading_level = None
+
+            for line in block["lines"]:
+                line_texts.append("".join(span["text"] for span in line["spans"]))
+                for span in line["spans"]:
+                    # Verifica se è un heading
+                    if span["size"] not in heading_sizes:
+                        continue
+                    font_name = font_names.get(span["font"])
+                    if font_name is None:
+                        font_name = font_names[span["font"]] = span["font"].lower()
+                    font_key = (font_name, span["size"], span["flags"])
+                    level = heading_fonts.get(font_key)
+                    if level is not None:
+                        heading_level = level
+
+            yield normalize_text("\n".join(line_texts)), heading_level, block["bbox"]
+
     def _clean_pdf_text(self, text: str) -> str:
         """Pulisce il testo estratto dal PDF"""
         # Rimuovi caratteri di controllo
@@ -343,22 +444,85 @@ class PDFParser:
         text = "\n".join(cleaned_lines)
         return normalize_text(text)
 
-    def _extract_tables(self, pdf_path: str, sections: List[PDFSection]) -> None:
-        """Estrae tabelle dal PDF e le associa alle sezioni"""
+    def _find_table_pages(self, doc: fitz.Document) -> List[int]:
+        """
+        Individua le pagine che possono contenere tabelle con bordi.
+
+        Camelot lattice rileva solo tabelle delimitate da linee: servono
+        rettangoli oppure sia linee orizzontali che verticali. Le pagine con
+        sole righe di intestazione/piè di pagina o senza disegni vengono
+        escluse, e un PDF senza griglie non invoca camelot.
+        """
+        table_pages = []
+        for page_index in range(doc.page_count):
+            # get_cdrawings: tuple grezze, senza oggetti Rect/Point per item
+            if self._has_ruling_grid(doc[page_index].get_cdrawings()):
+                table_pages.append(page_index + 1)
+        return table_pages
+
+    def _has_ruling_grid(self, drawings: List[Dict]) -> bool:
+        """Verifica se i disegni della pagina possono formare una griglia"""
+        has_horizontal = False
+        has_vertical = False
+        for drawing in drawings:
+            for item in drawing["items"]:
+                kind = item[0]
+                if kind in ("re", "qu"):
+                    return True
+                if kind != "l":
+                    continue
+                (x0, y0), (x1, y1) = item[1], item[2]
+                if abs(y1 - y0) < 1:
+                    has_horizontal = True
+                elif abs(x1 - x0) < 1:
+                    has_vertical = True
+                if has_horizontal and has_vertical:
+                    return True
+        return False
+
+    def _extract_tables(
+        self,
+        pdf_path: str,
+        sections: List[PDFSection],
+        table_pages: Optional[List[int]] = None,
+    ) -> None:
+        """
+        Estrae tabelle dal PDF e le associa alle sezioni
+
+        Args:
+            pdf_path: Percorso al file PDF
+            sections: Sezioni estratte dal documento
+            table_pages: Pagine (1-based) da analizzare, None per tutte
+        """
+        if table_pages is not None and not table_pages:
+            return  # Nessuna pagina con tabelle con bordi
+
+        # Indice pagina -> sezione per associare le tabelle senza scansioni
+        page_to_section = self._build_page_index(sections)
+
         try:
             # Prova Camelot per tabelle con bordi
-            tables_camelot = camelot.read_pdf(pdf_path, pages="all", flavor="lattice")
+            pages = (
+                ",".join(str(page) for page in table_pages)
+                if table_pages is not None
+                else "all"
+            )
+            tables_camelot = camelot.read_pdf(pdf_path, pages=pages, flavor="lattice")
 
             for table in tables_camelot:
                 table_text = self._table_to_markdown(table.df)
-                page_num = table.parsing_report["page"]
+                page_num = int(table.parsing_report["page"])
 
                 # Trova sezione corrispondente
-                for section in sections:
-                    if section.page_start <= page_num <= section.page_end:
-                        section.tables.append(table_text)
-                        section.content_type = ContentType.TABLE
-                        break
+                section_idx = (
+                    page_to_section[page_num]
+                    if 0 <= page_num < len(page_to_section)
+                    else -1
+                )
+                if section_idx >= 0:
+                    section = sections[section_idx]
+                    section.tables.append(table_text)
+                    section.content_type = ContentType.TABLE
 
         except Exception:
             # Fallback con tabula per tabelle senza bordi
@@ -373,12 +537,28 @@ class PDFParser:
             except Exception:
                 pass  # Ignora errori nell'estrazione tabelle
 
+    def _build_page_index(self, sections: List[PDFSection]) -> List[int]:
+        """
+        Costruisce l'indice pagina (1-based) -> posizione della sezione
+
+        Per le pagine condivise vale la prima sezione; -1 se nessuna sezione.
+        """
+        last_page = max((section.page_end for section in sections), default=0)
+        page_to_section = [-1] * (last_page + 1)
+        for section_idx, section in enumerate(sections):
+            for page_num in range(section.page_start, section.page_end + 1):
+                if page_to_section[page_num] < 0:
+                    page_to_section[page_num] = section_idx
+        return page_to_section
+
     def _table_to_markdown(self, df) -> str:
         """Converte DataFrame in formato Markdown"""
         try:
-            # Pulisci i dati
-            df = df.fillna("")
-            df = df.astype(str)
+            # Pulisci i dati con operazioni vettoriali per colonna
+            df = df.fillna("").astype(str)
+            df = df.apply(
+                lambda col: col.str.strip().str.replace("|", "\\|", regex=False)
+            )
 
             # Converti in Markdown
             markdown_lines = []
@@ -389,11 +569,17 @@ class PDFParser:
                 markdown_lines.append("| " + " | ".join(headers) + " |")
                 markdown_lines.append("| " + " | ".join(["---"] * len(headers)) + " |")
 
-            # Righe
-            for _, row in df.iterrows():
-                cells = [str(cell).strip().replace("|", "\\|") for cell in row]
-                if any(cells):  # Solo se la riga ha contenuto
-                    markdown_lines.append("| " + " | ".join(cells) + " |")
+            if df.shape[1] == 0:
+                return "\n".join(markdown_lines)
+
+            # Solo righe con contenuto
+            df = df[(df != "").any(axis=1)]
+
+            # Righe: concatenazione colonna per colonna invece che cella per cella
+            rows = "| " + df.iloc[:, 0]
+            for i in range(1, df.shape[1]):
+                rows = rows + " | " + df.iloc[:, i]
+            markdown_lines.extend((rows + " |").tolist())
 
             return "\n".join(markdown_lines)
 
@@ -430,3 +616,8 @@ class PDFParser:
             pix = None  # Libera memoria
 
         return images
+
+
+def _parse_pdf_worker(pdf_path: str) -> Tuple[List[PDFSection], Dict]:
+    """Entry point dei processi worker di PDFParser.parse_many"""
+    return PDFParser().parse_from_path(pdf_path)
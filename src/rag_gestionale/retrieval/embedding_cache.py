@@ -0,0 +1,74 @@
+"""
+Cache persistente degli embedding dei chunk su SQLite.
+Evita di ricalcolare gli embedding dei contenuti invariati a ogni
+reindicizzazione. Metodi bloccanti: da eseguire fuori dall'event loop.
+"""
+
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Embedding per hash del testo, separati per modello e configurazione"""
+
+    def __init__(self, path: str, namespace: str):
+        """
+        Args:
+            path: File SQLite della cache
+            namespace: Identifica modello e opzioni di encoding (chiavi
+                diverse se cambiano)
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._namespace = namespace.encode("utf-8") + b"\0"
+        # Connessione condivisa tra i thread dell'executor, serializzata
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+
+    def key(self, text: str) -> bytes:
+        """Chiave del testo nel namespace corrente"""
+        return hashlib.blake2b(
+            self._namespace + text.encode("utf-8"), digest_size=16
+        ).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Embedding presenti in cache per le chiavi richieste"""
+        found: Dict[bytes, np.ndarray] = {}
+        # Sotto il limite di variabili per query di SQLite
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                part = keys[start : start + 500]
+                rows = self._conn.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN "
+                    f"({','.join('?' * len(part))})",
+                    part,
+                )
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def set_many(self, items: Dict[bytes, np.ndarray]) -> None:
+        """Salva gli embedding (float32) in una sola transazione"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [
+                    (key, np.asarray(vector, dtype=np.float32).tobytes())
+                    for key, vector in items.items()
+                ],
+            )
+
+    def close(self) -> None:
+        """Chiude la connessione"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,151 @@
+"""
+Caricamento del modello di embedding.
+Backend PyTorch (FP16 su GPU), OpenVINO con precisione ridotta su CPU Xeon,
+oppure ONNX Runtime con quantizzazione dinamica int8 (CPU), esportata una
+sola volta su disco e verificata rispetto al modello FP32.
+"""
+
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+from sentence_transformers import SentenceTransformer
+
+from ..config.settings import EmbeddingSettings
+
+try:
+    import onnxruntime  # noqa: F401
+    import optimum.onnxruntime  # noqa: F401
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    HAS_ONNX_EXPORT = True
+except ImportError:
+    HAS_ONNX_EXPORT = False
+
+try:
+    import optimum.intel  # noqa: F401
+
+    HAS_OPENVINO = True
+except ImportError:
+    HAS_OPENVINO = False
+
+# Frasi di controllo per confrontare il modello int8 con quello FP32
+_FIDELITY_SENTENCES = (
+    "Come si registra una fattura elettronica passiva?",
+    "Impostare il codice IVA predefinito nell'anagrafica cliente",
+    "Errore E001: partita IVA non valida",
+    "Menu Contabilità > Prima nota > Nuova registrazione",
+    "La procedura di chiusura annuale genera le scritture di assestamento.",
+)
+
+
+def load_embedding_model(
+    settings: EmbeddingSettings, device: str
+) -> SentenceTransformer:
+    """
+    Carica il modello di embedding con il backend configurato
+
+    Args:
+        settings: Configurazione degli embeddings
+        device: Device risolto da get_device()
+
+    Returns:
+        Modello SentenceTransformer (PyTorch se ONNX non è utilizzabile)
+    """
+    if settings.backend == "onnx":
+        if not HAS_ONNX_EXPORT:
+            logger.warning("optimum/onnxruntime non disponibili, uso backend PyTorch")
+        elif device != "cpu":
+            # La quantizzazione dinamica int8 accelera solo su CPU
+            logger.info(f"Backend ONNX int8 ignorato su device={device}")
+        else:
+            try:
+                return _load_onnx_int8(settings)
+            except Exception as e:
+                logger.error(f"Modello ONNX int8 non utilizzabile, uso PyTorch: {e}")
+
+    elif settings.backend == "openvino":
+        if not HAS_OPENVINO:
+            logger.warning("optimum-intel non disponibile, uso backend PyTorch")
+        elif device != "cpu":
+            logger.info(f"Backend OpenVINO ignorato su device={device}")
+        else:
+            # bf16 usa AMX sui Xeon che lo supportano, FP32 altrove
+            return SentenceTransformer(
+                settings.model_name,
+                device="cpu",
+                backend="openvino",
+                model_kwargs={
+                    "ov_config": {
+                        "INFERENCE_PRECISION_HINT": settings.openvino_precision
+                    }
+                },
+            )
+
+    model = SentenceTransformer(settings.model_name, device=device)
+    if device == "cuda" and settings.fp16_on_gpu:
+        # Pesi e calcolo in FP16: metà memoria e tensor core
+        model.half()
+    return model
+
+
+def _load_onnx_int8(settings: EmbeddingSettings) -> SentenceTransformer:
+    """Carica il modello int8, esportandolo al primo utilizzo"""
+    # Una directory per modello: cambiando model_name si riesporta
+    export_dir = Path(settings.onnx_dir) / settings.model_name.replace("/", "--")
+    file_name = f"onnx/model_qint8_{settings.onnx_quantization}.onnx"
+
+    if not (export_dir / file_name).exists():
+        _export_onnx_int8(settings, export_dir, file_name)
+
+    logger.info(f"Caricamento modello embedding ONNX int8: {export_dir / file_name}")
+    return SentenceTransformer(
+        str(export_dir),
+        device="cpu",
+        backend="onnx",
+        model_kwargs={"file_name": file_name},
+    )
+
+
+def _export_onnx_int8(
+    settings: EmbeddingSettings, export_dir: Path, file_name: str
+) -> None:
+    """
+    Esporta il modello in ONNX FP32, lo quantizza in int8 e scarta la
+    quantizzazione se la similarità con FP32 è sotto la soglia
+    """
+    logger.info(
+        f"Esportazione ONNX int8 ({settings.onnx_quantization}) di "
+        f"{settings.model_name} in {export_dir}"
+    )
+    reference = SentenceTransformer(settings.model_name, device="cpu", backend="onnx")
+    reference.save_pretrained(str(export_dir))
+    export_dynamic_quantized_onnx_model(
+        reference, settings.onnx_quantization, str(export_dir)
+    )
+
+    quantized = SentenceTransformer(
+        str(export_dir),
+        device="cpu",
+        backend="onnx",
+        model_kwargs={"file_name": file_name},
+    )
+    fidelity = _min_cosine_similarity(reference, quantized)
+    if fidelity < settings.onnx_min_fidelity:
+        (export_dir / file_name).unlink()
+        raise ValueError(
+            f"similarità int8/FP32 {fidelity:.4f} sotto la soglia "
+            f"{settings.onnx_min_fidelity}"
+        )
+
+    logger.info(f"Modello ONNX int8 esportato (similarità minima {fidelity:.4f})")
+
+
+def _min_cosine_similarity(
+    reference: SentenceTransformer, candidate: SentenceTransformer
+) -> float:
+    """Similarità coseno minima tra gli embedding delle frasi di controllo"""
+    sentences = list(_FIDELITY_SENTENCES)
+    expected = reference.encode(sentences, normalize_embeddings=True)
+    actual = candidate.encode(sentences, normalize_embeddings=True)
+    return float(np.min(np.sum(expected * actual, axis=1)))
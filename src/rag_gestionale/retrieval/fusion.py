@@ -0,0 +1,113 @@
+"""
+Kernel numerici per la fusione degli score (TM2C2).
+Compilati con Numba se disponibile, altrimenti in NumPy vettoriale.
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+try:
+    from numba import njit
+
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+
+def _normalize(scores: np.ndarray) -> np.ndarray:
+    """Scores divisi per il massimo (invariati se il massimo è 0)"""
+    if not scores.size:
+        return scores
+    max_score = scores.max()
+    return scores / (max_score if max_score else 1.0)
+
+
+def _fuse_numpy(
+    vector_scores: np.ndarray,
+    lexical_scores: np.ndarray,
+    groups: np.ndarray,
+    n_groups: int,
+    alpha: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    n_vector = len(vector_scores)
+    scores = np.concatenate(
+        [_normalize(vector_scores) * alpha, _normalize(lexical_scores) * (1.0 - alpha)]
+    )
+    fused = np.bincount(groups, weights=scores, minlength=n_groups)
+    in_vector = np.bincount(groups[:n_vector], minlength=n_groups) > 0
+    in_lexical = np.bincount(groups[n_vector:], minlength=n_groups) > 0
+    return fused, in_vector, in_lexical
+
+
+if HAS_NUMBA:
+    # fastmath senza ninf/nnan: infiniti e NaN restano ben definiti
+    @njit(cache=True, fastmath={"nsz", "arcp", "contract", "reassoc"})
+    def _fuse_numba(vector_scores, lexical_scores, groups, n_groups, alpha):
+        n_vector = vector_scores.shape[0]
+        n_lexical = lexical_scores.shape[0]
+
+        # Massimi dal primo elemento, senza sentinella -inf
+        vector_max = 1.0
+        if n_vector > 0:
+            vector_max = vector_scores[0]
+            for i in range(1, n_vector):
+                vector_max = max(vector_max, vector_scores[i])
+            if vector_max == 0.0:
+                vector_max = 1.0
+
+        lexical_max = 1.0
+        if n_lexical > 0:
+            lexical_max = lexical_scores[0]
+            for i in range(1, n_lexical):
+                lexical_max = max(lexical_max, lexical_scores[i])
+            if lexical_max == 0.0:
+                lexical_max = 1.0
+
+        fused = np.zeros(n_groups)
+        in_vector = np.zeros(n_groups, dtype=np.bool_)
+        in_lexical = np.zeros(n_groups, dtype=np.bool_)
+        vector_weight = alpha / vector_max
+        lexical_weight = (1.0 - alpha) / lexical_max
+
+        for i in range(n_vector):
+            group = groups[i]
+            fused[group] += vector_scores[i] * vector_weight
+            in_vector[group] = True
+        for i in range(n_lexical):
+            group = groups[n_vector + i]
+            fused[group] += lexical_scores[i] * lexical_weight
+            in_lexical[group] = True
+
+        return fused, in_vector, in_lexical
+
+
+def fuse_scores(
+    vector_scores: np.ndarray,
+    lexical_scores: np.ndarray,
+    groups: np.ndarray,
+    n_groups: int,
+    alpha: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fusione TM2C2 con riduzione per chunk
+
+    Args:
+        vector_scores: Scores grezzi della ricerca densa
+        lexical_scores: Scores grezzi della ricerca lessicale
+        groups: Gruppo (chunk) di ogni score, prima i vector poi i lexical
+        n_groups: Numero di chunk distinti
+        alpha: Peso della ricerca densa
+
+    Returns:
+        Score fuso per chunk e maschere di presenza in vector e lexical
+    """
+    if HAS_NUMBA:
+        return _fuse_numba(
+            np.ascontiguousarray(vector_scores, dtype=np.float64),
+            np.ascontiguousarray(lexical_scores, dtype=np.float64),
+            np.ascontiguousarray(groups, dtype=np.int64),
+            n_groups,
+            alpha,
+        )
+    return _fuse_numpy(vector_scores, lexical_scores, groups, n_groups, alpha)
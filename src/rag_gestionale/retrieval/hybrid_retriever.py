@@ -4,42 +4,139 @@ Ottimizzato per query su documentazione di gestionali.
 """
 
 import asyncio
-from typing import Dict, List, Optional, Any, Tuple
-from collections import defaultdict
-
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Any, Tuple, Union
+
+import numpy as np
 from loguru import logger
 from sentence_transformers import CrossEncoder
 
+try:
+    import hyperscan
+
+    HAS_HYPERSCAN = True
+except ImportError:
+    HAS_HYPERSCAN = False
+
+from ..core.cache import TTLCache
 from ..core.models import DocumentChunk, SearchResult, QueryType
 from ..config.settings import get_settings, get_device
 from .vector_store import VectorStore
+from .fusion import fuse_scores
 from .lexical_search import LexicalSearch
+from .onnx_reranker import HAS_ONNXRUNTIME, OnnxCrossEncoder
+
+
+# Codice errore (es. ERR-001): case-sensitive, solo lettere maiuscole
+ERROR_CODE_PATTERN = r"\b[A-Z]{2,4}-?\d{2,4}\b"
+ERROR_CODE_RE = re.compile(ERROR_CODE_PATTERN)
+
+# Query letterali (frase tra virgolette o codice isolato): il ranking
+# lessicale è già ottimale, il reranking non aggiunge informazione
+LITERAL_QUERY_RE = re.compile(r'^\s*(?:"[^"]+"|[A-Z]{2,4}-?\d{2,4})\s*$')
+
+# Pattern per classificazione query, per categoria in ordine di priorità.
+# Ogni pattern è (regex, case_insensitive)
+CLASSIFIER_PATTERNS: Tuple[Tuple[QueryType, Tuple[Tuple[str, bool], ...]], ...] = (
+    (
+        QueryType.ERROR,
+        (
+            (ERROR_CODE_PATTERN, False),
+            (r"\b(?:errore|error|avviso|warning|codice)\b", True),
+            (r"\bnon\s+(?:funziona|va|riesco)\b", True),
+        ),
+    ),
+    (
+        QueryType.PARAMETER,
+        (
+            (r"\b(?:param|impostaz|valori|predefin|default|range)\b", True),
+            (r"\bcome\s+(?:impostare|configurare|settare)\b", True),
+            (r"\bdove\s+(?:trovo|si trova)\b", True),
+            (r"\bvalori?\s+(?:ammessi|possibili|consentiti)\b", True),
+        ),
+    ),
+    (
+        QueryType.PROCEDURE,
+        (
+            (r"\bcome\s+(?:fare|eseguire|effettuare)\b", True),
+            (r"\b(?:procedura|processo|step|passi)\b", True),
+            (r"\bper\s+(?:creare|generare|stampare|inviare)\b", True),
+            # Equivalente lineare di "\s+.*\b": spazi e poi una parola
+            (r"\b(?:configurare|impostare)\s+[^\w\n]*\w", True),
+        ),
+    ),
+)
+
+# Priorità per nome del gruppo nella regex di classificazione
+CLASSIFIER_PRIORITY = {
+    query_type.value: priority
+    for priority, (query_type, _) in enumerate(CLASSIFIER_PATTERNS)
+}
 
 
 class QueryClassifier:
     """Classificatore di query per routing intelligente"""
 
     def __init__(self):
-        # Pattern per classificazione query
-        self.parameter_patterns = [
-            r"\b(?:param|impostaz|valori|predefin|default|range)\b",
-            r"\bcome\s+(?:impostare|configurare|settare)\b",
-            r"\bdove\s+(?:trovo|si trova)\b",
-            r"\bvalori?\s+(?:ammessi|possibili|consentiti)\b",
-        ]
-
-        self.procedure_patterns = [
-            r"\bcome\s+(?:fare|eseguire|effettuare)\b",
-            r"\b(?:procedura|processo|step|passi)\b",
-            r"\bper\s+(?:creare|generare|stampare|inviare)\b",
-            r"\b(?:configurare|impostare)\s+.*\b",
-        ]
-
-        self.error_patterns = [
-            r"\b[A-Z]{2,4}-?\d{2,4}\b",  # Codici errore
-            r"\b(?:errore|error|avviso|warning|codice)\b",
-            r"\bnon\s+(?:funziona|va|riesco)\b",
-        ]
+        # Un'unica regex per tutte le categorie: una sola scansione per query
+        self.pattern = self._compile_classifier()
+
+        # Database Hyperscan (se disponibile): tutti i pattern in un'unica
+        # scansione lineare
+        self._hs_database = self._compile_hyperscan() if HAS_HYPERSCAN else None
+
+    @staticmethod
+    def _compile_classifier() -> re.Pattern:
+        """
+        Compila tutti i pattern in una regex con un gruppo nominato per
+        categoria, in ordine di priorità.
+
+        L'alternanza è in un lookahead, quindi viene provata a ogni posizione
+        e riporta la categoria più prioritaria che corrisponde lì; i gruppi
+        atomici evitano il backtracking dentro ciascuna categoria.
+        """
+        groups = []
+        for query_type, patterns in CLASSIFIER_PATTERNS:
+            alternation = "|".join(
+                f"(?:{pattern})" if case_insensitive else f"(?-i:{pattern})"
+                for pattern, case_insensitive in patterns
+            )
+            groups.append(f"(?P<{query_type.value}>(?>{alternation}))")
+        return re.compile(f"(?=(?:{'|'.join(groups)}))", re.IGNORECASE)
+
+    @staticmethod
+    def _compile_hyperscan():
+        """Compila tutti i pattern in un database Hyperscan in block mode"""
+        expressions, ids, flags = [], [], []
+        for priority, (_, patterns) in enumerate(CLASSIFIER_PATTERNS):
+            for pattern, case_insensitive in patterns:
+                expressions.append(pattern.encode("utf-8"))
+                ids.append(priority)
+                pattern_flags = (
+                    hyperscan.HS_FLAG_UTF8
+                    | hyperscan.HS_FLAG_UCP
+                    | hyperscan.HS_FLAG_SINGLEMATCH
+                )
+                if case_insensitive:
+                    pattern_flags |= hyperscan.HS_FLAG_CASELESS
+                flags.append(pattern_flags)
+
+        try:
+            database = hyperscan.Database(mode=hyperscan.HS_MODE_BLOCK)
+            database.compile(
+                expressions=expressions,
+                ids=ids,
+                elements=len(expressions),
+                flags=flags,
+            )
+            return database
+        except Exception as e:
+            logger.warning(f"Hyperscan non disponibile, uso re: {e}")
+            return None
 
     def classify_query(self, query: str) -> QueryType:
         """
@@ -51,23 +148,101 @@ class QueryClassifier:
         Returns:
             Tipo di query classificato
         """
-        query_lower = query.lower()
+        if self._hs_database is not None:
+            return self._classify_hyperscan(query)
 
-        import re
+        # Categoria più prioritaria tra tutte le posizioni che corrispondono
+        best = len(CLASSIFIER_PATTERNS)
+        for match in self.pattern.finditer(query):
+            best = min(best, CLASSIFIER_PRIORITY[match.lastgroup])
+            if best == 0:
+                break
 
-        # Controlla errori per primi (più specifici)
-        if any(re.search(pattern, query_lower) for pattern in self.error_patterns):
-            return QueryType.ERROR
+        if best == len(CLASSIFIER_PATTERNS):
+            return QueryType.GENERAL
+        return CLASSIFIER_PATTERNS[best][0]
 
-        # Controlla parametri
-        if any(re.search(pattern, query_lower) for pattern in self.parameter_patterns):
-            return QueryType.PARAMETER
+    def _classify_hyperscan(self, query: str) -> QueryType:
+        """Classifica con una sola scansione Hyperscan di tutti i pattern"""
+        matched = set()
 
-        # Controlla procedure
-        if any(re.search(pattern, query_lower) for pattern in self.procedure_patterns):
-            return QueryType.PROCEDURE
+        def on_match(pattern_id, start, end, flags, context):
+            matched.add(pattern_id)
 
-        return QueryType.GENERAL
+        self._hs_database.scan(query.encode("utf-8"), match_event_handler=on_match)
+
+        # La priorità coincide con l'id del pattern (errori prima)
+        if not matched:
+            return QueryType.GENERAL
+        return CLASSIFIER_PATTERNS[min(matched)][0]
+
+
+@dataclass
+class _ScoreBatch:
+    """
+    Vista struct-of-arrays dei candidati per le fasi numeriche (fusione,
+    reranking, diversificazione). I SearchResult sono aggiornati solo in
+    materialize.
+    """
+
+    ids: np.ndarray
+    section_ids: np.ndarray
+    scores: np.ndarray
+    labels: np.ndarray
+    refs: List[SearchResult]
+
+    @classmethod
+    def from_results(
+        cls, results: List[SearchResult], label: str = "Score"
+    ) -> "_ScoreBatch":
+        """Crea il batch da una lista di risultati"""
+        return cls(
+            ids=np.array([r.chunk.metadata.id for r in results], dtype=object),
+            section_ids=_intern_sections(results),
+            scores=np.fromiter(
+                (r.score for r in results), dtype=np.float64, count=len(results)
+            ),
+            labels=np.full(len(results), label, dtype=object),
+            refs=list(results),
+        )
+
+    def __len__(self) -> int:
+        return len(self.refs)
+
+    def take(self, indices: np.ndarray) -> "_ScoreBatch":
+        """Sotto-batch con le posizioni indicate, nell'ordine dato"""
+        return _ScoreBatch(
+            ids=self.ids[indices],
+            section_ids=self.section_ids[indices],
+            scores=self.scores[indices],
+            labels=self.labels[indices],
+            refs=[self.refs[i] for i in indices.tolist()],
+        )
+
+    def materialize(self) -> List[SearchResult]:
+        """Scrive score e spiegazione nei SearchResult e li restituisce"""
+        for result, score, label in zip(
+            self.refs, self.scores.tolist(), self.labels.tolist(), strict=True
+        ):
+            result.score = score
+            result.explanation = f"{label}: {score:.3f}"
+        return list(self.refs)
+
+
+def _intern_sections(results: List[SearchResult]) -> np.ndarray:
+    """
+    Id interi delle sezioni dei risultati, validi all'interno del batch
+    (stessa sezione, stesso id)
+    """
+    section_table: Dict[str, int] = {}
+    section_ids = np.empty(len(results), dtype=np.intp)
+    for i, result in enumerate(results):
+        section_path = result.chunk.metadata.section_path or "unknown"
+        section_id = section_table.get(section_path)
+        if section_id is None:
+            section_id = section_table[section_path] = len(section_table)
+        section_ids[i] = section_id
+    return section_ids
 
 
 class HybridRetriever:
@@ -78,7 +253,23 @@ class HybridRetriever:
         self.vector_store = VectorStore()
         self.lexical_search = LexicalSearch()
         self.query_classifier = QueryClassifier()
-        self.reranker: Optional[CrossEncoder] = None
+        self.reranker: Optional[Union[CrossEncoder, OnnxCrossEncoder]] = None
+        # Boost per tipo di query, calcolati una volta e in sola lettura
+        self._boosts_by_type = self._build_boost_params()
+        # k denso massimo tra i tipi di query (ricerca avviata prima della
+        # classificazione)
+        self._max_k_dense = max(self._get_k_values(t)[0] for t in QueryType)
+        # Ricerche in corso, condivise tra richieste identiche concorrenti
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        # Thread dedicato all'inferenza del reranker, separato dal pool di default
+        self._rerank_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="reranker"
+        )
+        # Scores del reranker per coppia (hash query, id chunk)
+        self._rerank_cache = TTLCache(
+            maxsize=self.settings.retrieval.rerank_cache_size,
+            ttl=self.settings.retrieval.rerank_cache_ttl,
+        )
 
     async def initialize(self):
         """Inizializza tutti i componenti"""
@@ -88,20 +279,38 @@ class HybridRetriever:
 
         # Determina device da utilizzare
         device = get_device()
-        logger.info(
-            f"Caricamento reranker: {self.settings.retrieval.reranker_model} su device={device}"
-        )
-
-        # Carica reranker
-        loop = asyncio.get_event_loop()
-        self.reranker = await loop.run_in_executor(
-            None,
-            lambda: CrossEncoder(
-                self.settings.retrieval.reranker_model,
-                max_length=512,
-                device=device,
-            ),
-        )
+        onnx_path = self.settings.retrieval.reranker_onnx_path
+        if onnx_path and not HAS_ONNXRUNTIME:
+            logger.warning("onnxruntime non disponibile, uso CrossEncoder PyTorch")
+            onnx_path = None
+
+        # Carica reranker (ONNX int8 su CPU se configurato)
+        loop = asyncio.get_running_loop()
+        if onnx_path:
+            logger.info(f"Caricamento reranker ONNX: {onnx_path}")
+            self.reranker = await loop.run_in_executor(
+                self._rerank_executor,
+                lambda: OnnxCrossEncoder(
+                    onnx_path,
+                    self.settings.retrieval.reranker_model,
+                    max_length=self.settings.retrieval.reranker_max_length,
+                    doc_cache_size=self.settings.retrieval.rerank_cache_size,
+                    doc_cache_ttl=self.settings.retrieval.rerank_cache_ttl,
+                ),
+            )
+            device = "cpu"
+        else:
+            logger.info(
+                f"Caricamento reranker: {self.settings.retrieval.reranker_model} su device={device}"
+            )
+            self.reranker = await loop.run_in_executor(
+                self._rerank_executor,
+                lambda: CrossEncoder(
+                    self.settings.retrieval.reranker_model,
+                    max_length=self.settings.retrieval.reranker_max_length,
+                    device=device,
+                ),
+            )
 
         logger.info(f"Hybrid retriever inizializzato (device={device})")
 
@@ -127,37 +336,80 @@ class HybridRetriever:
         if top_k is None:
             top_k = self.settings.retrieval.k_final
 
-        # Classifica query se non specificato
+        # Richieste identiche in corso condividono la stessa ricerca
+        key = (
+            query,
+            top_k,
+            query_type,
+            tuple(
+                sorted((name, repr(value)) for name, value in (filters or {}).items())
+            ),
+        )
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._search(query, top_k, filters, query_type)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # shield: la cancellazione di un chiamante non interrompe gli altri
+        return list(await asyncio.shield(task))
+
+    async def _search(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]],
+        query_type: Optional[QueryType],
+    ) -> List[SearchResult]:
+        """Esegue la ricerca ibrida (classificazione, candidati, fusione, rerank)"""
+        # Classifica query se non specificato, in un thread mentre la ricerca
+        # densa è già in corso (con il k massimo, troncato dopo)
+        vector_task = None
         if query_type is None:
-            query_type = self.query_classifier.classify_query(query)
+            vector_task = asyncio.ensure_future(
+                self.vector_store.search(
+                    query=query, top_k=self._max_k_dense, filters=filters
+                )
+            )
+            try:
+                query_type = await asyncio.to_thread(
+                    self.query_classifier.classify_query, query
+                )
+            except BaseException:
+                vector_task.cancel()
+                raise
 
         logger.debug(f"Query classificata come: {query_type.value}")
 
         # Ottieni candidati da entrambi i sistemi
         vector_results, lexical_results = await self._get_candidates(
-            query, filters, query_type
+            query, filters, query_type, vector_task=vector_task
         )
 
-        # Combina e deduplica risultati
-        combined_results = self._combine_results(vector_results, lexical_results)
+        # Combina e deduplica risultati, limitando ai candidati per il reranking
+        batch = self._combine_results(
+            vector_results,
+            lexical_results,
+            limit=max(self.settings.retrieval.k_rerank, top_k),
+        )
 
         # Log immagini dopo combinazione
-        total_images = sum(len(r.images) for r in combined_results)
+        total_images = sum(len(r.images) for r in batch.refs)
         logger.info(
-            f"Dopo combinazione: {len(combined_results)} risultati con {total_images} immagini totali"
+            f"Dopo combinazione: {len(batch)} risultati con {total_images} immagini totali"
         )
 
-        # Reranking
-        if len(combined_results) > self.settings.retrieval.k_final:
-            reranked_results = await self._rerank_results(query, combined_results)
-        else:
-            reranked_results = combined_results
-
-        # Diversificazione (evita troppi risultati dalla stessa sezione)
-        diversified_results = self._diversify_results(reranked_results)
+        # Reranking (non per lookup letterali, pochi candidati in più o
+        # classifica di fusione già netta)
+        needs_rerank = not self._is_ranking_settled(batch, top_k)
+        if needs_rerank and self._needs_rerank(query, query_type):
+            batch = await self._rerank_results(query, batch)
 
-        # Tronca ai risultati finali
-        final_results = diversified_results[:top_k]
+        # Diversificazione (evita troppi risultati dalla stessa sezione) e
+        # troncamento ai risultati finali
+        final_results = self._diversify_results(batch, top_k).materialize()
 
         # Log immagini finali
         total_images_final = sum(len(r.images) for r in final_results)
@@ -167,23 +419,51 @@ class HybridRetriever:
 
         return final_results
 
+    def _is_ranking_settled(self, batch: _ScoreBatch, top_k: int) -> bool:
+        """Verifica se il reranking non può cambiare in modo utile la classifica"""
+        # Pochi candidati oltre quelli richiesti
+        if len(batch) - top_k <= 2:
+            return True
+        # Distacco ampio tra il primo e l'ultimo dei top_k
+        gap = batch.scores[0] - batch.scores[top_k - 1]
+        return gap > self.settings.retrieval.rerank_skip_gap
+
+    def _needs_rerank(self, query: str, query_type: QueryType) -> bool:
+        """Verifica se la query beneficia del reranking con cross-encoder"""
+        if LITERAL_QUERY_RE.match(query):
+            return False
+        # Query su codici errore specifici: decide il match esatto lessicale
+        if query_type == QueryType.ERROR and ERROR_CODE_RE.search(query):
+            return False
+        return True
+
     async def _get_candidates(
         self,
         query: str,
         filters: Optional[Dict[str, Any]],
         query_type: QueryType,
+        vector_task: Optional[asyncio.Future] = None,
     ) -> Tuple[List[SearchResult], List[SearchResult]]:
-        """Ottiene candidati da vector e lexical search"""
+        """
+        Ottiene candidati da vector e lexical search
+
+        Args:
+            query: Query di ricerca
+            filters: Filtri sui metadati
+            query_type: Tipo di query
+            vector_task: Ricerca densa già avviata con k maggiore o uguale
+        """
 
         # Adatta parametri basati sul tipo di query
         k_dense, k_lexical = self._get_k_values(query_type)
 
         # Esegui ricerche in parallelo
-        vector_task = self.vector_store.search(
-            query=query,
-            top_k=k_dense,
-            filters=filters,
-        )
+        if vector_task is None:
+            vector_task = self.vector_store.search(
+                query=query,
+                top_k=k_dense,
+                filters=filters,
+            )
 
         lexical_task = self.lexical_search.search(
             query=query,
@@ -195,6 +475,7 @@ class HybridRetriever:
         vector_results, lexical_results = await asyncio.gather(
             vector_task, lexical_task
         )
+        vector_results = vector_results[:k_dense]
 
         logger.debug(
             f"Candidati: {len(vector_results)} vector, {len(lexical_results)} lexical"
@@ -220,132 +501,205 @@ class HybridRetriever:
             # Query generali - valori di default
             return base_dense, base_lexical
 
-    def _get_boost_params(self, query_type: QueryType) -> Dict[str, float]:
+    def _get_boost_params(self, query_type: QueryType) -> Mapping[str, float]:
         """Ottiene parametri di boost basati sul tipo di query"""
-        base_boosts = {
-            "title": self.settings.retrieval.title_boost,
-            "breadcrumbs": self.settings.retrieval.breadcrumbs_boost,
-            "param_name": self.settings.retrieval.param_name_boost,
-            "error_code": self.settings.retrieval.error_code_boost,
-        }
-
-        if query_type == QueryType.ERROR:
-            # Boost massimo per codici errore
-            base_boosts["error_code"] *= 2.0
-        elif query_type == QueryType.PARAMETER:
-            # Boost per nomi parametri
-            base_boosts["param_name"] *= 1.5
-        elif query_type == QueryType.PROCEDURE:
-            # Boost per titoli procedurali
-            base_boosts["title"] *= 1.3
-
-        return base_boosts
+        return self._boosts_by_type[query_type]
+
+    def _build_boost_params(self) -> Dict[QueryType, Mapping[str, float]]:
+        """Precalcola i parametri di boost per ogni tipo di query"""
+        boosts_by_type = {}
+        for query_type in QueryType:
+            base_boosts = {
+                "title": self.settings.retrieval.title_boost,
+                "breadcrumbs": self.settings.retrieval.breadcrumbs_boost,
+                "param_name": self.settings.retrieval.param_name_boost,
+                "error_code": self.settings.retrieval.error_code_boost,
+            }
+
+            if query_type == QueryType.ERROR:
+                # Boost massimo per codici errore
+                base_boosts["error_code"] *= 2.0
+            elif query_type == QueryType.PARAMETER:
+                # Boost per nomi parametri
+                base_boosts["param_name"] *= 1.5
+            elif query_type == QueryType.PROCEDURE:
+                # Boost per titoli procedurali
+                base_boosts["title"] *= 1.3
+
+            boosts_by_type[query_type] = MappingProxyType(base_boosts)
+
+        return boosts_by_type
 
     def _combine_results(
-        self, vector_results: List[SearchResult], lexical_results: List[SearchResult]
-    ) -> List[SearchResult]:
-        """Combina e deduplica risultati da vector e lexical"""
-        seen_chunks = {}
-        combined = []
-
-        # Normalizza scores (0-1) per comparabilità
-        max_vector_score = max([r.score for r in vector_results], default=1.0)
-        max_lexical_score = max([r.score for r in lexical_results], default=1.0)
-
-        # Aggiungi risultati vector
-        for result in vector_results:
-            chunk_id = result.chunk.metadata.id
-            normalized_score = result.score / max_vector_score
-            result.score = normalized_score
-            result.explanation = f"Vector: {normalized_score:.3f}"
-
-            seen_chunks[chunk_id] = result
-            combined.append(result)
-
-        # Aggiungi risultati lexical (combina se già visti)
-        for result in lexical_results:
-            chunk_id = result.chunk.metadata.id
-            normalized_score = result.score / max_lexical_score
-
-            if chunk_id in seen_chunks:
-                # Combina scores (media pesata)
-                existing_result = seen_chunks[chunk_id]
-                combined_score = (existing_result.score * 0.6) + (
-                    normalized_score * 0.4
-                )
-                existing_result.score = combined_score
-                existing_result.explanation = f"Hybrid: {combined_score:.3f}"
-
-                # Combina immagini (merge deduplicato per ID)
-                existing_image_ids = {img.get("id") for img in existing_result.images}
-                for img in result.images:
-                    if img.get("id") not in existing_image_ids:
-                        existing_result.images.append(img)
-                        existing_image_ids.add(img.get("id"))
-            else:
-                result.score = normalized_score
-                result.explanation = f"Lexical: {normalized_score:.3f}"
-                seen_chunks[chunk_id] = result
-                combined.append(result)
+        self,
+        vector_results: List[SearchResult],
+        lexical_results: List[SearchResult],
+        limit: Optional[int] = None,
+    ) -> _ScoreBatch:
+        """
+        Combina e deduplica risultati da vector e lexical
 
-        # Ordina per score combinato
-        combined.sort(key=lambda x: x.score, reverse=True)
+        Fusione TM2C2: score normalizzati con minimo teorico 0 e massimo
+        osservato, poi alpha * dense + (1 - alpha) * lexical; uno score
+        mancante vale il minimo teorico.
 
-        return combined
+        Args:
+            vector_results: Risultati della ricerca densa
+            lexical_results: Risultati della ricerca lessicale
+            limit: Numero massimo di risultati da restituire (tutti se None)
+        """
+        alpha = self.settings.retrieval.fusion_alpha
+        candidates = vector_results + lexical_results
+        if not candidates:
+            return _ScoreBatch.from_results([])
+
+        # Gruppi di deduplica per chunk id: first è la prima occorrenza
+        # (il risultato vector per i chunk trovati da entrambi)
+        ids = np.array([result.chunk.metadata.id for result in candidates])
+        _, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+
+        # Normalizza scores (0-1) e somma per chunk
+        n_vector = len(vector_results)
+        fused, in_vector, in_lexical = fuse_scores(
+            self._raw_scores(vector_results),
+            self._raw_scores(lexical_results),
+            inverse,
+            len(first),
+            alpha,
+        )
 
-    async def _rerank_results(
-        self, query: str, results: List[SearchResult]
-    ) -> List[SearchResult]:
-        """Reranking con cross-encoder"""
-        if not self.reranker or len(results) <= 1:
-            return results
-
-        # Prepara coppie query-document per reranker
-        pairs = []
-        for result in results:
-            # Usa titolo + inizio contenuto per reranking
-            doc_text = f"{result.chunk.metadata.title}. {result.chunk.content[:200]}"
-            pairs.append([query, doc_text])
-
-        # Calcola scores di reranking
-        loop = asyncio.get_event_loop()
-        rerank_scores = await loop.run_in_executor(
-            None, lambda: self.reranker.predict(pairs)
+        # Ordina per score combinato, a parità nell'ordine di arrivo
+        selected = np.arange(len(first))
+        if limit is not None and limit < len(first):
+            selected = np.argpartition(-fused, limit - 1)[:limit]
+        selected = selected[np.lexsort((first[selected], -fused[selected]))]
+
+        labels = np.where(
+            in_vector & in_lexical, "Hybrid", np.where(in_vector, "Vector", "Lexical")
+        ).astype(object)
+        refs = []
+        for group in selected.tolist():
+            result = candidates[first[group]]
+            if in_vector[group] and in_lexical[group]:
+                for idx in np.flatnonzero(inverse[n_vector:] == group).tolist():
+                    self._merge_images(result, lexical_results[idx])
+            refs.append(result)
+
+        return _ScoreBatch(
+            ids=ids[first[selected]].astype(object),
+            section_ids=_intern_sections(refs),
+            scores=fused[selected],
+            labels=labels[selected],
+            refs=refs,
         )
 
-        # Aggiorna scores e ordina
-        for i, result in enumerate(results):
-            # Combina score originale con rerank (weighted)
-            original_score = result.score
-            rerank_score = float(rerank_scores[i])
-            combined_score = (original_score * 0.3) + (rerank_score * 0.7)
+    @staticmethod
+    def _raw_scores(results: List[SearchResult]) -> np.ndarray:
+        """Scores dei risultati come array"""
+        return np.fromiter(
+            (result.score for result in results), dtype=np.float64, count=len(results)
+        )
 
-            result.score = combined_score
-            result.explanation = f"Reranked: {combined_score:.3f}"
+    @staticmethod
+    def _merge_images(target: SearchResult, source: SearchResult) -> None:
+        """Combina immagini (merge deduplicato per ID)"""
+        existing_image_ids = {img.get("id") for img in target.images}
+        for img in source.images:
+            if img.get("id") not in existing_image_ids:
+                target.images.append(img)
+                existing_image_ids.add(img.get("id"))
 
-        # Ordina per nuovo score
-        results.sort(key=lambda x: x.score, reverse=True)
+    async def _rerank_results(self, query: str, batch: _ScoreBatch) -> _ScoreBatch:
+        """Reranking con cross-encoder"""
+        if not self.reranker or len(batch) <= 1:
+            return batch
+
+        # Scores già calcolati per la stessa coppia (query, chunk)
+        query_key = hashlib.blake2b(query.encode("utf-8"), digest_size=16).digest()
+        chunk_ids = batch.ids.tolist()
+        rerank_scores = np.empty(len(batch), dtype=np.float64)
+        missing = []
+        for i, chunk_id in enumerate(chunk_ids):
+            cached = self._rerank_cache.get((query_key, chunk_id))
+            if cached is None:
+                missing.append(i)
+            else:
+                rerank_scores[i] = cached
+
+        if missing:
+            # Prepara coppie query-document per reranker
+            pairs = []
+            for i in missing:
+                chunk = batch.refs[i].chunk
+                # Usa titolo + inizio contenuto per reranking
+                doc_text = f"{chunk.metadata.title}. {chunk.content[:200]}"
+                pairs.append([query, doc_text])
+
+            # Ordina le coppie per lunghezza: batch omogenei riducono il padding
+            order = np.argsort([len(q) + len(d) for q, d in pairs], kind="stable")
+            sorted_pairs = [pairs[i] for i in order]
+
+            # Calcola scores di reranking
+            loop = asyncio.get_running_loop()
+            sorted_scores = await loop.run_in_executor(
+                self._rerank_executor,
+                lambda: self.reranker.predict(
+                    sorted_pairs,
+                    batch_size=self.settings.retrieval.rerank_batch_size,
+                    show_progress_bar=False,
+                ),
+            )
+
+            # Riporta gli scores nell'ordine originale dei risultati
+            missing_scores = np.empty(len(pairs), dtype=np.float64)
+            missing_scores[order] = np.asarray(sorted_scores, dtype=np.float64)
+            rerank_scores[missing] = missing_scores
+
+            for i, score in zip(missing, missing_scores.tolist(), strict=True):
+                self._rerank_cache.set((query_key, chunk_ids[i]), score)
+
+        # Combina score di fusione con rerank (weighted) e ordina
+        rerank_weight = self.settings.retrieval.rerank_weight
+        scores = batch.scores * (1.0 - rerank_weight) + rerank_scores * rerank_weight
+        reranked = replace(
+            batch,
+            scores=scores,
+            labels=np.full(len(batch), "Reranked", dtype=object),
+        ).take(np.argsort(-scores, kind="stable"))
 
-        logger.debug(f"Reranking completato su {len(results)} risultati")
-        return results
+        logger.debug(
+            f"Reranking completato su {len(batch)} risultati "
+            f"({len(batch) - len(missing)} da cache)"
+        )
+        return reranked
 
-    def _diversify_results(self, results: List[SearchResult]) -> List[SearchResult]:
+    def _diversify_results(
+        self, batch: _ScoreBatch, top_k: Optional[int] = None
+    ) -> _ScoreBatch:
         """Diversifica risultati per evitare troppi dalla stessa sezione"""
-        diversified = []
-        section_counts = defaultdict(int)
+        if top_k is None:
+            top_k = self.settings.retrieval.k_final
         max_per_section = self.settings.retrieval.diversification_threshold
 
-        for result in results:
-            section_path = result.chunk.metadata.section_path or "unknown"
-
-            if section_counts[section_path] < max_per_section:
-                diversified.append(result)
-                section_counts[section_path] += 1
-            elif len(diversified) < self.settings.retrieval.k_final:
-                # Accetta comunque se non abbiamo abbastanza risultati
-                diversified.append(result)
-
-        return diversified
+        # Id di sezione compattati in 0..n-1: contatori in una lista, senza hash
+        _, local_ids = np.unique(batch.section_ids, return_inverse=True)
+        section_counts = [0] * len(batch)
+        selected = []
+        for i, section_id in enumerate(local_ids.tolist()):
+            count = section_counts[section_id]
+            if count < max_per_section:
+                selected.append(i)
+                section_counts[section_id] = count + 1
+                if len(selected) == top_k:
+                    break
+
+        # Accetta comunque altri risultati se non ne abbiamo abbastanza
+        if len(selected) < top_k:
+            skipped = np.ones(len(batch), dtype=bool)
+            skipped[selected] = False
+            selected.extend(np.flatnonzero(skipped)[: top_k - len(selected)].tolist())
+
+        return batch.take(np.array(selected, dtype=np.intp))
 
     async def add_chunks(self, chunks: List[DocumentChunk]) -> None:
         """Aggiunge chunk a entrambi gli indici"""
@@ -403,6 +757,25 @@ class HybridRetriever:
             chunk = await self.lexical_search.get_chunk_by_id(chunk_id)
         return chunk
 
+    async def get_chunks_by_ids(
+        self, chunk_ids: List[str]
+    ) -> List[Optional[DocumentChunk]]:
+        """
+        Recupera più chunk per ID: una sola richiesta all'indice lessicale,
+        una sola al vector store per quelli mancanti
+        """
+        chunks = await self.lexical_search.get_chunks_by_ids(chunk_ids)
+
+        missing = [i for i, chunk in enumerate(chunks) if chunk is None]
+        if missing:
+            fallback = await self.vector_store.get_chunks_by_ids(
+                [chunk_ids[i] for i in missing]
+            )
+            for i, chunk in zip(missing, fallback, strict=True):
+                chunks[i] = chunk
+
+        return chunks
+
     async def delete_chunk(self, chunk_id: str) -> bool:
         """Elimina chunk da entrambi gli indici"""
         vector_success = await self.vector_store.delete_chunk(chunk_id)
@@ -433,9 +806,35 @@ class HybridRetriever:
             self.vector_store.close(),
             self.lexical_search.close(),
         )
+        self._rerank_executor.shutdown(wait=False)
         logger.info("Hybrid retriever chiuso")
 
 
+# Istanza globale, inizializzata una sola volta (caricamento reranker)
+_retriever: Optional[HybridRetriever] = None
+_retriever_lock = asyncio.Lock()
+
+
+async def get_retriever() -> HybridRetriever:
+    """Factory per retriever condiviso"""
+    global _retriever
+    async with _retriever_lock:
+        if _retriever is None:
+            retriever = HybridRetriever()
+            await retriever.initialize()
+            _retriever = retriever
+    return _retriever
+
+
+async def close_retriever() -> None:
+    """Chiude il retriever condiviso (allo shutdown dell'applicazione)"""
+    global _retriever
+    async with _retriever_lock:
+        if _retriever is not None:
+            await _retriever.close()
+            _retriever = None
+
+
 # Utility function per retrieval rapido
 async def search_documents(
     query: str,
@@ -453,11 +852,5 @@ async def search_documents(
     Returns:
         Lista di risultati
     """
-    retriever = HybridRetriever()
-    await retriever.initialize()
-
-    try:
-        results = await retriever.search(query, top_k, filters)
-        return results
-    finally:
-        await retriever.close()
+    retriever = await get_retriever()
+    return await retriever.search(query, top_k, filters)
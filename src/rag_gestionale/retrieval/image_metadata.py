@@ -0,0 +1,209 @@
+"""
+Metadata delle immagini estratte, letti dal filesystem.
+Funzioni bloccanti (filesystem): da eseguire fuori dall'event loop.
+"""
+
+import functools
+import os
+import re
+import struct
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+from loguru import logger
+
+# Formati cercati, in ordine di preferenza se esistono più file con lo stesso nome
+_IMAGE_EXTENSIONS = ("png", "jpg", "jpeg", "gif", "webp")
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Marker SOF JPEG con le dimensioni (esclusi DHT, JPG e DAC)
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# {source_hash}_img_{idx} (HTML) o {source_hash}_p{page}_i{idx} (PDF)
+_IMAGE_ID_RE = re.compile(
+    r"(?P<hash>[^_]+)_(?:img_(?P<idx>\d+)|p(?P<page>\d+)_i(?P<page_idx>\d+))"
+)
+
+
+def _list_image_dir(source_dir: str) -> Dict[str, str]:
+    """
+    Immagini di una directory per nome senza estensione (una sola scandir
+    invece di un exists() per formato), vuoto se la directory non esiste.
+    Il listing è riusato finché la directory non cambia (st_mtime_ns), anche
+    se le immagini sono salvate da un altro processo; le directory mancanti
+    non vengono memorizzate
+    """
+    try:
+        mtime_ns = os.stat(source_dir).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+        return {}
+    return _scan_image_dir(source_dir, mtime_ns)
+
+
+@functools.lru_cache(maxsize=256)
+def _scan_image_dir(source_dir: str, mtime_ns: int) -> Dict[str, str]:
+    """Listing di una directory alla versione mtime_ns"""
+    files: Dict[str, str] = {}
+    try:
+        with os.scandir(source_dir) as entries:
+            names = [entry.name for entry in entries if entry.is_file()]
+    except (FileNotFoundError, NotADirectoryError):
+        return files
+
+    # Ordinati per formato preferito: vince il primo per ogni nome
+    candidates = []
+    for name in names:
+        stem, _, ext = name.rpartition(".")
+        if stem and ext.lower() in _IMAGE_EXTENSIONS:
+            candidates.append((_IMAGE_EXTENSIONS.index(ext.lower()), stem, name))
+    for _, stem, name in sorted(candidates):
+        files.setdefault(stem, name)
+    return files
+
+
+def clear_image_dir_cache() -> None:
+    """Svuota i listing memorizzati delle directory"""
+    _scan_image_dir.cache_clear()
+
+
+def _parse_jpeg_size(image: BinaryIO) -> Optional[Tuple[int, int]]:
+    """Dimensioni dal primo segmento SOF, saltando gli altri segmenti"""
+    image.seek(2)
+    while True:
+        if image.read(1) != b"\xff":
+            return None
+        # Byte di riempimento 0xFF prima del marker
+        byte = image.read(1)
+        while byte == b"\xff":
+            byte = image.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Marker senza lunghezza
+            continue
+        segment = image.read(2)
+        if len(segment) < 2:
+            return None
+        if marker in _JPEG_SOF_MARKERS:
+            frame = image.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">HH", frame[1:5])
+            return width, height
+        image.seek(struct.unpack(">H", segment)[0] - 2, os.SEEK_CUR)
+
+
+def _parse_webp_size(header: bytes) -> Optional[Tuple[int, int]]:
+    """Dimensioni dal primo chunk WEBP (VP8, VP8L o VP8X)"""
+    chunk = header[12:16]
+    if chunk == b"VP8 " and header[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and header[20:21] == b"\x2f":
+        bits = int.from_bytes(header[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        width = int.from_bytes(header[24:27], "little") + 1
+        height = int.from_bytes(header[27:30], "little") + 1
+        return width, height
+    return None
+
+
+def _parse_image_header(image: BinaryIO) -> Optional[Tuple[int, int, str]]:
+    """
+    Dimensioni e formato dai primi byte del file, riconosciuto dalla firma
+    (PNG, JPEG, GIF, WEBP); None se il formato non è riconosciuto
+    """
+    header = image.read(32)
+    size = None
+    if header.startswith(_PNG_SIGNATURE) and header[12:16] == b"IHDR":
+        size, format_name = struct.unpack(">II", header[16:24]), "png"
+    elif header.startswith(b"\xff\xd8"):
+        size, format_name = _parse_jpeg_size(image), "jpeg"
+    elif header[:6] in (b"GIF87a", b"GIF89a") and len(header) >= 10:
+        size, format_name = struct.unpack("<HH", header[6:10]), "gif"
+    elif header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        size, format_name = _parse_webp_size(header), "webp"
+
+    if not size or min(size) <= 0:
+        return None
+    return size[0], size[1], format_name
+
+
+def _read_image_header(image: BinaryIO, ext: str) -> Tuple[int, int, str]:
+    """
+    Dimensioni e formato dall'intestazione del file aperto, senza
+    inizializzare i decoder; PIL solo per i file non riconosciuti
+    """
+    parsed = _parse_image_header(image)
+    if parsed is not None:
+        return parsed
+
+    from PIL import Image
+
+    image.seek(0)
+    with Image.open(image) as img:
+        width, height = img.size
+        return width, height, img.format.lower() if img.format else ext
+
+
+def load_image_metadata(image_id: str, storage_base: Path) -> Optional[Dict[str, Any]]:
+    """
+    Metadata di una immagine dal filesystem (bloccante)
+
+    Args:
+        image_id: ID immagine (formato: {source_hash}_img_{idx} o {source_hash}_p{page}_i{idx})
+        storage_base: Directory base delle immagini salvate
+
+    Returns:
+        Dizionario con metadata immagine, None se non trovata
+    """
+    try:
+        # Formato HTML: {source_hash}_img_{idx} -> file: img_{idx}.{ext}
+        # Formato PDF: {source_hash}_p{page}_i{idx} -> file: page_{page+1}_img_{idx}.{ext}
+        match = _IMAGE_ID_RE.fullmatch(image_id)
+        if match is None:
+            logger.debug("Formato ID immagine non riconosciuto: {}", image_id)
+            return None
+
+        if match["idx"] is not None:
+            filename_pattern = f"img_{match['idx']}"
+        else:
+            filename_pattern = f"page_{int(match['page']) + 1}_img_{match['page_idx']}"
+
+        # Cerca il file nella directory source_hash
+        source_dir = storage_base / match["hash"]
+        filename = _list_image_dir(str(source_dir)).get(filename_pattern)
+        if filename is None:
+            logger.debug(
+                "Immagine {} non trovata nel filesystem (pattern: {})",
+                image_id,
+                filename_pattern,
+            )
+            return None
+
+        image_file = source_dir / filename
+        ext = filename.rpartition(".")[2].lower()
+        try:
+            # Un solo open: intestazione e dimensione dal descrittore aperto
+            with open(image_file, "rb") as image:
+                file_size = os.fstat(image.fileno()).st_size
+                width, height, format_name = _read_image_header(image, ext)
+
+            return {
+                "id": image_id,
+                "storage_path": str(image_file),
+                "image_url": f"/images/{source_dir.name}/{image_file.name}",
+                "width": width,
+                "height": height,
+                "format": format_name,
+                "file_size_bytes": file_size,
+            }
+        except Exception as img_err:
+            logger.warning(f"Errore lettura immagine {image_file}: {img_err}")
+
+    except Exception as e:
+        logger.warning(f"Errore caricamento metadata immagine {image_id}: {e}")
+
+    return None
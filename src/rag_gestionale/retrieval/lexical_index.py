@@ -0,0 +1,362 @@
+"""
+Configurazione dell'indice lessicale OpenSearch.
+Analyzer italiano, sinonimi, mapping dei campi e conversione dei documenti.
+"""
+
+import functools
+from datetime import datetime
+from typing import Any, Dict, List
+
+from ..core.models import ChunkMetadata, ContentType, DocumentChunk, SourceFormat
+
+# Analyzer italiano personalizzato
+ITALIAN_ANALYZER = {
+    "tokenizer": "standard",
+    "filter": [
+        "italian_elision",  # dell'utente -> utente
+        "lowercase",
+        "asciifolding",  # Rimuove accenti (icu_folding se configurato)
+        "italian_stop",  # Stop words italiane
+        "tech_keywords",  # Termini tecnici esclusi dallo stemming
+        "italian_stemmer",  # Stemming leggero
+    ],
+}
+
+# Stesso analyzer con sinonimi, solo in ricerca e solo sul contenuto: i token
+# indicizzati restano minimi e i sinonimi si aggiornano senza reindicizzare
+ITALIAN_SEARCH_ANALYZER = {
+    "tokenizer": "standard",
+    "filter": ITALIAN_ANALYZER["filter"] + ["custom_synonym"],
+}
+
+# Sinonimi per terminologia gestionale (usati se non è configurato un file
+# di sinonimi sui nodi OpenSearch, vedi opensearch/analysis/it_synonyms.txt)
+CUSTOM_SYNONYMS = (
+    "impostazione,impostaz,settaggio,configurazione,config",
+    "parametro,parametr,opzione,campo",
+    "procedura,processo,guida,istruzione",
+    "errore,error,codice,avviso,warning",
+    "fattura,fatturazione,documento",
+    "cliente,anagrafica,soggetto",
+    "articolo,prodotto,merce",
+    "iva,imposta,aliquota",
+    "contabilita,contabilità,coge",
+    "magazzino,giacenza,stock",
+)
+
+# Configurazione indice; repliche, refresh, BM25, termini tecnici e sinonimi
+# dipendono dai settings e vengono aggiunti da LexicalSearch._build_index_config
+# solo quando l'indice va creato
+INDEX_CONFIG_TEMPLATE: Dict[str, Any] = {
+    "settings": {
+        "number_of_shards": 1,
+        "index": {
+            # Documenti dello stesso modulo contigui nei segmenti: i filtri per
+            # modulo saltano interi blocchi (vale solo per indici ricreati)
+            "sort.field": ["module", "section_level"],
+            "sort.order": ["asc", "asc"],
+        },
+        "analysis": {
+            "analyzer": {
+                "italian_custom": ITALIAN_ANALYZER,
+                "italian_search": ITALIAN_SEARCH_ANALYZER,
+                "exact_match": {
+                    "tokenizer": "keyword",
+                    "filter": ["lowercase"],
+                },
+            },
+            "filter": {
+                # Articoli e preposizioni elisi: lo standard tokenizer non
+                # separa l'apostrofo tra due lettere
+                "italian_elision": {
+                    "type": "elision",
+                    "articles_case": True,
+                    "articles": [
+                        "c",
+                        "l",
+                        "all",
+                        "dall",
+                        "dell",
+                        "nell",
+                        "sull",
+                        "coll",
+                        "pell",
+                        "gl",
+                        "agl",
+                        "dagl",
+                        "degl",
+                        "negl",
+                        "sugl",
+                        "un",
+                        "m",
+                        "t",
+                        "s",
+                        "v",
+                        "d",
+                    ],
+                },
+                "italian_stop": {
+                    "type": "stop",
+                    "stopwords": "_italian_",
+                },
+                "italian_stemmer": {
+                    "type": "stemmer",
+                    "language": "light_italian",
+                },
+            },
+        },
+    },
+    "mappings": {
+        "properties": {
+            "chunk_id": {"type": "keyword"},
+            "title": {
+                "type": "text",
+                # Senza sinonimi: sui campi brevi l'espansione moltiplica le
+                # clausole senza migliorare il recall
+                "analyzer": "italian_custom",
+                "similarity": "title_bm25",
+                "fields": {
+                    "exact": {
+                        "type": "text",
+                        "analyzer": "exact_match",
+                        "similarity": "bm25_no_norm",
+                    }
+                },
+                "boost": 2.0,  # Boost per titoli
+            },
+            "content": {
+                "type": "text",
+                "analyzer": "italian_custom",
+                "search_analyzer": "italian_search",
+            },
+            "breadcrumbs": {
+                "type": "text",
+                "analyzer": "italian_custom",
+                "boost": 1.5,
+            },
+            "param_name": {
+                "type": "text",
+                "analyzer": "exact_match",
+                "similarity": "bm25_no_norm",
+                "boost": 3.0,  # Boost alto per nomi parametri
+            },
+            "error_code": {
+                "type": "keyword",
+                "boost": 4.0,  # Boost massimo per codici errore
+            },
+            "ui_path": {
+                "type": "text",
+                "analyzer": "exact_match",
+                "similarity": "bm25_no_norm",
+                "boost": 2.0,
+            },
+            "content_type": {"type": "keyword"},
+            "module": {"type": "keyword"},
+            "version": {"type": "keyword"},
+            "section_level": {"type": "integer"},
+            "source_url": {"type": "keyword"},
+            "lang": {"type": "keyword"},
+            "updated_at": {"type": "date"},
+        }
+    },
+}
+
+# Search template (Mustache) memorizzato sul cluster: le richieste inviano solo
+# id e parametri. Deve restare allineato a render_search_body
+SEARCH_TEMPLATE_ID = "rag_bm25"
+SEARCH_TEMPLATE_SOURCE = """{
+  "size": {{size}},
+  "_source": {{#toJson}}source{{/toJson}},
+  "track_total_hits": false,{{#early_termination}}
+  "terminate_after": {{terminate_after}},{{/early_termination}}
+  "query": {
+    "bool": {
+      "must": {
+        "dis_max": {
+          "queries": [
+            {
+              "multi_match": {
+                "query": {{#toJson}}query{{/toJson}},
+                "fields": {{#toJson}}fields{{/toJson}},
+                "type": "cross_fields"
+              }
+            }{{#error_code}},
+            {
+              "constant_score": {
+                "filter": {
+                  "term": {"error_code": {{#toJson}}error_code_value{{/toJson}}}
+                },
+                "boost": {{error_code_boost}}
+              }
+            }{{/error_code}}
+          ],
+          "tie_breaker": {{tie_breaker}}
+        }
+      },
+      "filter": {{#toJson}}filters{{/toJson}}
+    }
+  }{{#fuzzy}},
+  "rescore": {
+    "window_size": {{rescore_window}},
+    "query": {
+      "rescore_query": {
+        "multi_match": {
+          "query": {{#toJson}}query{{/toJson}},
+          "fields": {{#toJson}}fuzzy_fields{{/toJson}},
+          "type": "best_fields",
+          "fuzziness": "AUTO",
+          "prefix_length": 2
+        }
+      },
+      "query_weight": 1.0,
+      "rescore_query_weight": {{rescore_weight}}
+    }
+  }{{/fuzzy}}
+}"""
+
+
+def render_search_body(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Corpo della ricerca dai parametri (equivalente al search template)"""
+    # Query multi-field con boost, solo match esatti sui termini
+    queries = [
+        {
+            "multi_match": {
+                "query": params["query"],
+                "fields": params["fields"],
+                "type": "cross_fields",
+            }
+        }
+    ]
+
+    # Query per codici errore (exact match): score costante, senza BM25
+    if params["error_code"]:
+        queries.append(
+            {
+                "constant_score": {
+                    "filter": {"term": {"error_code": params["error_code_value"]}},
+                    "boost": params["error_code_boost"],
+                }
+            }
+        )
+
+    # Combina query: conta la sottoquery migliore, le altre solo col
+    # tie_breaker (niente doppio conteggio codice errore + testo).
+    # Il conteggio totale non è usato: senza, Lucene può saltare interi
+    # blocchi di documenti non competitivi (block-max WAND)
+    search_body = {
+        "track_total_hits": False,
+        "query": {
+            "bool": {
+                "must": {
+                    "dis_max": {
+                        "queries": queries,
+                        "tie_breaker": params["tie_breaker"],
+                    }
+                },
+                "filter": params["filters"],
+            }
+        },
+    }
+
+    # Le hit restano ordinate per score, ma solo tra i documenti raccolti
+    if params["early_termination"]:
+        search_body["terminate_after"] = params["terminate_after"]
+
+    if params["fuzzy"]:
+        search_body["rescore"] = {
+            "window_size": params["rescore_window"],
+            "query": {
+                "rescore_query": {
+                    "multi_match": {
+                        "query": params["query"],
+                        "fields": params["fuzzy_fields"],
+                        "type": "best_fields",
+                        "fuzziness": "AUTO",
+                        "prefix_length": 2,
+                    }
+                },
+                "query_weight": 1.0,
+                "rescore_query_weight": params["rescore_weight"],
+            },
+        }
+
+    return search_body
+
+
+# Lookup dei valori enum memoizzato (pochi tipi di contenuto, uno per hit)
+_content_type = functools.lru_cache(maxsize=32)(ContentType)
+
+
+def _breadcrumbs_from_source(value: Any) -> List[str]:
+    """Breadcrumbs da _source: array, o stringa unita con " > " (indici precedenti)"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return value.split(" > ")
+    return value
+
+
+def chunk_to_document(chunk: DocumentChunk) -> Dict[str, Any]:
+    """Converte chunk in documento OpenSearch"""
+    metadata = chunk.metadata
+    document = {
+        "chunk_id": metadata.id,
+        "title": metadata.title,
+        "content": chunk.content,
+        "content_type": metadata.content_type.value,
+        "module": metadata.module,
+        "version": metadata.version,
+        "section_level": metadata.section_level,
+        "source_url": metadata.source_url,
+        "lang": metadata.lang,
+        "updated_at": metadata.updated_at.isoformat(),
+    }
+
+    # Campi opzionali solo se valorizzati: meno termini e _source più piccolo
+    # (senza dizionari intermedi: la conversione gira per ogni chunk)
+    if metadata.breadcrumbs:
+        # Array: ogni livello è un valore del campo text, senza join/split
+        document["breadcrumbs"] = metadata.breadcrumbs
+    if metadata.param_name:
+        document["param_name"] = metadata.param_name
+    if metadata.error_code:
+        document["error_code"] = metadata.error_code
+    if metadata.ui_path:
+        document["ui_path"] = metadata.ui_path
+    if metadata.image_ids:
+        document["image_ids"] = metadata.image_ids
+
+    return document
+
+
+def document_to_chunk(doc: Dict[str, Any]) -> DocumentChunk:
+    """
+    Converte documento OpenSearch in chunk. I documenti sono scritti da
+    _chunk_to_document con tipi già corretti: model_construct evita la
+    validazione pydantic a ogni hit
+    """
+    metadata = ChunkMetadata.model_construct(
+        id=doc["chunk_id"],
+        title=doc["title"],
+        breadcrumbs=_breadcrumbs_from_source(doc.get("breadcrumbs")),
+        section_level=doc["section_level"],
+        section_path="",  # Non salvato in lexical
+        content_type=_content_type(doc["content_type"]),
+        version=doc["version"],
+        module=doc["module"],
+        param_name=doc.get("param_name"),
+        ui_path=doc.get("ui_path"),
+        error_code=doc.get("error_code"),
+        source_url=doc["source_url"],
+        source_format=SourceFormat.HTML,  # Default
+        lang=doc["lang"],
+        hash="",  # Non necessario per search
+        updated_at=datetime.fromisoformat(doc["updated_at"]),
+        image_ids=doc.get("image_ids", []),
+    )
+
+    return DocumentChunk.model_construct(
+        # Assente con LITE_SOURCE_FIELDS
+        content=doc.get("content", ""),
+        metadata=metadata,
+    )
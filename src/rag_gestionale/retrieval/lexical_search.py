@@ -4,13 +4,112 @@ Ottimizzato per termini tecnici italiani e codici errore.
 """
 
 import asyncio
-from typing import Dict, List, Optional, Any
+import copy
+import functools
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import (
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    Any,
+)
 
 from opensearchpy import AsyncOpenSearch
+from opensearchpy.helpers import async_streaming_bulk
 from loguru import logger
 
+from ..core.cache import TTLCache
 from ..core.models import DocumentChunk, SearchResult
 from ..config.settings import get_settings
+from .image_metadata import load_image_metadata
+from .lexical_index import (
+    CUSTOM_SYNONYMS,
+    INDEX_CONFIG_TEMPLATE,
+    SEARCH_TEMPLATE_ID,
+    SEARCH_TEMPLATE_SOURCE,
+    chunk_to_document,
+    document_to_chunk,
+    render_search_body,
+)
+from .opensearch_client import get_async_client, release_async_client
+
+# Query composta solo da un codice errore (es. E001, ERR-1234)
+# (case-insensitive: la query viene convertita in maiuscolo solo se è un codice)
+_ERROR_CODE_RE = re.compile(r"[A-Z]{1,6}[-_]?\d{2,6}", re.IGNORECASE)
+
+# Sotto questa lunghezza l'espansione fuzzy costa più di quanto recupera
+_MIN_FUZZY_QUERY_LENGTH = 4
+
+# Peso delle sottoquery non migliori nel dis_max
+_DIS_MAX_TIE_BREAKER = 0.1
+
+# Campi letti da document_to_chunk: il resto di _source non viene trasferito
+_SOURCE_FIELDS = (
+    "chunk_id",
+    "title",
+    "content",
+    "breadcrumbs",
+    "param_name",
+    "error_code",
+    "ui_path",
+    "content_type",
+    "module",
+    "version",
+    "section_level",
+    "source_url",
+    "lang",
+    "updated_at",
+    "image_ids",
+)
+# Senza testo e breadcrumbs, per chi usa solo score e metadati (es. fusione
+# senza reranking): il contenuto è la parte più pesante della risposta
+LITE_SOURCE_FIELDS = tuple(
+    field for field in _SOURCE_FIELDS if field not in ("content", "breadcrumbs")
+)
+_SEARCH_FILTER_PATH = "hits.hits._source,hits.hits._score"
+# Shard request cache anche con size > 0 (le query sono deterministiche: niente
+# "now" né random_score), invalidato da OpenSearch a ogni refresh; stessa copia
+# dello shard per richieste uguali, così la cache e la page cache restano calde
+_SEARCH_PREFERENCE = "_local"
+
+# Oltre questa soglia i risultati sono paginati con point-in-time + search_after
+_PAGINATION_THRESHOLD = 1000
+_PAGE_SIZE = 200
+_PIT_KEEP_ALIVE = "1m"
+
+# Soglia minima di terminate_after, se l'interruzione anticipata è attiva
+_MIN_TERMINATE_AFTER = 200
+
+# Errori di indicizzazione conservati (e loggati) per ogni ingestione
+_MAX_LOGGED_BULK_ERRORS = 5
+
+# Ingestioni bulk in corso per indice, condivise tra le istanze: refresh e
+# repliche sono impostazioni dell'indice, ripristinate solo dall'ultima
+_ingest_depths: Dict[str, int] = {}
+_ingest_lock = asyncio.Lock()
+
+
+@functools.lru_cache(maxsize=16)
+def _fields_for_boosts(
+    title: float, breadcrumbs: float, param_name: float
+) -> Tuple[str, ...]:
+    """Campi multi_match con boost (pochi set di boost distinti, memoizzati)"""
+    return (
+        f"title^{title}",
+        "content",
+        f"breadcrumbs^{breadcrumbs}",
+        f"param_name^{param_name}",
+        "ui_path^1.5",
+    )
 
 
 class LexicalSearch:
@@ -20,154 +119,161 @@ class LexicalSearch:
         self.settings = get_settings()
         self.client: Optional[AsyncOpenSearch] = None
         self.index_name = self.settings.lexical_search.index_name
-
-        # Analyzer italiano personalizzato
-        self.italian_analyzer = {
-            "tokenizer": "standard",
-            "filter": [
-                "lowercase",
-                "asciifolding",  # Rimuove accenti
-                "italian_stop",  # Stop words italiane
-                "italian_stemmer",  # Stemming leggero
-                "custom_synonym",  # Sinonimi personalizzati
-            ],
+        # Risultati di ricerca recenti; la generazione cambia a ogni modifica
+        # dell'indice e invalida le voci precedenti
+        self._search_cache = TTLCache(
+            maxsize=self.settings.lexical_search.search_cache_size,
+            ttl=self.settings.lexical_search.search_cache_ttl,
+        )
+        self._generation = 0
+        # Ricerche in corso per chiave: richieste identiche concorrenti
+        # attendono la stessa risposta invece di ripeterla
+        self._inflight_searches: Dict[bytes, asyncio.Future] = {}
+        self._search_template_ready = False
+        # Boost di default dei campi e parametri del rescore, letti una sola
+        # volta dai settings
+        self._default_boosts = {
+            "title": self.settings.retrieval.title_boost,
+            "breadcrumbs": self.settings.retrieval.breadcrumbs_boost,
+            "param_name": self.settings.retrieval.param_name_boost,
+            "error_code": self.settings.retrieval.error_code_boost,
+        }
+        # Campi con i boost di default, immutabili: ricalcolati solo con override
+        self._default_fields = _fields_for_boosts(
+            self._default_boosts["title"],
+            self._default_boosts["breadcrumbs"],
+            self._default_boosts["param_name"],
+        )
+        self._rescore_params = {
+            "rescore_window": self.settings.lexical_search.fuzzy_rescore_window,
+            "rescore_weight": self.settings.lexical_search.fuzzy_rescore_weight,
         }
-
-        # Sinonimi per terminologia gestionale
-        self.custom_synonyms = [
-            "impostazione,impostaz,settaggio,configurazione,config",
-            "parametro,parametr,opzione,campo",
-            "procedura,processo,guida,istruzione",
-            "errore,error,codice,avviso,warning",
-            "fattura,fatturazione,documento",
-            "cliente,anagrafica,soggetto",
-            "articolo,prodotto,merce",
-            "iva,imposta,aliquota",
-            "contabilita,contabilità,coge",
-            "magazzino,giacenza,stock",
-        ]
 
     async def initialize(self):
         """Inizializza il client OpenSearch"""
-        self.client = AsyncOpenSearch(
-            hosts=[
-                {
-                    "host": self.settings.lexical_search.host,
-                    "port": self.settings.lexical_search.port,
-                }
-            ],
-            use_ssl=False,
-            verify_certs=False,
-        )
+        if self.client is None:
+            self.client = await get_async_client()
 
         # Crea indice se non esiste
         await self._ensure_index_exists()
+        await self._ensure_search_template()
 
         logger.info("Lexical search inizializzato")
 
+    async def _ensure_search_template(self) -> None:
+        """Memorizza il search template sul cluster (fallback: query esplicita)"""
+        self._search_template_ready = False
+        if not self.settings.lexical_search.use_search_template:
+            return
+
+        try:
+            await self.client.put_script(
+                id=SEARCH_TEMPLATE_ID,
+                body={"script": {"lang": "mustache", "source": SEARCH_TEMPLATE_SOURCE}},
+            )
+            self._search_template_ready = True
+        except Exception as e:
+            logger.warning(f"Search template non disponibile, uso query esplicita: {e}")
+
     async def _ensure_index_exists(self):
         """Crea l'indice se non esiste"""
         try:
-            exists = await self.client.indices.exists(index=self.index_name)
-            if not exists:
-                # Configurazione indice con analyzer italiano
-                index_config = {
-                    "settings": {
-                        "number_of_shards": 1,
-                        "number_of_replicas": 0,
-                        "index": {
-                            "similarity": {
-                                "default": {
-                                    "type": "BM25",
-                                    "k1": self.settings.lexical_search.bm25_k1,
-                                    "b": self.settings.lexical_search.bm25_b,
-                                }
-                            }
-                        },
-                        "analysis": {
-                            "analyzer": {
-                                "italian_custom": self.italian_analyzer,
-                                "exact_match": {
-                                    "tokenizer": "keyword",
-                                    "filter": ["lowercase"],
-                                },
-                            },
-                            "filter": {
-                                "italian_stop": {
-                                    "type": "stop",
-                                    "stopwords": "_italian_",
-                                },
-                                "italian_stemmer": {
-                                    "type": "stemmer",
-                                    "language": "light_italian",
-                                },
-                                "custom_synonym": {
-                                    "type": "synonym",
-                                    "synonyms": self.custom_synonyms,
-                                },
-                            },
-                        },
+            if await self.client.indices.exists(index=self.index_name):
+                logger.info(f"Indice {self.index_name} già esistente")
+                return
+
+            await self.client.indices.create(
+                index=self.index_name,
+                body=self._build_index_config(),
+            )
+            logger.info(f"Indice {self.index_name} creato")
+
+        except Exception as e:
+            logger.error(f"Errore creazione indice: {e}")
+            raise
+
+    def _build_index_config(self) -> Dict[str, Any]:
+        """Configurazione indice con analyzer italiano e parametri BM25"""
+        lexical_settings = self.settings.lexical_search
+        index_config = copy.deepcopy(INDEX_CONFIG_TEMPLATE)
+        index_settings = index_config["settings"]
+        index_settings["number_of_replicas"] = lexical_settings.replicas
+        index_settings["analysis"]["filter"]["tech_keywords"] = {
+            "type": "keyword_marker",
+            "keywords": [word.lower() for word in lexical_settings.tech_keywords],
+        }
+        index_settings["analysis"]["filter"]["custom_synonym"] = (
+            self._build_synonym_filter()
+        )
+        if lexical_settings.icu_folding:
+            # Richiede il plugin analysis-icu sui nodi
+            for analyzer in ("italian_custom", "italian_search"):
+                filters = index_settings["analysis"]["analyzer"][analyzer]["filter"]
+                filters[filters.index("asciifolding")] = "icu_folding"
+        index_settings["index"].update(
+            {
+                "refresh_interval": lexical_settings.refresh_interval,
+                "similarity": {
+                    "default": {
+                        "type": "BM25",
+                        "k1": lexical_settings.bm25_k1,
+                        "b": lexical_settings.bm25_b,
                     },
-                    "mappings": {
-                        "properties": {
-                            "chunk_id": {"type": "keyword"},
-                            "title": {
-                                "type": "text",
-                                "analyzer": "italian_custom",
-                                "fields": {
-                                    "exact": {
-                                        "type": "text",
-                                        "analyzer": "exact_match",
-                                    }
-                                },
-                                "boost": 2.0,  # Boost per titoli
-                            },
-                            "content": {
-                                "type": "text",
-                                "analyzer": "italian_custom",
-                            },
-                            "breadcrumbs": {
-                                "type": "text",
-                                "analyzer": "italian_custom",
-                                "boost": 1.5,
-                            },
-                            "param_name": {
-                                "type": "text",
-                                "analyzer": "exact_match",
-                                "boost": 3.0,  # Boost alto per nomi parametri
-                            },
-                            "error_code": {
-                                "type": "keyword",
-                                "boost": 4.0,  # Boost massimo per codici errore
-                            },
-                            "ui_path": {
-                                "type": "text",
-                                "analyzer": "exact_match",
-                                "boost": 2.0,
-                            },
-                            "content_type": {"type": "keyword"},
-                            "module": {"type": "keyword"},
-                            "version": {"type": "keyword"},
-                            "section_level": {"type": "integer"},
-                            "source_url": {"type": "keyword"},
-                            "lang": {"type": "keyword"},
-                            "updated_at": {"type": "date"},
-                        }
+                    "title_bm25": {
+                        "type": "BM25",
+                        "k1": lexical_settings.title_bm25_k1,
+                        "b": lexical_settings.title_bm25_b,
+                    },
+                    # Campi quasi-keyword (nomi parametro, percorsi UI): la
+                    # lunghezza non è un segnale, niente normalizzazione
+                    "bm25_no_norm": {
+                        "type": "BM25",
+                        "k1": lexical_settings.bm25_k1,
+                        "b": 0.0,
                     },
-                }
+                },
+            }
+        )
+        return index_config
 
-                await self.client.indices.create(
-                    index=self.index_name,
-                    body=index_config,
-                )
+    def _build_synonym_filter(self) -> Dict[str, Any]:
+        """Filtro sinonimi: da file sui nodi (aggiornabile) o in linea"""
+        synonyms_path = self.settings.lexical_search.synonyms_path
+        if synonyms_path:
+            return {
+                "type": "synonym_graph",
+                "synonyms_path": synonyms_path,
+                "updateable": True,
+                "lenient": True,
+            }
+        return {
+            "type": "synonym_graph",
+            "synonyms": list(CUSTOM_SYNONYMS),
+            "lenient": True,
+        }
 
-                logger.info(f"Indice {self.index_name} creato")
-            else:
-                logger.info(f"Indice {self.index_name} già esistente")
+    async def reload_synonyms(self) -> bool:
+        """
+        Ricarica il file dei sinonimi sui nodi senza reindicizzare
+        (analyzer di ricerca con filtro updateable)
 
+        Returns:
+            True se gli analyzer sono stati ricaricati
+        """
+        if not self.settings.lexical_search.synonyms_path:
+            logger.warning("Nessun file di sinonimi configurato")
+            return False
+
+        try:
+            await self.client.transport.perform_request(
+                "POST", f"/_plugins/_refresh_search_analyzers/{self.index_name}"
+            )
+            self.invalidate()
+            logger.info(f"Sinonimi ricaricati per l'indice {self.index_name}")
+            return True
         except Exception as e:
-            logger.error(f"Errore creazione indice: {e}")
-            raise
+            logger.error(f"Errore ricaricamento sinonimi: {e}")
+            return False
 
     async def add_chunks(self, chunks: List[DocumentChunk]) -> None:
         """
@@ -181,40 +287,158 @@ class LexicalSearch:
 
         logger.info(f"Indicizzazione lessicale di {len(chunks)} chunk")
 
-        # Prepara documenti per bulk insert
-        actions = []
-        for chunk in chunks:
-            doc = self._chunk_to_document(chunk)
-            action = {
-                "_index": self.index_name,
-                "_id": chunk.metadata.id,
-                "_source": doc,
-            }
-            actions.append(action)
+        # Suddivide i chunk tra richieste bulk concorrenti
+        chunk_size = self.settings.lexical_search.bulk_chunk_size
+        n_tasks = min(
+            self.settings.lexical_search.bulk_concurrency,
+            -(-len(chunks) // chunk_size),
+        )
+        part_size = -(-len(chunks) // n_tasks)
+        parts = [
+            chunks[start : start + part_size]
+            for start in range(0, len(chunks), part_size)
+        ]
 
         # Bulk insert
+        await self._enter_ingest_mode()
         try:
-            from opensearchpy.helpers import async_bulk
+            results = await asyncio.gather(*(self._bulk_part(part) for part in parts))
 
-            success, failed = await async_bulk(
-                self.client,
-                actions,
-                chunk_size=100,
-                request_timeout=60,
-            )
-
-            logger.info(f"Indicizzati {success} chunk, {len(failed)} falliti")
+            success = sum(result[0] for result in results)
+            failed = sum(result[1] for result in results)
+            errors = [error for result in results for error in result[2]]
+            logger.info(f"Indicizzati {success} chunk, {failed} falliti")
+            for error in errors[:_MAX_LOGGED_BULK_ERRORS]:
+                logger.warning(f"Errore indicizzazione: {error}")
 
         except Exception as e:
             logger.error(f"Errore bulk insert: {e}")
             raise
+        finally:
+            await self._exit_ingest_mode()
+            self.invalidate()
+
+    async def _enter_ingest_mode(self) -> None:
+        """Attiva la modalità ingestione alla prima ingestione in corso sull'indice"""
+        async with _ingest_lock:
+            depth = _ingest_depths.get(self.index_name, 0) + 1
+            _ingest_depths[self.index_name] = depth
+            if depth == 1:
+                await self._set_ingest_mode(True)
+
+    async def _exit_ingest_mode(self) -> None:
+        """Ripristina l'indice e lo rende ricercabile al termine delle ingestioni"""
+        async with _ingest_lock:
+            depth = _ingest_depths.pop(self.index_name) - 1
+            if depth > 0:
+                _ingest_depths[self.index_name] = depth
+                return
+            await self._set_ingest_mode(False)
+            try:
+                await self.client.indices.refresh(index=self.index_name)
+            except Exception as e:
+                logger.warning(f"Errore refresh indice: {e}")
+
+    async def _set_ingest_mode(self, enabled: bool) -> None:
+        """
+        Modalità ingestione: niente refresh periodico né repliche durante il
+        caricamento bulk, ripristinati alla fine
+        """
+        lexical_settings = self.settings.lexical_search
+        index_settings = {
+            "refresh_interval": "-1" if enabled else lexical_settings.refresh_interval,
+            "number_of_replicas": 0 if enabled else lexical_settings.replicas,
+            # None ripristina il valore di default
+            "translog.flush_threshold_size": "1gb" if enabled else None,
+        }
+        try:
+            await self.client.indices.put_settings(
+                index=self.index_name, body={"index": index_settings}
+            )
+        except Exception as e:
+            logger.warning(f"Errore impostazione modalità ingestione: {e}")
+
+    async def _bulk_part(
+        self, part: List[DocumentChunk]
+    ) -> Tuple[int, int, List[Dict[str, Any]]]:
+        """
+        Indicizza una parte dei chunk in streaming: gli esiti sono contati
+        man mano, conservando solo i primi errori
+
+        Returns:
+            Chunk indicizzati, chunk falliti e campione degli errori
+        """
+        lexical_settings = self.settings.lexical_search
+        success = 0
+        failed = 0
+        errors: List[Dict[str, Any]] = []
+
+        async for ok, item in async_streaming_bulk(
+            self.client,
+            self._iter_actions(part),
+            chunk_size=lexical_settings.bulk_chunk_size,
+            max_chunk_bytes=lexical_settings.bulk_max_chunk_bytes,
+            raise_on_error=False,
+            request_timeout=60,
+        ):
+            if ok:
+                success += 1
+            else:
+                failed += 1
+                if len(errors) < _MAX_LOGGED_BULK_ERRORS:
+                    errors.append(item)
+
+        return success, failed, errors
+
+    async def _iter_actions(
+        self, part: List[DocumentChunk]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Azioni bulk a blocchi di bulk_chunk_size: il blocco successivo si
+        prepara in un thread mentre il precedente è in volo, senza bloccare
+        l'event loop
+        """
+        chunk_size = self.settings.lexical_search.bulk_chunk_size
+        blocks = [
+            part[start : start + chunk_size]
+            for start in range(0, len(part), chunk_size)
+        ]
+
+        pending = asyncio.ensure_future(
+            asyncio.to_thread(self._build_actions, blocks[0])
+        )
+        try:
+            for i in range(len(blocks)):
+                actions = await pending
+                if i + 1 < len(blocks):
+                    pending = asyncio.ensure_future(
+                        asyncio.to_thread(self._build_actions, blocks[i + 1])
+                    )
+                for action in actions:
+                    yield action
+        finally:
+            pending.cancel()
+
+    def _build_actions(self, chunks: List[DocumentChunk]) -> List[Dict[str, Any]]:
+        """Azioni bulk per un blocco di chunk (eseguito fuori dall'event loop)"""
+        index_name = self.index_name
+        to_document = self._chunk_to_document
+        return [
+            {
+                "_index": index_name,
+                "_id": chunk.metadata.id,
+                "_source": to_document(chunk),
+            }
+            for chunk in chunks
+        ]
 
     async def search(
         self,
         query: str,
         top_k: int = 20,
         filters: Optional[Dict[str, Any]] = None,
-        boost_params: Optional[Dict[str, float]] = None,
+        boost_params: Optional[Mapping[str, float]] = None,
+        source_fields: Optional[Sequence[str]] = None,
     ) -> List[SearchResult]:
         """
         Ricerca lessicale con BM25
@@ -224,112 +448,426 @@ class LexicalSearch:
             top_k: Numero di risultati
             filters: Filtri sui metadati
             boost_params: Parametri di boost personalizzati
+            source_fields: Campi di _source da trasferire (default: tutti quelli
+                usati dai chunk; LITE_SOURCE_FIELDS per escludere il testo)
 
         Returns:
             Lista di risultati ordinati per rilevanza BM25
         """
-        # Costruisci query OpenSearch
-        search_body = self._build_search_query(query, filters, boost_params)
-
-        try:
-            response = await self.client.search(
-                index=self.index_name,
-                body=search_body,
-                size=top_k,
+        source = tuple(source_fields) if source_fields else _SOURCE_FIELDS
+        cache_key = self._search_cache_key(query, top_k, filters, boost_params, source)
+        cached = self._search_cache.get(cache_key)
+        if cached is not None:
+            return self._copy_results(cached)
+
+        inflight = self._inflight_searches.get(cache_key)
+        if inflight is None:
+            inflight = asyncio.ensure_future(
+                self._execute_search(
+                    query, top_k, filters, boost_params, source, cache_key
+                )
+            )
+            self._inflight_searches[cache_key] = inflight
+            inflight.add_done_callback(
+                lambda _: self._inflight_searches.pop(cache_key, None)
             )
 
-            # Converte risultati e popola immagini
-            results = []
-            for hit in response["hits"]["hits"]:
-                chunk = self._document_to_chunk(hit["_source"])
+        # shield: la cancellazione di un chiamante non interrompe gli altri
+        return self._copy_results(await asyncio.shield(inflight))
 
-                # Popola immagini se presenti
-                images_data = []
-                if chunk.metadata.image_ids:
-                    logger.info(
-                        f"Chunk {chunk.metadata.id} ha {len(chunk.metadata.image_ids)} image_ids, caricamento metadata..."
+    async def _execute_search(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]],
+        boost_params: Optional[Mapping[str, float]],
+        source: Tuple[str, ...],
+        cache_key: bytes,
+    ) -> List[SearchResult]:
+        """Esegue la ricerca su OpenSearch e salva i risultati in cache"""
+        # Parametri della query OpenSearch
+        # Niente interruzione anticipata con la paginazione: ogni pagina
+        # si fermerebbe prima di arrivare ai risultati successivi
+        params = self._search_params(
+            query,
+            filters,
+            boost_params,
+            top_k=None if top_k > _PAGINATION_THRESHOLD else top_k,
+        )
+
+        try:
+            if top_k > _PAGINATION_THRESHOLD:
+                hits = await self._search_paginated(
+                    render_search_body(params), top_k, source
+                )
+            else:
+                if self._search_template_ready:
+                    # Solo id del template e parametri
+                    response = await self.client.search_template(
+                        index=self.index_name,
+                        body={
+                            "id": SEARCH_TEMPLATE_ID,
+                            "params": {
+                                **params,
+                                "size": top_k,
+                                "source": source,
+                            },
+                        },
+                        filter_path=_SEARCH_FILTER_PATH,
+                        preference=_SEARCH_PREFERENCE,
+                        # Non previsto dal client per i template, ma accettato
+                        # da OpenSearch come per la ricerca normale
+                        params={"request_cache": "true"},
                     )
-                    images_data = await self._load_images_metadata(
-                        chunk.metadata.image_ids
+                else:
+                    response = await self.client.search(
+                        index=self.index_name,
+                        body=render_search_body(params),
+                        size=top_k,
+                        _source_includes=source,
+                        filter_path=_SEARCH_FILTER_PATH,
+                        preference=_SEARCH_PREFERENCE,
+                        request_cache=True,
                     )
-                    logger.info(
-                        f"Caricate {len(images_data)} immagini per chunk {chunk.metadata.id}"
+                # Con filter_path, senza hit la risposta non ha la chiave "hits"
+                hits = response.get("hits", {}).get("hits", [])
+
+            results = (await self._hits_to_results([hits]))[0]
+            self._search_cache.set(cache_key, results)
+            return results
+
+        except Exception as e:
+            logger.error(f"Errore ricerca lessicale: {e}")
+            return []
+
+    async def multi_search(
+        self,
+        queries: List[str],
+        top_k: int = 20,
+        filters: Optional[Dict[str, Any]] = None,
+        boost_params: Optional[Mapping[str, float]] = None,
+    ) -> List[List[SearchResult]]:
+        """
+        Più ricerche lessicali in una sola richiesta _msearch
+
+        Args:
+            queries: Query di ricerca (es. sotto-query o riscritture)
+            top_k: Numero di risultati per query
+            filters: Filtri sui metadati, comuni a tutte le query
+            boost_params: Parametri di boost personalizzati
+
+        Returns:
+            Risultati per query, nello stesso ordine di queries
+        """
+        if top_k > _PAGINATION_THRESHOLD:
+            # La paginazione con point-in-time richiede richieste separate
+            return list(
+                await asyncio.gather(
+                    *(
+                        self.search(query, top_k, filters, boost_params)
+                        for query in queries
                     )
+                )
+            )
 
-                result = SearchResult(
+        results: List[Optional[List[SearchResult]]] = [None] * len(queries)
+        pending: Dict[bytes, List[int]] = {}
+        for position, query in enumerate(queries):
+            cache_key = self._search_cache_key(query, top_k, filters, boost_params)
+            cached = self._search_cache.get(cache_key)
+            if cached is not None:
+                results[position] = self._copy_results(cached)
+            else:
+                # Query ripetute inviate una sola volta
+                pending.setdefault(cache_key, []).append(position)
+
+        if pending:
+            header = {
+                "index": self.index_name,
+                "preference": _SEARCH_PREFERENCE,
+                "request_cache": True,
+            }
+            body: List[Dict[str, Any]] = []
+            for positions in pending.values():
+                search_body = self._build_search_query(
+                    queries[positions[0]], filters, boost_params, top_k
+                )
+                search_body["size"] = top_k
+                search_body["_source"] = list(_SOURCE_FIELDS)
+                body.extend((header, search_body))
+
+            try:
+                response = await self.client.msearch(
+                    body=body,
+                    filter_path=(
+                        "responses.hits.hits._source,"
+                        "responses.hits.hits._score,responses.error"
+                    ),
+                )
+                responses = response.get("responses", [])
+            except Exception as e:
+                logger.error(f"Errore ricerca lessicale multipla: {e}")
+                responses = []
+
+            # Le risposte seguono l'ordine delle richieste
+            hit_lists: List[Optional[List[Dict[str, Any]]]] = []
+            for index in range(len(pending)):
+                item = responses[index] if index < len(responses) else {}
+                if "hits" in item:
+                    hit_lists.append(item["hits"].get("hits", []))
+                elif "error" in item:
+                    logger.error(f"Errore ricerca lessicale multipla: {item['error']}")
+                    hit_lists.append(None)
+                else:
+                    # Senza hit filter_path rimuove "hits"; senza risposta
+                    # (richiesta fallita) il risultato non va in cache
+                    hit_lists.append([] if responses else None)
+
+            converted = await self._hits_to_results([hits or [] for hits in hit_lists])
+            for (cache_key, positions), hits, query_results in zip(
+                pending.items(), hit_lists, converted, strict=True
+            ):
+                # Le risposte in errore non vanno in cache
+                if hits is not None:
+                    self._search_cache.set(cache_key, query_results)
+                for position in positions:
+                    results[position] = self._copy_results(query_results)
+
+        return results
+
+    async def _hits_to_results(
+        self, hit_lists: List[List[Dict[str, Any]]]
+    ) -> List[List[SearchResult]]:
+        """
+        Converte le hit in risultati, caricando le immagini una volta per
+        tutte le liste
+        """
+        chunk_lists = [
+            [self._document_to_chunk(hit["_source"]) for hit in hits]
+            for hits in hit_lists
+        ]
+        images_by_id = await self._load_images_metadata(
+            image_id
+            for chunks in chunk_lists
+            for chunk in chunks
+            for image_id in chunk.metadata.image_ids
+        )
+        result_lists = [
+            [
+                SearchResult(
                     chunk=chunk,
                     score=hit["_score"],
                     explanation=f"BM25 score: {hit['_score']:.3f}",
-                    images=images_data,
+                    images=[
+                        images_by_id[image_id]
+                        for image_id in chunk.metadata.image_ids
+                        if image_id in images_by_id
+                    ],
                 )
-                results.append(result)
+                for hit, chunk in zip(hits, chunks, strict=True)
+            ]
+            for hits, chunks in zip(hit_lists, chunk_lists, strict=True)
+        ]
+        if images_by_id:
+            # Un solo log per conversione, formattato solo se il livello è attivo
+            logger.opt(lazy=True).debug(
+                "Caricati metadata di {} immagini per {}/{} risultati",
+                lambda: len(images_by_id),
+                lambda: sum(
+                    1 for results in result_lists for result in results if result.images
+                ),
+                lambda: sum(len(results) for results in result_lists),
+            )
+        return result_lists
 
-            return results
+    async def _search_paginated(
+        self,
+        search_body: Dict[str, Any],
+        top_k: int,
+        source: Tuple[str, ...] = _SOURCE_FIELDS,
+    ) -> List[Dict[str, Any]]:
+        """
+        Recupera top_k hit a pagine con point-in-time e search_after,
+        evitando una singola coda di priorità di dimensione top_k per shard
+        """
+        pit = await self.client.create_pit(
+            index=self.index_name, keep_alive=_PIT_KEEP_ALIVE
+        )
+        pit_id = pit["pit_id"]
 
-        except Exception as e:
-            logger.error(f"Errore ricerca lessicale: {e}")
-            return []
+        # Il rescore non è compatibile con un sort esplicito
+        body = {key: value for key, value in search_body.items() if key != "rescore"}
+        # chunk_id come spareggio stabile tra score uguali
+        body["sort"] = [{"_score": "desc"}, {"chunk_id": "asc"}]
+
+        hits: List[Dict[str, Any]] = []
+        try:
+            while len(hits) < top_k:
+                body["pit"] = {"id": pit_id, "keep_alive": _PIT_KEEP_ALIVE}
+                size = min(_PAGE_SIZE, top_k - len(hits))
+                response = await self.client.search(
+                    body=body,
+                    size=size,
+                    _source_includes=source,
+                    filter_path=f"{_SEARCH_FILTER_PATH},hits.hits.sort,pit_id",
+                )
+                pit_id = response.get("pit_id", pit_id)
+                page = response.get("hits", {}).get("hits", [])
+                hits.extend(page)
+
+                if len(page) < size:
+                    break
+                body["search_after"] = page[-1]["sort"]
+        finally:
+            try:
+                await self.client.delete_pit(body={"pit_id": [pit_id]})
+            except Exception as e:
+                logger.warning(f"Errore chiusura point-in-time: {e}")
+
+        return hits
+
+    def _search_cache_key(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[Dict[str, Any]],
+        boost_params: Optional[Mapping[str, float]],
+        source: Tuple[str, ...] = _SOURCE_FIELDS,
+    ) -> bytes:
+        """Chiave di cache: query normalizzata, parametri e generazione"""
+        payload = json.dumps(
+            [
+                " ".join(query.lower().split()),
+                top_k,
+                filters or {},
+                dict(boost_params or {}),
+                source,
+                self._generation,
+            ],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+
+    @staticmethod
+    def _copy_results(results: List[SearchResult]) -> List[SearchResult]:
+        """Copie dei risultati: score e immagini vengono modificati a valle"""
+        return [
+            result.model_copy(update={"images": list(result.images)})
+            for result in results
+        ]
+
+    def invalidate(self) -> None:
+        """
+        Invalida i risultati in cache dopo una modifica dell'indice.
+
+        La nuova generazione esclude anche le ricerche in corso, che
+        salveranno i risultati con la chiave precedente.
+        """
+        self._generation += 1
+        self._search_cache.clear()
 
     async def get_chunk_by_id(self, chunk_id: str) -> Optional[DocumentChunk]:
         """Recupera chunk per ID"""
+        return (await self.get_chunks_by_ids([chunk_id]))[0]
+
+    async def get_chunks_by_ids(
+        self, chunk_ids: List[str]
+    ) -> List[Optional[DocumentChunk]]:
+        """
+        Recupera più chunk con una sola richiesta mget
+
+        Args:
+            chunk_ids: ID dei chunk da recuperare
+
+        Returns:
+            Chunk nello stesso ordine degli ID (None se non trovato)
+        """
+        if not chunk_ids:
+            return []
+
         try:
-            response = await self.client.get(
+            response = await self.client.mget(
                 index=self.index_name,
-                id=chunk_id,
+                body={"ids": chunk_ids},
+                _source_includes=_SOURCE_FIELDS,
             )
-            return self._document_to_chunk(response["_source"])
+            return [
+                self._document_to_chunk(doc["_source"]) if doc.get("found") else None
+                for doc in response["docs"]
+            ]
 
         except Exception as e:
-            logger.debug(f"Chunk {chunk_id} non trovato: {e}")
-            return None
+            logger.error(f"Errore recupero di {len(chunk_ids)} chunk: {e}")
+            return [None] * len(chunk_ids)
 
     async def delete_chunk(self, chunk_id: str) -> bool:
         """Elimina chunk per ID"""
         try:
+            # Refresh immediato: con wait_for si attenderebbe fino al prossimo
+            # refresh periodico. La cache si invalida solo a chunk non più
+            # ricercabile, altrimenti una ricerca concorrente lo rimetterebbe
+            # in cache
             await self.client.delete(
                 index=self.index_name,
                 id=chunk_id,
+                refresh=True,
             )
+            self.invalidate()
             return True
         except Exception as e:
             logger.error(f"Errore eliminazione chunk {chunk_id}: {e}")
             return False
 
-    async def delete_chunks_by_url(self, source_url: str) -> int:
+    async def delete_chunks_by_url(
+        self, source_url: str, wait: bool = True
+    ) -> Union[int, str]:
         """
-        Elimina tutti i chunk di un URL sorgente
+        Elimina tutti i chunk di un URL sorgente con una sola delete_by_query
 
         Args:
             source_url: URL sorgente dei chunk da eliminare
+            wait: Se False la cancellazione prosegue in background come task
+                OpenSearch e non si attende il conteggio; fino al termine del
+                task e al refresh successivo le ricerche (e la cache) possono
+                ancora restituire i chunk eliminati
 
         Returns:
-            Numero di chunk eliminati
+            Numero di chunk eliminati, o ID del task se wait è False
         """
         try:
-            # Prima conta quanti documenti verranno eliminati
-            count_query = {"query": {"term": {"source_url": source_url}}}
-
-            count_result = await self.client.count(
-                index=self.index_name, body=count_query
+            # Suddivisa per shard; i documenti modificati nel frattempo sono saltati.
+            # Se attesa, un solo refresh a fine cancellazione la rende visibile
+            # alle ricerche prima dell'invalidazione della cache
+            result = await self.client.delete_by_query(
+                index=self.index_name,
+                body={"query": {"term": {"source_url": source_url}}},
+                slices="auto",
+                conflicts="proceed",
+                wait_for_completion=wait,
+                refresh=wait,
             )
 
-            deleted_count = count_result.get("count", 0)
-
-            if deleted_count > 0:
-                # Elimina tutti i documenti che corrispondono
-                delete_query = {"query": {"term": {"source_url": source_url}}}
-
-                result = await self.client.delete_by_query(
-                    index=self.index_name, body=delete_query
+            if not wait:
+                task_id = result.get("task", "")
+                # Scarta solo i risultati già in cache, non garantisce
+                # l'assenza dei chunk nelle ricerche successive
+                self.invalidate()
+                logger.info(
+                    f"Eliminazione chunk per URL {source_url} avviata (task {task_id})"
                 )
+                return task_id
 
-                logger.info(f"Eliminati {deleted_count} chunk per URL: {source_url}")
+            deleted_count = result.get("deleted", 0)
+            if deleted_count > 0:
+                self.invalidate()
+                logger.info(f"Eliminati {deleted_count} chunk per URL {source_url}")
 
             return deleted_count
 
         except Exception as e:
             logger.error(f"Errore eliminazione chunk per URL {source_url}: {e}")
-            return 0
+            return 0 if wait else ""
 
     async def get_index_stats(self) -> Dict[str, Any]:
         """Statistiche dell'indice"""
@@ -356,224 +894,105 @@ class LexicalSearch:
                 "error": str(e),
             }
 
-    def _chunk_to_document(self, chunk: DocumentChunk) -> Dict[str, Any]:
-        """Converte chunk in documento OpenSearch"""
-        metadata = chunk.metadata
-        return {
-            "chunk_id": metadata.id,
-            "title": metadata.title,
-            "content": chunk.content,
-            "breadcrumbs": " > ".join(metadata.breadcrumbs),
-            "param_name": metadata.param_name,
-            "error_code": metadata.error_code,
-            "ui_path": metadata.ui_path,
-            "content_type": metadata.content_type.value,
-            "module": metadata.module,
-            "version": metadata.version,
-            "section_level": metadata.section_level,
-            "source_url": metadata.source_url,
-            "lang": metadata.lang,
-            "updated_at": metadata.updated_at.isoformat(),
-            "image_ids": metadata.image_ids or [],
-        }
-
-    def _document_to_chunk(self, doc: Dict[str, Any]) -> DocumentChunk:
-        """Converte documento OpenSearch in chunk"""
-        from ..core.models import ChunkMetadata, ContentType, SourceFormat
-        from datetime import datetime
-
-        metadata = ChunkMetadata(
-            id=doc["chunk_id"],
-            title=doc["title"],
-            breadcrumbs=doc["breadcrumbs"].split(" > ")
-            if doc.get("breadcrumbs")
-            else [],
-            section_level=doc["section_level"],
-            section_path="",  # Non salvato in lexical
-            content_type=ContentType(doc["content_type"]),
-            version=doc["version"],
-            module=doc["module"],
-            param_name=doc.get("param_name"),
-            ui_path=doc.get("ui_path"),
-            error_code=doc.get("error_code"),
-            source_url=doc["source_url"],
-            source_format=SourceFormat.HTML,  # Default
-            lang=doc["lang"],
-            hash="",  # Non necessario per search
-            updated_at=datetime.fromisoformat(doc["updated_at"]),
-            image_ids=doc.get("image_ids", []),
-        )
+    # Conversioni definite accanto al mapping dell'indice
+    _chunk_to_document = staticmethod(chunk_to_document)
+    _document_to_chunk = staticmethod(document_to_chunk)
 
-        return DocumentChunk(
-            content=doc["content"],
-            metadata=metadata,
-        )
-
-    async def _load_images_metadata(self, image_ids: List[str]) -> List[Dict[str, Any]]:
+    async def _load_images_metadata(
+        self, image_ids: Iterable[str]
+    ) -> Dict[str, Dict[str, Any]]:
         """
-        Carica metadata delle immagini partendo dagli ID
+        Carica in parallelo i metadata delle immagini partendo dagli ID
 
         Args:
-            image_ids: Lista di ID immagini (formato: {source_hash}_img_{idx} o {source_hash}_p{page}_i{idx})
+            image_ids: ID immagini (anche ripetuti tra più chunk)
 
         Returns:
-            Lista di dizionari con metadata immagini
+            Metadata per ID, solo per le immagini trovate
         """
-        from pathlib import Path
-        from PIL import Image
-
-        images_data = []
-
         if not self.settings.image_storage.enabled:
-            return images_data
+            return {}
 
+        # Filesystem e PIL fuori dall'event loop, una volta per ID
         storage_base = Path(self.settings.image_storage.storage_base_path)
-
-        for image_id in image_ids:
-            try:
-                # Estrai source_hash e filename dall'ID
-                # Formato HTML: {source_hash}_img_{idx} -> file: img_{idx}.{ext}
-                # Formato PDF: {source_hash}_p{page}_i{idx} -> file: page_{page}_img_{idx}.{ext}
-                parts = image_id.split("_", 1)
-                if len(parts) < 2:
-                    logger.debug(f"Formato ID immagine non valido: {image_id}")
-                    continue
-
-                source_hash = parts[0]
-                remaining = parts[1]
-
-                # Determina il pattern del filename
-                if remaining.startswith("img_"):
-                    # Formato HTML: img_{idx}
-                    idx = remaining.split("_")[1]
-                    filename_pattern = f"img_{idx}"
-                elif remaining.startswith("p") and "_i" in remaining:
-                    # Formato PDF: p{page}_i{idx} -> page_{page}_img_{idx}
-                    page_part, idx_part = remaining.split("_i", 1)
-                    page_num = page_part[1:]  # Rimuove 'p'
-                    filename_pattern = f"page_{int(page_num) + 1}_img_{idx_part}"
-                else:
-                    logger.debug(f"Formato ID immagine non riconosciuto: {image_id}")
-                    continue
-
-                # Cerca il file nella directory source_hash
-                source_dir = storage_base / source_hash
-                if not source_dir.exists() or not source_dir.is_dir():
-                    logger.debug(
-                        f"Directory {source_hash} non trovata per immagine {image_id}"
-                    )
-                    continue
-
-                # Cerca file con questo pattern (diversi formati possibili)
-                found = False
-                for ext in ["png", "jpg", "jpeg", "gif", "webp"]:
-                    image_file = source_dir / f"{filename_pattern}.{ext}"
-                    if image_file.exists():
-                        # Ricostruisci metadata base dall'immagine
-                        try:
-                            with Image.open(image_file) as img:
-                                width, height = img.size
-                                format_name = img.format.lower() if img.format else ext
-
-                            image_data = {
-                                "id": image_id,
-                                "storage_path": str(image_file),
-                                "image_url": f"/images/{source_dir.name}/{image_file.name}",
-                                "width": width,
-                                "height": height,
-                                "format": format_name,
-                                "file_size_bytes": image_file.stat().st_size,
-                            }
-                            images_data.append(image_data)
-                            found = True
-                            break
-                        except Exception as img_err:
-                            logger.warning(
-                                f"Errore lettura immagine {image_file}: {img_err}"
-                            )
-
-                if not found:
-                    logger.debug(
-                        f"Immagine {image_id} non trovata nel filesystem (pattern: {filename_pattern})"
-                    )
-
-            except Exception as e:
-                logger.warning(f"Errore caricamento metadata immagine {image_id}: {e}")
-                continue
-
-        return images_data
+        unique_ids = list(dict.fromkeys(image_ids))
+        loaded = await asyncio.gather(
+            *(
+                asyncio.to_thread(load_image_metadata, image_id, storage_base)
+                for image_id in unique_ids
+            )
+        )
+        return {
+            image_id: image_data
+            for image_id, image_data in zip(unique_ids, loaded, strict=True)
+            if image_data is not None
+        }
 
     def _build_search_query(
         self,
         query: str,
         filters: Optional[Dict[str, Any]] = None,
-        boost_params: Optional[Dict[str, float]] = None,
+        boost_params: Optional[Mapping[str, float]] = None,
+        top_k: Optional[int] = None,
     ) -> Dict[str, Any]:
         """Costruisce query OpenSearch"""
-        # Boost di default
-        default_boosts = {
-            "title": self.settings.retrieval.title_boost,
-            "breadcrumbs": self.settings.retrieval.breadcrumbs_boost,
-            "param_name": self.settings.retrieval.param_name_boost,
-            "error_code": self.settings.retrieval.error_code_boost,
-        }
+        return render_search_body(
+            self._search_params(query, filters, boost_params, top_k)
+        )
 
+    def _search_params(
+        self,
+        query: str,
+        filters: Optional[Dict[str, Any]] = None,
+        boost_params: Optional[Mapping[str, float]] = None,
+        top_k: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Parametri della query, condivisi da search template e query esplicita.
+        Con top_k e terminate_after_factor configurato, ogni shard smette di
+        raccogliere documenti oltre max(200, top_k * fattore)
+        """
+        boosts = self._default_boosts
+        fields = self._default_fields
         if boost_params:
-            default_boosts.update(boost_params)
-
-        # Query multi-field con boost
-        multi_match = {
-            "multi_match": {
-                "query": query,
-                "fields": [
-                    f"title^{default_boosts['title']}",
-                    f"content",
-                    f"breadcrumbs^{default_boosts['breadcrumbs']}",
-                    f"param_name^{default_boosts['param_name']}",
-                    f"ui_path^1.5",
-                ],
-                "type": "best_fields",
-                "fuzziness": "AUTO",
-            }
-        }
-
-        # Query per codici errore (exact match)
-        error_code_query = {
-            "term": {
-                "error_code": {
-                    "value": query.upper(),
-                    "boost": default_boosts["error_code"],
-                }
-            }
-        }
-
-        # Combina query
-        bool_query = {
-            "bool": {
-                "should": [multi_match, error_code_query],
-                "minimum_should_match": 1,
-            }
-        }
-
-        # Aggiungi filtri
-        if filters:
-            filter_clauses = []
-            for field, value in filters.items():
-                if value:
-                    filter_clauses.append({"term": {field: value}})
+            boosts = {**boosts, **boost_params}
+            fields = _fields_for_boosts(
+                boosts["title"], boosts["breadcrumbs"], boosts["param_name"]
+            )
 
-            if filter_clauses:
-                bool_query["bool"]["filter"] = filter_clauses
+        stripped = query.strip()
+        is_error_code = _ERROR_CODE_RE.fullmatch(stripped) is not None
+        factor = self.settings.lexical_search.terminate_after_factor
+        terminate_after = (
+            max(_MIN_TERMINATE_AFTER, top_k * factor) if factor and top_k else 0
+        )
 
-        # Query body (BM25 viene configurato a livello di indice)
-        search_body = {
-            "query": bool_query,
+        return {
+            "query": query,
+            "fields": fields,
+            # Fuzzy solo su titolo e contenuto, non sui campi quasi-keyword
+            "fuzzy_fields": fields[:2],
+            "tie_breaker": _DIS_MAX_TIE_BREAKER,
+            # Term sul codice errore solo se la query è un codice
+            "error_code": is_error_code,
+            "error_code_value": stripped.upper() if is_error_code else "",
+            "error_code_boost": boosts["error_code"],
+            "filters": [
+                {"term": {field: value}} for field, value in filters.items() if value
+            ]
+            if filters
+            else [],
+            # Fuzzy (Levenshtein) solo sui primi risultati, non sull'intero indice,
+            # e mai sui codici errore (un refuso è un altro codice)
+            "fuzzy": len(stripped) >= _MIN_FUZZY_QUERY_LENGTH and not is_error_code,
+            "early_termination": terminate_after > 0,
+            "terminate_after": terminate_after,
+            **self._rescore_params,
         }
 
-        return search_body
-
     async def close(self):
         """Chiude connessione"""
         if self.client:
-            await self.client.close()
+            self.client = None
+            await release_async_client()
         logger.info("Lexical search chiuso")
@@ -0,0 +1,164 @@
+"""
+Reranker cross-encoder eseguito con ONNX Runtime.
+Carica un modello esportato in ONNX e quantizzato int8, esponendo la stessa
+interfaccia di predict di CrossEncoder.
+"""
+
+from typing import Dict, List, Sequence
+
+import numpy as np
+from loguru import logger
+
+from ..core.cache import TTLCache
+
+try:
+    import onnxruntime as ort
+
+    HAS_ONNXRUNTIME = True
+except ImportError:
+    HAS_ONNXRUNTIME = False
+
+
+class OnnxCrossEncoder:
+    """Cross-encoder su ONNX Runtime (CPU) con tokenizer Rust di HuggingFace"""
+
+    def __init__(
+        self,
+        model_path: str,
+        tokenizer_name: str,
+        max_length: int = 256,
+        doc_cache_size: int = 10_000,
+        doc_cache_ttl: float = 900.0,
+    ):
+        """
+        Args:
+            model_path: Percorso del modello ONNX (tipicamente int8)
+            tokenizer_name: Modello HuggingFace da cui caricare il tokenizer
+            max_length: Lunghezza massima in token di una coppia
+            doc_cache_size: Documenti tokenizzati mantenuti in cache
+            doc_cache_ttl: Validità della cache dei documenti (secondi)
+        """
+        if not HAS_ONNXRUNTIME:
+            raise ImportError("onnxruntime non installato (extra 'onnx')")
+
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_pretrained(tokenizer_name)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.pad_id = _resolve_pad_id(self.tokenizer)
+        # Il padding è fatto per batch in predict
+        self.tokenizer.no_padding()
+        # Tokenizzazione lato documento, riusata tra query diverse
+        self._doc_cache = TTLCache(maxsize=doc_cache_size, ttl=doc_cache_ttl)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+        logger.info(f"Reranker ONNX caricato da {model_path}")
+
+    def predict(
+        self,
+        pairs: Sequence[Sequence[str]],
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        """Calcola gli scores di rilevanza (sigmoide dei logits, come CrossEncoder)"""
+        encodings = self._encode_pairs(pairs)
+
+        logits: List[np.ndarray] = []
+        for start in range(0, len(encodings), batch_size):
+            encoded = _pad_batch(encodings[start : start + batch_size], self.pad_id)
+            feeds = {
+                name: encoded[name] for name in self.input_names if name in encoded
+            }
+            output = self.session.run(None, feeds)[0]
+            logits.append(np.asarray(output).reshape(len(feeds["input_ids"]), -1)[:, 0])
+
+        if not logits:
+            return np.empty(0, dtype=np.float32)
+
+        return 1.0 / (1.0 + np.exp(-np.concatenate(logits)))
+
+    def _encode_pairs(self, pairs: Sequence[Sequence[str]]) -> List:
+        """Codifica le coppie riusando la tokenizzazione già calcolata dei documenti"""
+        doc_encodings = {}
+        missing_docs = []
+        for _, doc in pairs:
+            if doc in doc_encodings:
+                continue
+            cached = self._doc_cache.get(doc)
+            doc_encodings[doc] = cached
+            if cached is None:
+                missing_docs.append(doc)
+
+        # Documenti nuovi in un'unica chiamata (Rust, senza GIL)
+        if missing_docs:
+            new_encodings = self.tokenizer.encode_batch(
+                missing_docs, add_special_tokens=False
+            )
+            for doc, encoding in zip(missing_docs, new_encodings, strict=True):
+                doc_encodings[doc] = encoding
+                self._doc_cache.set(doc, encoding)
+
+        # Unione query + documento con token speciali e troncamento della coppia
+        query_encodings = {}
+        encodings = []
+        for query, doc in pairs:
+            if query not in query_encodings:
+                query_encodings[query] = self.tokenizer.encode(
+                    query, add_special_tokens=False
+                )
+            encodings.append(
+                self.tokenizer.post_process(query_encodings[query], doc_encodings[doc])
+            )
+
+        return encodings
+
+
+def _resolve_pad_id(tokenizer) -> int:
+    """Id del token di padding definito dal tokenizer"""
+    if tokenizer.padding:
+        return tokenizer.padding["pad_id"]
+    for token in ("<pad>", "[PAD]"):
+        token_id = tokenizer.token_to_id(token)
+        if token_id is not None:
+            return token_id
+    return 0
+
+
+def _pad_batch(encodings: Sequence, pad_id: int) -> Dict[str, np.ndarray]:
+    """Tensori int64 di un batch, con padding alla sequenza più lunga"""
+    width = max(len(encoding.ids) for encoding in encodings)
+    input_ids = np.full((len(encodings), width), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+    token_type_ids = np.zeros((len(encodings), width), dtype=np.int64)
+
+    for row, encoding in enumerate(encodings):
+        length = len(encoding.ids)
+        input_ids[row, :length] = encoding.ids
+        attention_mask[row, :length] = encoding.attention_mask
+        token_type_ids[row, :length] = encoding.type_ids
+
+    return {
+        "input_ids": input_ids,
+        "attention_mask": attention_mask,
+        "token_type_ids": token_type_ids,
+    }
+
+
+def quantize_reranker(onnx_path: str, output_path: str) -> None:
+    """
+    Quantizzazione dinamica int8 di un reranker esportato in ONNX.
+
+    L'export si esegue una tantum con:
+        optimum-cli export onnx --model BAAI/bge-reranker-large \
+            --task text-classification out/
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QInt8)
+    logger.info(f"Reranker quantizzato int8 salvato in {output_path}")
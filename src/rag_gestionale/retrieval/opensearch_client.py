@@ -0,0 +1,84 @@
+"""
+Client OpenSearch condiviso tra i componenti della ricerca lessicale.
+"""
+
+import asyncio
+from typing import Any, Optional
+
+from opensearchpy import AsyncOpenSearch
+from opensearchpy.exceptions import SerializationError
+from opensearchpy.serializer import JSONSerializer
+
+from ..config.settings import get_settings
+
+try:
+    import orjson
+
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+class OrjsonSerializer(JSONSerializer):
+    """Serializer OpenSearch basato su orjson (richieste bulk e risposte)"""
+
+    def dumps(self, data: Any) -> Any:
+        # Le stringhe (es. righe NDJSON già pronte) passano invariate
+        if isinstance(data, str):
+            return data
+
+        try:
+            return orjson.dumps(
+                data,
+                default=self.default,
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+            ).decode("utf-8")
+        except (TypeError, ValueError) as e:
+            raise SerializationError(data, e) from e
+
+    def loads(self, s: str) -> Any:
+        try:
+            return orjson.loads(s)
+        except (TypeError, ValueError) as e:
+            raise SerializationError(s, e) from e
+
+
+# Client condiviso tra le istanze: un solo pool di connessioni riusato
+_client: Optional[AsyncOpenSearch] = None
+_client_refs = 0
+_client_lock = asyncio.Lock()
+
+
+async def get_async_client() -> AsyncOpenSearch:
+    """Factory per client OpenSearch condiviso"""
+    global _client, _client_refs
+    async with _client_lock:
+        if _client is None:
+            settings = get_settings()
+            _client = AsyncOpenSearch(
+                hosts=[
+                    {
+                        "host": settings.lexical_search.host,
+                        "port": settings.lexical_search.port,
+                    }
+                ],
+                use_ssl=False,
+                verify_certs=False,
+                maxsize=settings.lexical_search.pool_maxsize,
+                http_compress=True,
+                retry_on_timeout=True,
+                max_retries=3,
+                serializer=OrjsonSerializer() if HAS_ORJSON else JSONSerializer(),
+            )
+        _client_refs += 1
+        return _client
+
+
+async def release_async_client() -> None:
+    """Rilascia il client condiviso, chiudendolo all'ultimo rilascio"""
+    global _client, _client_refs
+    async with _client_lock:
+        _client_refs = max(_client_refs - 1, 0)
+        if _client_refs == 0 and _client is not None:
+            await _client.close()
+            _client = None
@@ -4,8 +4,10 @@ Ottimizzato per performance e filtri ricchi su metadati.
 """
 
 import asyncio
+import unicodedata
+import uuid
+from pathlib import Path
 from typing import Dict, List, Optional, Any
-from datetime import datetime
 
 from qdrant_client import QdrantClient, AsyncQdrantClient
 from qdrant_client.http import models
@@ -19,11 +21,34 @@ from qdrant_client.http.models import (
     MatchValue,
     Range,
 )
+import numpy as np
 from loguru import logger
 from sentence_transformers import SentenceTransformer
 
-from ..core.models import DocumentChunk, SearchResult
+from ..core.cache import TTLCache
+from ..core.models import ChunkMetadata, DocumentChunk, SearchResult
 from ..config.settings import get_settings, get_device
+from .embedding_cache import EmbeddingCache
+from .embedding_model import load_embedding_model
+from .image_metadata import load_image_metadata
+
+# Campi usati nei filtri, indicizzati nel payload: il filtro diventa una
+# lookup invece di una scansione di tutti i punti
+_PAYLOAD_INDEXES = {
+    "module": models.PayloadSchemaType.KEYWORD,
+    "version": models.PayloadSchemaType.KEYWORD,
+    "content_type": models.PayloadSchemaType.KEYWORD,
+    "source_url": models.PayloadSchemaType.KEYWORD,
+    "section_level": models.PayloadSchemaType.INTEGER,
+}
+
+
+def _point_id(chunk_id: str) -> str:
+    """
+    ID Qdrant stabile per chunk: UUIDv5 uguale in ogni processo (hash() di
+    Python dipende da PYTHONHASHSEED)
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, chunk_id))
 
 
 class VectorStore:
@@ -34,22 +59,35 @@ class VectorStore:
         self.client: Optional[QdrantClient] = None
         self.async_client: Optional[AsyncQdrantClient] = None
         self.embedding_model: Optional[SentenceTransformer] = None
+        self._embedding_cache: Optional[EmbeddingCache] = None
         self.collection_name = self.settings.vector_store.collection_name
+        # Embedding delle query ripetute, senza ripassare dal modello
+        self._query_cache = TTLCache(
+            maxsize=self.settings.embedding.query_cache_size,
+            ttl=self.settings.embedding.query_cache_ttl,
+        )
+        # Rescore con i vettori originali dei candidati trovati su int8
+        self._quantization_params = (
+            models.QuantizationSearchParams(
+                rescore=True,
+                oversampling=self.settings.vector_store.quantization_oversampling,
+            )
+            if self.settings.vector_store.scalar_quantization
+            else None
+        )
 
     async def initialize(self):
         """Inizializza il vector store"""
         # Client Qdrant
-        self.client = QdrantClient(
-            host=self.settings.vector_store.host,
-            port=self.settings.vector_store.port,
-            check_compatibility=False,
-        )
-
-        self.async_client = AsyncQdrantClient(
-            host=self.settings.vector_store.host,
-            port=self.settings.vector_store.port,
-            check_compatibility=False,
-        )
+        client_options = {
+            "host": self.settings.vector_store.host,
+            "port": self.settings.vector_store.port,
+            "grpc_port": self.settings.vector_store.grpc_port,
+            "prefer_grpc": self.settings.vector_store.prefer_grpc,
+            "check_compatibility": False,
+        }
+        self.client = QdrantClient(**client_options)
+        self.async_client = AsyncQdrantClient(**client_options)
 
         # Determina device da utilizzare
         device = get_device()
@@ -57,10 +95,18 @@ class VectorStore:
             f"Caricamento modello embedding: {self.settings.embedding.model_name} su device={device}"
         )
 
-        self.embedding_model = SentenceTransformer(
-            self.settings.embedding.model_name,
-            device=device,
-        )
+        self.embedding_model = load_embedding_model(self.settings.embedding, device)
+
+        # Cache persistente degli embedding dei chunk (opzionale)
+        embedding_settings = self.settings.embedding
+        if embedding_settings.cache_path:
+            self._embedding_cache = EmbeddingCache(
+                embedding_settings.cache_path,
+                namespace=(
+                    f"{embedding_settings.model_name}|{embedding_settings.backend}|"
+                    f"{embedding_settings.normalize_embeddings}"
+                ),
+            )
 
         # Crea collection se non esiste
         await self._ensure_collection_exists()
@@ -68,15 +114,29 @@ class VectorStore:
         logger.info(f"Vector store inizializzato (device={device})")
 
     async def _ensure_collection_exists(self):
-        """Crea la collection se non esiste"""
+        """Crea la collection se non esiste, con gli indici del payload"""
+        payload_schema: Dict[str, Any] = {}
         try:
             collection_info = await self.async_client.get_collection(
                 self.collection_name
             )
             logger.info(f"Collection {self.collection_name} già esistente")
+            # Indici esistenti: si creano solo quelli aggiunti dopo la collection
+            payload_schema = collection_info.payload_schema or {}
         except Exception:
             # Collection non esiste, creala
             vector_size = self.embedding_model.get_sentence_embedding_dimension()
+            vector_settings = self.settings.vector_store
+
+            quantization_config = None
+            if vector_settings.scalar_quantization:
+                quantization_config = models.ScalarQuantization(
+                    scalar=models.ScalarQuantizationConfig(
+                        type=models.ScalarType.INT8,
+                        quantile=vector_settings.quantization_quantile,
+                        always_ram=True,
+                    )
+                )
 
             await self.async_client.create_collection(
                 collection_name=self.collection_name,
@@ -84,10 +144,13 @@ class VectorStore:
                     size=vector_size,
                     distance=Distance.COSINE,
                     hnsw_config=models.HnswConfigDiff(
-                        m=self.settings.vector_store.hnsw_m,
-                        ef_construct=self.settings.vector_store.hnsw_ef_construct,
+                        m=vector_settings.hnsw_m,
+                        ef_construct=vector_settings.hnsw_ef_construct,
                     ),
+                    # Con la quantizzazione i vettori FP32 servono solo al rescore
+                    on_disk=vector_settings.scalar_quantization,
                 ),
+                quantization_config=quantization_config,
                 optimizers_config=models.OptimizersConfigDiff(
                     default_segment_number=2,
                 ),
@@ -95,6 +158,28 @@ class VectorStore:
 
             logger.info(f"Collection {self.collection_name} creata")
 
+        await self._ensure_payload_indexes(payload_schema)
+
+    async def _ensure_payload_indexes(self, payload_schema: Dict[str, Any]) -> None:
+        """Crea gli indici del payload non ancora presenti"""
+        missing = {
+            field: schema
+            for field, schema in _PAYLOAD_INDEXES.items()
+            if field not in payload_schema
+        }
+        await asyncio.gather(
+            *(
+                self.async_client.create_payload_index(
+                    collection_name=self.collection_name,
+                    field_name=field,
+                    field_schema=schema,
+                )
+                for field, schema in missing.items()
+            )
+        )
+        if missing:
+            logger.info(f"Indici payload creati: {', '.join(missing)}")
+
     async def add_chunks(self, chunks: List[DocumentChunk]) -> None:
         """
         Aggiunge chunk al vector store
@@ -114,37 +199,56 @@ class VectorStore:
             embeddings = await self._generate_embeddings_batch(texts)
             logger.debug(f"Embeddings generati: {len(embeddings)}")
 
-            # Prepara punti per Qdrant
+            # Prepara punti per Qdrant (vettori numpy passati direttamente al
+            # client, senza liste intermedie)
             points = []
-            for i, chunk in enumerate(chunks):
+            for chunk, embedding in zip(chunks, embeddings, strict=True):
                 point = PointStruct(
-                    id=abs(
-                        hash(chunk.metadata.id)
-                    ),  # Usa hash positivo come ID numerico
-                    vector=embeddings[i].tolist(),
+                    id=_point_id(chunk.metadata.id),
+                    vector=embedding,
                     payload=self._chunk_to_payload(chunk),
                 )
                 points.append(point)
 
             logger.debug(f"Preparati {len(points)} punti per l'inserimento")
 
-            # Inserisci in batch
-            batch_size = 100
-            for i in range(0, len(points), batch_size):
-                batch = points[i : i + batch_size]
-                logger.debug(
-                    f"Inserimento batch {i // batch_size + 1}: {len(batch)} punti"
-                )
-                await self.async_client.upsert(
-                    collection_name=self.collection_name,
-                    points=batch,
-                )
+            # Inserisci in batch concorrenti, limitati dal semaforo
+            batch_size = self.settings.vector_store.upsert_batch_size
+            semaphore = asyncio.Semaphore(self.settings.vector_store.upsert_concurrency)
+            batches = [
+                points[i : i + batch_size] for i in range(0, len(points), batch_size)
+            ]
+            await asyncio.gather(
+                *(self._upsert_batch(batch, semaphore) for batch in batches[:-1])
+            )
+            # L'ultimo batch, inviato dopo gli altri, attende l'applicazione:
+            # Qdrant applica gli aggiornamenti in ordine, quindi al ritorno
+            # tutti i punti sono ricercabili ed eventuali errori emergono qui
+            await self._upsert_batch(batches[-1], semaphore, wait=True)
 
             logger.info(f"Indicizzati {len(chunks)} chunk nel vector store")
         except Exception as e:
             logger.error(f"ERRORE durante indicizzazione nel vector store: {e}")
             raise
 
+    async def _upsert_batch(
+        self,
+        batch: List[PointStruct],
+        semaphore: asyncio.Semaphore,
+        wait: bool = False,
+    ) -> None:
+        """
+        Inserisce un batch di punti; con wait=False Qdrant conferma alla
+        ricezione, senza attendere l'applicazione del batch
+        """
+        async with semaphore:
+            logger.debug(f"Inserimento batch di {len(batch)} punti")
+            await self.async_client.upsert(
+                collection_name=self.collection_name,
+                points=batch,
+                wait=wait,
+            )
+
     async def delete_chunks_by_url(self, source_url: str) -> int:
         """
         Elimina tutti i chunk di un URL sorgente
@@ -214,48 +318,130 @@ class VectorStore:
         # Costruisci filtri Qdrant
         qdrant_filter = self._build_filter(filters) if filters else None
 
-        # Esegui ricerca
-        search_result = await self.async_client.search(
+        # Esegui ricerca (Query API, come search_many)
+        response = await self.async_client.query_points(
             collection_name=self.collection_name,
-            query_vector=query_embedding.tolist(),
+            query=query_embedding,
             limit=top_k,
             query_filter=qdrant_filter,
             score_threshold=score_threshold,
+            search_params=self._build_search_params(top_k),
             with_payload=True,
         )
 
-        # Converte risultati e popola immagini
-        results = []
-        for hit in search_result:
-            chunk = self._payload_to_chunk(hit.payload)
+        return (await self._hits_to_results([response.points]))[0]
 
-            # Popola immagini se presenti
-            images_data = []
-            if chunk.metadata.image_ids:
-                logger.info(
-                    f"Chunk {chunk.metadata.id} ha {len(chunk.metadata.image_ids)} image_ids, caricamento metadata..."
-                )
-                images_data = await self._load_images_metadata(chunk.metadata.image_ids)
-                logger.info(
-                    f"Caricate {len(images_data)} immagini per chunk {chunk.metadata.id}"
+    async def search_many(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        filters: Optional[Dict[str, Any]] = None,
+        score_threshold: float = 0.0,
+    ) -> List[List[SearchResult]]:
+        """
+        Più ricerche semantiche con una sola richiesta query_batch_points
+
+        Args:
+            queries: Query di ricerca (es. riscritture o sotto-query)
+            top_k: Numero di risultati per query
+            filters: Filtri sui metadati, comuni a tutte le query
+            score_threshold: Soglia minima di score
+
+        Returns:
+            Risultati per query, nello stesso ordine di queries
+        """
+        if not queries:
+            return []
+
+        # Embedding delle query non in cache con una sola chiamata al modello
+        embeddings = await self._generate_query_embeddings(queries)
+        qdrant_filter = self._build_filter(filters) if filters else None
+        search_params = self._build_search_params(top_k)
+
+        responses = await self.async_client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                models.QueryRequest(
+                    query=embedding,
+                    limit=top_k,
+                    filter=qdrant_filter,
+                    score_threshold=score_threshold,
+                    params=search_params,
+                    with_payload=True,
                 )
+                for embedding in embeddings
+            ],
+        )
+
+        return await self._hits_to_results([response.points for response in responses])
+
+    async def _hits_to_results(
+        self, hit_lists: List[List[Any]]
+    ) -> List[List[SearchResult]]:
+        """
+        Converte le hit in risultati, popolando le immagini con una sola
+        lettura (in parallelo) per tutte le liste, anche se condivise tra
+        più chunk
+        """
+        chunk_lists = [
+            [self._payload_to_chunk(hit.payload) for hit in hits] for hits in hit_lists
+        ]
+        image_ids = list(
+            dict.fromkeys(
+                image_id
+                for chunks in chunk_lists
+                for chunk in chunks
+                for image_id in chunk.metadata.image_ids
+            )
+        )
+        images_by_id = {
+            image_data["id"]: image_data
+            for image_data in await self._load_images_metadata(image_ids)
+        }
 
-            result = SearchResult(
-                chunk=chunk,
-                score=hit.score,
-                explanation=f"Vector similarity: {hit.score:.3f}",
-                images=images_data,
+        result_lists = [
+            [
+                SearchResult(
+                    chunk=chunk,
+                    score=hit.score,
+                    explanation=f"Vector similarity: {hit.score:.3f}",
+                    images=[
+                        images_by_id[image_id]
+                        for image_id in chunk.metadata.image_ids
+                        if image_id in images_by_id
+                    ],
+                )
+                for hit, chunk in zip(hits, chunks, strict=True)
+            ]
+            for hits, chunks in zip(hit_lists, chunk_lists, strict=True)
+        ]
+        if images_by_id:
+            logger.debug(
+                f"Caricati metadata di {len(images_by_id)} immagini "
+                f"per {sum(len(results) for results in result_lists)} risultati"
             )
-            results.append(result)
 
-        return results
+        return result_lists
+
+    def _build_search_params(self, top_k: int) -> models.SearchParams:
+        """
+        Parametri di ricerca: hnsw_ef proporzionale a top_k, con
+        hnsw_ef_search come minimo. Un ef più alto esplora più nodi del
+        grafo (recall maggiore, latenza maggiore); 4 candidati per risultato
+        bastano a mantenere la recall senza pagare un ef fisso alto sui
+        top_k piccoli
+        """
+        return models.SearchParams(
+            hnsw_ef=max(top_k * 4, self.settings.vector_store.hnsw_ef_search),
+            quantization=self._quantization_params,
+        )
 
     async def get_chunk_by_id(self, chunk_id: str) -> Optional[DocumentChunk]:
         """Recupera chunk per ID"""
         try:
             point = await self.async_client.retrieve(
                 collection_name=self.collection_name,
-                ids=[hash(chunk_id)],
+                ids=[_point_id(chunk_id)],
                 with_payload=True,
             )
 
@@ -267,12 +453,44 @@ class VectorStore:
             logger.error(f"Errore recupero chunk {chunk_id}: {e}")
             return None
 
+    async def get_chunks_by_ids(
+        self, chunk_ids: List[str]
+    ) -> List[Optional[DocumentChunk]]:
+        """
+        Recupera più chunk con una sola richiesta retrieve
+
+        Args:
+            chunk_ids: ID dei chunk da recuperare
+
+        Returns:
+            Chunk nello stesso ordine degli ID (None se non trovato)
+        """
+        if not chunk_ids:
+            return []
+
+        try:
+            points = await self.async_client.retrieve(
+                collection_name=self.collection_name,
+                ids=[_point_id(chunk_id) for chunk_id in chunk_ids],
+                with_payload=True,
+            )
+            # Qdrant non garantisce l'ordine: riallinea per chunk_id
+            chunks = {
+                point.payload["chunk_id"]: self._payload_to_chunk(point.payload)
+                for point in points
+            }
+            return [chunks.get(chunk_id) for chunk_id in chunk_ids]
+
+        except Exception as e:
+            logger.error(f"Errore recupero di {len(chunk_ids)} chunk: {e}")
+            return [None] * len(chunk_ids)
+
     async def delete_chunk(self, chunk_id: str) -> bool:
         """Elimina chunk per ID"""
         try:
             await self.async_client.delete(
                 collection_name=self.collection_name,
-                points_selector=models.PointIdsList(points=[hash(chunk_id)]),
+                points_selector=models.PointIdsList(points=[_point_id(chunk_id)]),
             )
             return True
         except Exception as e:
@@ -305,13 +523,49 @@ class VectorStore:
             logger.error(f"Errore recupero statistiche: {e}")
             return {}
 
-    async def _generate_embeddings_batch(self, texts: List[str]) -> List:
-        """Genera embeddings in batch per efficienza"""
+    async def _generate_embeddings_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        Genera embeddings in batch per efficienza. I testi duplicati sono
+        codificati una volta e, con la cache persistente, solo i contenuti
+        mai visti passano dal modello
+        """
         import time
 
         start = time.time()
-        logger.debug(f"Inizio generazione embeddings per {len(texts)} testi")
+        unique = list(dict.fromkeys(texts))
+        embeddings: Dict[str, np.ndarray] = {}
+
+        cache = self._embedding_cache
+        if cache is not None:
+            keys = {text: cache.key(text) for text in unique}
+            found = await asyncio.to_thread(cache.get_many, list(keys.values()))
+            embeddings = {
+                text: found[key] for text, key in keys.items() if key in found
+            }
 
+        missing = [text for text in unique if text not in embeddings]
+        logger.debug(
+            f"Embeddings per {len(texts)} testi: {len(missing)} da calcolare, "
+            f"{len(unique) - len(missing)} duplicati o in cache esclusi"
+        )
+        if missing:
+            encoded = await self._encode_texts(missing)
+            embeddings.update(zip(missing, encoded, strict=True))
+            if cache is not None:
+                await asyncio.to_thread(
+                    cache.set_many,
+                    {
+                        keys[text]: embedding
+                        for text, embedding in zip(missing, encoded, strict=True)
+                    },
+                )
+
+        elapsed = time.time() - start
+        logger.debug(f"Embeddings generati in {elapsed:.2f}s")
+        return np.stack([embeddings[text] for text in texts])
+
+    async def _encode_texts(self, texts: List[str]) -> np.ndarray:
+        """Codifica i testi con il modello, fuori dall'event loop"""
         # Determina batch size in base al device
         device = self.embedding_model.device.type
         batch_size = (
@@ -326,7 +580,7 @@ class VectorStore:
         loop = asyncio.get_event_loop()
 
         try:
-            embeddings = await loop.run_in_executor(
+            return await loop.run_in_executor(
                 None,
                 lambda: self.embedding_model.encode(
                     texts,
@@ -336,38 +590,51 @@ class VectorStore:
                 ),
             )
         except RuntimeError as e:
-            if "out of memory" in str(e).lower():
-                logger.warning(
-                    f"CUDA OOM durante generazione embeddings - riduco batch size da {batch_size} a {batch_size // 2}"
-                )
-                # Retry con batch size ridotto
-                embeddings = await loop.run_in_executor(
-                    None,
-                    lambda: self.embedding_model.encode(
-                        texts,
-                        batch_size=batch_size // 2,
-                        normalize_embeddings=self.settings.embedding.normalize_embeddings,
-                        show_progress_bar=False,
-                    ),
-                )
-            else:
+            if "out of memory" not in str(e).lower():
                 raise
-
-        elapsed = time.time() - start
-        logger.debug(f"Embeddings generati in {elapsed:.2f}s")
-        return embeddings
+            logger.warning(
+                f"CUDA OOM durante generazione embeddings - riduco batch size da {batch_size} a {batch_size // 2}"
+            )
+            # Retry con batch size ridotto
+            return await loop.run_in_executor(
+                None,
+                lambda: self.embedding_model.encode(
+                    texts,
+                    batch_size=batch_size // 2,
+                    normalize_embeddings=self.settings.embedding.normalize_embeddings,
+                    show_progress_bar=False,
+                ),
+            )
 
     async def _generate_embedding(self, text: str):
-        """Genera embedding per singolo testo"""
-        loop = asyncio.get_event_loop()
-        embedding = await loop.run_in_executor(
-            None,
-            lambda: self.embedding_model.encode(
-                [text],
-                normalize_embeddings=self.settings.embedding.normalize_embeddings,
-            )[0],
-        )
-        return embedding
+        """Genera embedding per singolo testo (in cache per le query ripetute)"""
+        return (await self._generate_query_embeddings([text]))[0]
+
+    async def _generate_query_embeddings(self, texts: List[str]) -> List:
+        """
+        Embedding delle query: quelle in cache non ripassano dal modello, le
+        altre (senza duplicati) sono codificate con una sola chiamata
+        """
+        # Forme Unicode e spazi equivalenti condividono la voce; le maiuscole
+        # no, perché cambiano l'embedding
+        keys = [" ".join(unicodedata.normalize("NFKC", text).split()) for text in texts]
+        embeddings = {key: self._query_cache.get(key) for key in keys}
+        missing = [key for key, embedding in embeddings.items() if embedding is None]
+
+        if missing:
+            loop = asyncio.get_event_loop()
+            encoded = await loop.run_in_executor(
+                None,
+                lambda: self.embedding_model.encode(
+                    missing,
+                    normalize_embeddings=self.settings.embedding.normalize_embeddings,
+                ),
+            )
+            for key, embedding in zip(missing, encoded, strict=True):
+                self._query_cache.set(key, embedding)
+                embeddings[key] = embedding
+
+        return [embeddings[key] for key in keys]
 
     async def _load_images_metadata(self, image_ids: List[str]) -> List[Dict[str, Any]]:
         """
@@ -379,164 +646,43 @@ class VectorStore:
         Returns:
             Lista di dizionari con metadata immagini
         """
-        from pathlib import Path
-        from PIL import Image
-
-        images_data = []
-
         if not self.settings.image_storage.enabled:
-            return images_data
+            return []
 
+        # File risolti dal listing della directory (una scandir per sorgente);
+        # letture in parallelo, fuori dall'event loop
         storage_base = Path(self.settings.image_storage.storage_base_path)
-
-        for image_id in image_ids:
-            try:
-                # Estrai source_hash e filename dall'ID
-                # Formato HTML: {source_hash}_img_{idx} -> file: img_{idx}.{ext}
-                # Formato PDF: {source_hash}_p{page}_i{idx} -> file: page_{page}_img_{idx}.{ext}
-                parts = image_id.split("_", 1)
-                if len(parts) < 2:
-                    logger.debug(f"Formato ID immagine non valido: {image_id}")
-                    continue
-
-                source_hash = parts[0]
-                remaining = parts[1]
-
-                # Determina il pattern del filename
-                if remaining.startswith("img_"):
-                    # Formato HTML: img_{idx}
-                    idx = remaining.split("_")[1]
-                    filename_pattern = f"img_{idx}"
-                elif remaining.startswith("p") and "_i" in remaining:
-                    # Formato PDF: p{page}_i{idx} -> page_{page}_img_{idx}
-                    page_part, idx_part = remaining.split("_i", 1)
-                    page_num = page_part[1:]  # Rimuove 'p'
-                    filename_pattern = f"page_{int(page_num) + 1}_img_{idx_part}"
-                else:
-                    logger.debug(f"Formato ID immagine non riconosciuto: {image_id}")
-                    continue
-
-                # Cerca il file nella directory source_hash
-                source_dir = storage_base / source_hash
-                if not source_dir.exists() or not source_dir.is_dir():
-                    logger.debug(
-                        f"Directory {source_hash} non trovata per immagine {image_id}"
-                    )
-                    continue
-
-                # Cerca file con questo pattern (diversi formati possibili)
-                found = False
-                for ext in ["png", "jpg", "jpeg", "gif", "webp"]:
-                    image_file = source_dir / f"{filename_pattern}.{ext}"
-                    if image_file.exists():
-                        # Ricostruisci metadata base dall'immagine
-                        try:
-                            with Image.open(image_file) as img:
-                                width, height = img.size
-                                format_name = img.format.lower() if img.format else ext
-
-                            image_data = {
-                                "id": image_id,
-                                "storage_path": str(image_file),
-                                "image_url": f"/images/{source_dir.name}/{image_file.name}",
-                                "width": width,
-                                "height": height,
-                                "format": format_name,
-                                "file_size_bytes": image_file.stat().st_size,
-                            }
-                            images_data.append(image_data)
-                            found = True
-                            break
-                        except Exception as img_err:
-                            logger.warning(
-                                f"Errore lettura immagine {image_file}: {img_err}"
-                            )
-
-                if not found:
-                    logger.debug(
-                        f"Immagine {image_id} non trovata nel filesystem (pattern: {filename_pattern})"
-                    )
-
-            except Exception as e:
-                logger.warning(f"Errore caricamento metadata immagine {image_id}: {e}")
-                continue
-
-        return images_data
+        loaded = await asyncio.gather(
+            *(
+                asyncio.to_thread(load_image_metadata, image_id, storage_base)
+                for image_id in image_ids
+            )
+        )
+        return [image_data for image_data in loaded if image_data is not None]
 
     def _chunk_to_payload(self, chunk: DocumentChunk) -> Dict[str, Any]:
-        """Converte chunk in payload Qdrant"""
+        """
+        Converte chunk in payload Qdrant. Serializzazione di pydantic-core,
+        con i campi opzionali non valorizzati esclusi
+        """
         metadata = chunk.metadata
-
-        # Crea payload base
-        payload = {
-            "chunk_id": metadata.id,
-            "title": metadata.title,
-            "content": chunk.content,
-            "breadcrumbs": metadata.breadcrumbs or [],
-            "section_level": metadata.section_level,
-            "section_path": metadata.section_path,
-            "content_type": metadata.content_type.value,
-            "version": metadata.version,
-            "module": metadata.module,
-            "source_url": metadata.source_url,
-            "source_format": metadata.source_format.value,
-            "lang": metadata.lang or "it",
-            "hash": metadata.hash,
-            "updated_at": metadata.updated_at.isoformat(),
-        }
-
-        # Aggiungi campi opzionali solo se non None
-        if metadata.param_name:
-            payload["param_name"] = metadata.param_name
-        if metadata.ui_path:
-            payload["ui_path"] = metadata.ui_path
-        if metadata.error_code:
-            payload["error_code"] = metadata.error_code
-        if metadata.page_range:
-            payload["page_range"] = metadata.page_range
-        if metadata.anchor:
-            payload["anchor"] = metadata.anchor
-        if metadata.parent_chunk_id:
-            payload["parent_chunk_id"] = metadata.parent_chunk_id
-        if metadata.child_chunk_ids:
-            payload["child_chunk_ids"] = metadata.child_chunk_ids
-        if metadata.image_ids:
-            payload["image_ids"] = metadata.image_ids
-
+        payload = metadata.model_dump(mode="json", exclude_none=True, exclude={"id"})
+        payload["chunk_id"] = metadata.id
+        payload["content"] = chunk.content
         return payload
 
     def _payload_to_chunk(self, payload: Dict[str, Any]) -> DocumentChunk:
-        """Converte payload Qdrant in chunk"""
-        from ..core.models import ChunkMetadata, ContentType, SourceFormat
-
-        # Ricostruisci metadati
-        metadata = ChunkMetadata(
-            id=payload["chunk_id"],
-            title=payload["title"],
-            breadcrumbs=payload.get("breadcrumbs", []),
-            section_level=payload["section_level"],
-            section_path=payload["section_path"],
-            content_type=ContentType(payload["content_type"]),
-            version=payload["version"],
-            module=payload["module"],
-            param_name=payload.get("param_name"),
-            ui_path=payload.get("ui_path"),
-            error_code=payload.get("error_code"),
-            source_url=payload["source_url"],
-            source_format=SourceFormat(payload["source_format"]),
-            page_range=payload.get("page_range"),
-            anchor=payload.get("anchor"),
-            lang=payload["lang"],
-            hash=payload["hash"],
-            updated_at=datetime.fromisoformat(payload["updated_at"]),
-            parent_chunk_id=payload.get("parent_chunk_id"),
-            child_chunk_ids=payload.get("child_chunk_ids", []),
-            image_ids=payload.get("image_ids", []),
-        )
+        """Converte payload Qdrant in chunk (validazione di pydantic-core)"""
+        metadata = {
+            key: value
+            for key, value in payload.items()
+            if key not in ("chunk_id", "content")
+        }
+        metadata["id"] = payload["chunk_id"]
 
         return DocumentChunk(
             content=payload["content"],
-            metadata=metadata,
+            metadata=ChunkMetadata.model_validate(metadata),
         )
 
     def _build_filter(self, filters: Dict[str, Any]) -> Filter:
@@ -581,6 +727,8 @@ class VectorStore:
 
     async def close(self):
         """Chiude connessioni"""
+        if self._embedding_cache:
+            self._embedding_cache.close()
         if self.async_client:
             await self.async_client.close()
         if self.client:
@@ -216,7 +216,7 @@ def mock_qdrant_client():
     client.get_collection = AsyncMock(return_value=MagicMock(points_count=100))
     client.create_collection = AsyncMock()
     client.upsert = AsyncMock()
-    client.search = AsyncMock(return_value=[])
+    client.query_points = AsyncMock(return_value=MagicMock(points=[]))
     client.delete = AsyncMock()
     client.retrieve = AsyncMock(return_value=[])
     client.count = AsyncMock(return_value=MagicMock(count=0))
@@ -244,7 +244,10 @@ def mock_sentence_transformer():
     import numpy as np
 
     model = MagicMock()
-    model.encode = MagicMock(return_value=np.random.rand(384))  # Mock embedding 384-dim
+    # Un embedding 384-dim per ogni testo, come il modello reale
+    model.encode = MagicMock(
+        side_effect=lambda texts, **kwargs: np.random.rand(len(texts), 384)
+    )
     model.get_sentence_embedding_dimension = MagicMock(return_value=384)
     model.device = MagicMock()
     model.device.type = "cpu"
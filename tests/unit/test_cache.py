@@ -0,0 +1,61 @@
+"""
+Unit tests per il modulo cache
+"""
+
+import pytest
+
+from src.rag_gestionale.core import cache as cache_module
+from src.rag_gestionale.core.cache import TTLCache
+
+
+@pytest.mark.unit
+class TestTTLCache:
+    """Test per la classe TTLCache"""
+
+    def test_get_set(self):
+        """Test inserimento e lettura"""
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set("a", 1)
+
+        assert cache.get("a") == 1
+        assert "a" in cache
+        assert cache.get("b") is None
+        assert len(cache) == 1
+
+    def test_lru_eviction(self):
+        """Test rimozione della voce meno usata oltre maxsize"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")  # "b" diventa la meno usata
+        cache.set("c", 3)
+
+        assert "a" in cache
+        assert "b" not in cache
+        assert "c" in cache
+
+    def test_expiration(self, monkeypatch):
+        """Test scadenza delle voci dopo il ttl"""
+        now = [1000.0]
+        monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+        cache = TTLCache(maxsize=10, ttl=5)
+        cache.set("a", 1)
+
+        now[0] += 4
+        assert cache.get("a") == 1
+
+        now[0] += 2
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_pop_and_clear(self):
+        """Test rimozione esplicita e svuotamento"""
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        assert cache.pop("a") == 1
+        assert cache.pop("a", "x") == "x"
+
+        cache.clear()
+        assert len(cache) == 0
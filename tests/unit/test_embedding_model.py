@@ -0,0 +1,123 @@
+"""
+Unit tests per il caricamento del modello di embedding
+"""
+
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+from src.rag_gestionale.config.settings import EmbeddingSettings
+from src.rag_gestionale.retrieval import embedding_model
+from src.rag_gestionale.retrieval.embedding_model import load_embedding_model
+
+_MODULE = "src.rag_gestionale.retrieval.embedding_model"
+
+
+def _fake_export(model, quantization, export_dir):
+    """Simula l'esportazione scrivendo il file quantizzato"""
+    path = Path(export_dir) / "onnx" / f"model_qint8_{quantization}.onnx"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+
+
+def _model(embeddings):
+    model = MagicMock()
+    model.encode.return_value = np.asarray(embeddings, dtype=np.float32)
+    return model
+
+
+@pytest.mark.unit
+class TestLoadEmbeddingModel:
+    """Test per la scelta del backend e l'esportazione ONNX int8"""
+
+    def test_torch_backend_by_default(self):
+        """Test backend PyTorch, in FP16 solo su GPU"""
+        with patch(f"{_MODULE}.SentenceTransformer") as mock_st:
+            load_embedding_model(EmbeddingSettings(), "cuda")
+            mock_st.assert_called_once_with("BAAI/bge-m3", device="cuda")
+            mock_st.return_value.half.assert_called_once()
+
+            mock_st.reset_mock()
+            load_embedding_model(EmbeddingSettings(), "cpu")
+            mock_st.return_value.half.assert_not_called()
+
+            load_embedding_model(EmbeddingSettings(fp16_on_gpu=False), "cuda")
+            mock_st.return_value.half.assert_not_called()
+
+    def test_openvino_precision_hint(self):
+        """Test backend OpenVINO con precisione bf16 su CPU"""
+        settings = EmbeddingSettings(backend="openvino")
+        with (
+            patch.object(embedding_model, "HAS_OPENVINO", True),
+            patch(f"{_MODULE}.SentenceTransformer") as mock_st,
+        ):
+            load_embedding_model(settings, "cpu")
+
+        kwargs = mock_st.call_args.kwargs
+        assert kwargs["backend"] == "openvino"
+        assert kwargs["model_kwargs"] == {
+            "ov_config": {"INFERENCE_PRECISION_HINT": "bf16"}
+        }
+
+    def test_onnx_export_once_then_reused(self, tmp_path):
+        """Test esportazione al primo avvio e riuso del file int8"""
+        settings = EmbeddingSettings(backend="onnx", onnx_dir=str(tmp_path))
+        same = [[1.0, 0.0], [0.0, 1.0]]
+
+        with (
+            patch.object(embedding_model, "HAS_ONNX_EXPORT", True),
+            patch(f"{_MODULE}.SentenceTransformer", return_value=_model(same)) as st,
+            patch(
+                f"{_MODULE}.export_dynamic_quantized_onnx_model",
+                side_effect=_fake_export,
+                create=True,
+            ) as export,
+        ):
+            load_embedding_model(settings, "cpu")
+            load_embedding_model(settings, "cpu")
+
+        export.assert_called_once()
+        kwargs = st.call_args.kwargs
+        assert kwargs["backend"] == "onnx"
+        assert kwargs["model_kwargs"] == {
+            "file_name": "onnx/model_qint8_avx512_vnni.onnx"
+        }
+        assert st.call_args.args[0] == str(tmp_path / "BAAI--bge-m3")
+
+    def test_onnx_low_fidelity_falls_back_to_torch(self, tmp_path):
+        """Test quantizzazione scartata se si discosta troppo da FP32"""
+        settings = EmbeddingSettings(backend="onnx", onnx_dir=str(tmp_path))
+        reference = _model([[1.0, 0.0], [0.0, 1.0]])
+        quantized = _model([[1.0, 0.0], [0.6, 0.8]])
+        fallback = MagicMock()
+
+        with (
+            patch.object(embedding_model, "HAS_ONNX_EXPORT", True),
+            patch(
+                f"{_MODULE}.SentenceTransformer",
+                side_effect=[reference, quantized, fallback],
+            ) as st,
+            patch(
+                f"{_MODULE}.export_dynamic_quantized_onnx_model",
+                side_effect=_fake_export,
+                create=True,
+            ),
+        ):
+            model = load_embedding_model(settings, "cpu")
+
+        assert model is fallback
+        assert st.call_args.kwargs == {"device": "cpu"}
+        assert not list(tmp_path.rglob("model_qint8_*.onnx"))
+
+    def test_onnx_skipped_on_gpu(self, tmp_path):
+        """Test backend PyTorch su GPU anche se configurato ONNX"""
+        settings = EmbeddingSettings(backend="onnx", onnx_dir=str(tmp_path))
+        with (
+            patch.object(embedding_model, "HAS_ONNX_EXPORT", True),
+            patch(f"{_MODULE}.SentenceTransformer") as mock_st,
+        ):
+            load_embedding_model(settings, "cuda")
+
+        mock_st.assert_called_once_with("BAAI/bge-m3", device="cuda")
@@ -0,0 +1,63 @@
+"""
+Unit tests per i kernel di fusione degli score
+"""
+
+import numpy as np
+import pytest
+
+from src.rag_gestionale.retrieval import fusion
+
+
+@pytest.mark.unit
+class TestFuseScores:
+    """Test per fuse_scores"""
+
+    @pytest.fixture
+    def inputs(self):
+        """Due risultati vector e due lexical, con un chunk in comune"""
+        vector_scores = np.array([1.0, 0.5])
+        lexical_scores = np.array([2.0, 1.0])
+        groups = np.array([0, 1, 1, 2])
+        return vector_scores, lexical_scores, groups, 3, 0.7
+
+    def test_fuse_numpy(self, inputs):
+        """Test fusione TM2C2 e maschere di presenza"""
+        fused, in_vector, in_lexical = fusion._fuse_numpy(*inputs)
+
+        np.testing.assert_allclose(fused, [0.7, 0.65, 0.15])
+        assert in_vector.tolist() == [True, True, False]
+        assert in_lexical.tolist() == [False, True, True]
+
+    def test_fuse_numpy_zero_max(self):
+        """Test che un massimo nullo non causi divisioni per zero"""
+        fused, _, in_lexical = fusion._fuse_numpy(
+            np.zeros(2), np.empty(0), np.array([0, 1]), 2, 0.7
+        )
+
+        np.testing.assert_allclose(fused, [0.0, 0.0])
+        assert not in_lexical.any()
+
+    @pytest.mark.skipif(not fusion.HAS_NUMBA, reason="numba non installato")
+    def test_fuse_numba_matches_numpy(self, inputs):
+        """Test che il kernel Numba coincida con la versione NumPy"""
+        expected = fusion._fuse_numpy(*inputs)
+        result = fusion.fuse_scores(*inputs)
+
+        for actual, reference in zip(result, expected, strict=True):
+            np.testing.assert_allclose(actual, reference)
+
+    @pytest.mark.skipif(not fusion.HAS_NUMBA, reason="numba non installato")
+    def test_fuse_numba_negative_scores(self):
+        """Test massimi con soli score negativi, come nella versione NumPy"""
+        inputs = (
+            np.array([-0.2, -0.5, -0.1]),
+            np.array([-3.0, -1.5]),
+            np.array([0, 1, 2, 2, 3]),
+            4,
+            0.6,
+        )
+        expected = fusion._fuse_numpy(*inputs)
+        result = fusion.fuse_scores(*inputs)
+
+        for actual, reference in zip(result, expected, strict=True):
+            np.testing.assert_allclose(actual, reference)
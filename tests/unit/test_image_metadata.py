@@ -0,0 +1,120 @@
+"""
+Unit tests per il modulo image_metadata
+"""
+
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+from src.rag_gestionale.retrieval.image_metadata import (
+    _scan_image_dir,
+    clear_image_dir_cache,
+    load_image_metadata,
+)
+
+
+@pytest.fixture(autouse=True)
+def _clear_dir_cache():
+    clear_image_dir_cache()
+    yield
+    clear_image_dir_cache()
+
+
+def _save_image(path, size=(4, 3)):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", size).save(path)
+
+
+@pytest.mark.unit
+class TestLoadImageMetadata:
+    """Test per il caricamento dei metadata immagine"""
+
+    def test_html_and_pdf_ids(self, tmp_path):
+        """Test decodifica degli ID HTML e PDF nei nomi file"""
+        _save_image(tmp_path / "abc" / "img_0.png")
+        _save_image(tmp_path / "abc" / "page_3_img_1.jpg", size=(8, 6))
+
+        html = load_image_metadata("abc_img_0", tmp_path)
+        assert html["width"] == 4 and html["height"] == 3
+        assert html["format"] == "png"
+        assert html["image_url"] == "/images/abc/img_0.png"
+        assert (
+            html["file_size_bytes"] == (tmp_path / "abc" / "img_0.png").stat().st_size
+        )
+
+        # Pagine PDF indicizzate da 0 nell'ID, da 1 nel nome file
+        pdf = load_image_metadata("abc_p2_i1", tmp_path)
+        assert pdf["format"] == "jpeg"
+        assert pdf["storage_path"].endswith("page_3_img_1.jpg")
+
+    def test_preferred_format_and_missing(self, tmp_path):
+        """Test formato preferito, file mancanti e ID non validi"""
+        _save_image(tmp_path / "abc" / "img_0.jpg")
+        _save_image(tmp_path / "abc" / "img_0.png")
+
+        assert load_image_metadata("abc_img_0", tmp_path)["format"] == "png"
+        assert load_image_metadata("abc_img_9", tmp_path) is None
+        assert load_image_metadata("zzz_img_0", tmp_path) is None
+        assert load_image_metadata("abc_foto_0", tmp_path) is None
+
+    def test_directory_listed_once(self, tmp_path):
+        """Test una sola lettura della directory finché non cambia"""
+        _save_image(tmp_path / "abc" / "img_0.png")
+
+        load_image_metadata("abc_img_0", tmp_path)
+        load_image_metadata("abc_img_1", tmp_path)
+        assert _scan_image_dir.cache_info().misses == 1
+
+        # Immagine salvata dopo il listing (anche da un altro processo):
+        # la directory modificata viene riletta
+        _save_image(tmp_path / "abc" / "img_1.png")
+        assert load_image_metadata("abc_img_1", tmp_path) is not None
+        assert _scan_image_dir.cache_info().misses == 2
+
+    def test_missing_directory_not_cached(self, tmp_path):
+        """Test directory creata dopo una ricerca andata a vuoto"""
+        assert load_image_metadata("abc_img_0", tmp_path) is None
+
+        _save_image(tmp_path / "abc" / "img_0.png")
+        assert load_image_metadata("abc_img_0", tmp_path) is not None
+
+    @pytest.mark.parametrize(
+        "ext, options",
+        [
+            ("png", {}),
+            ("jpg", {}),
+            ("jpg", {"progressive": True}),
+            ("gif", {}),
+            ("webp", {"lossless": True}),
+            ("webp", {"quality": 80}),
+            ("webp", {"exif": b"Exif\x00\x00"}),
+        ],
+    )
+    def test_header_only_read(self, tmp_path, ext, options):
+        """Test dimensioni dall'intestazione per ogni formato, senza PIL"""
+        path = tmp_path / "abc" / f"img_0.{ext}"
+        path.parent.mkdir(parents=True)
+        Image.new("RGB", (321, 123)).save(path, **options)
+
+        with patch.object(Image, "open", wraps=Image.open) as pil_open:
+            metadata = load_image_metadata("abc_img_0", tmp_path)
+            pil_open.assert_not_called()
+
+        assert (metadata["width"], metadata["height"]) == (321, 123)
+        assert metadata["format"] == {"jpg": "jpeg"}.get(ext, ext)
+
+    def test_unrecognized_header_pil_fallback(self, tmp_path):
+        """Test PIL per i file con intestazione non riconosciuta"""
+        path = tmp_path / "abc" / "img_0.png"
+        path.parent.mkdir(parents=True)
+        # Firma PNG senza il chunk IHDR in testa
+        path.write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x00" * 24)
+
+        with patch.object(
+            Image, "open", return_value=Image.new("RGB", (5, 2))
+        ) as pil_open:
+            metadata = load_image_metadata("abc_img_0", tmp_path)
+            pil_open.assert_called_once()
+
+        assert (metadata["width"], metadata["height"]) == (5, 2)
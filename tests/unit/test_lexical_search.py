@@ -0,0 +1,842 @@
+"""
+Unit tests per il modulo LexicalSearch
+"""
+
+import asyncio
+import json
+import re
+import threading
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+from opensearchpy.serializer import JSONSerializer
+
+from src.rag_gestionale.core.models import DocumentChunk
+from src.rag_gestionale.retrieval import lexical_search as lexical_search_module
+from src.rag_gestionale.retrieval.lexical_index import SEARCH_TEMPLATE_SOURCE
+from src.rag_gestionale.retrieval.lexical_search import (
+    LITE_SOURCE_FIELDS,
+    LexicalSearch,
+)
+from src.rag_gestionale.retrieval.opensearch_client import (
+    HAS_ORJSON,
+    OrjsonSerializer,
+)
+
+
+@pytest.mark.unit
+@pytest.mark.requires_opensearch
+class TestLexicalSearch:
+    """Test per la classe LexicalSearch"""
+
+    @pytest.fixture
+    async def lexical_search(self, mock_opensearch_client):
+        """Fixture che crea un'istanza di LexicalSearch con mock"""
+        with patch(
+            "src.rag_gestionale.retrieval.opensearch_client.AsyncOpenSearch"
+        ) as mock_client:
+            mock_opensearch_client.indices.put_settings = AsyncMock()
+            mock_opensearch_client.indices.refresh = AsyncMock()
+            mock_client.return_value = mock_opensearch_client
+
+            search = LexicalSearch()
+            await search.initialize()
+            yield search
+            await search.close()
+            mock_opensearch_client.close.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_initialization(self, lexical_search):
+        """Verifica che il client venga creato e l'indice controllato"""
+        assert lexical_search.client is not None
+        lexical_search.client.indices.exists.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_ensure_index_creates_config(self, lexical_search):
+        """Test creazione indice con BM25 dai settings, solo se non esiste"""
+        indices = lexical_search.client.indices
+        indices.create.assert_not_awaited()
+
+        indices.exists.return_value = False
+        await lexical_search._ensure_index_exists()
+
+        body = indices.create.call_args.kwargs["body"]
+        settings = lexical_search.settings.lexical_search
+        similarity = body["settings"]["index"]["similarity"]["default"]
+        assert similarity == {
+            "type": "BM25",
+            "k1": settings.bm25_k1,
+            "b": settings.bm25_b,
+        }
+        title_similarity = body["settings"]["index"]["similarity"]["title_bm25"]
+        assert title_similarity["b"] == settings.title_bm25_b
+        # Campi quasi-keyword senza normalizzazione della lunghezza
+        no_norm = body["settings"]["index"]["similarity"]["bm25_no_norm"]
+        assert no_norm["b"] == 0.0
+        properties = body["mappings"]["properties"]
+        assert properties["param_name"]["similarity"] == "bm25_no_norm"
+        assert properties["ui_path"]["similarity"] == "bm25_no_norm"
+        assert properties["title"]["fields"]["exact"]["similarity"] == "bm25_no_norm"
+        assert body["mappings"]["properties"]["title"]["similarity"] == "title_bm25"
+        assert body["settings"]["number_of_replicas"] == settings.replicas
+        index = body["settings"]["index"]
+        assert index["sort.field"] == ["module", "section_level"]
+        assert index["refresh_interval"] == settings.refresh_interval
+        synonyms = body["settings"]["analysis"]["filter"]["custom_synonym"]
+        assert "iva,imposta,aliquota" in synonyms["synonyms"]
+        # Sinonimi solo nell'analyzer di ricerca
+        analyzers = body["settings"]["analysis"]["analyzer"]
+        assert "custom_synonym" not in analyzers["italian_custom"]["filter"]
+        assert analyzers["italian_search"]["filter"][-1] == "custom_synonym"
+        content = body["mappings"]["properties"]["content"]
+        assert content["search_analyzer"] == "italian_search"
+        # Espansione dei sinonimi solo sul contenuto
+        for field in ("title", "breadcrumbs"):
+            assert "search_analyzer" not in body["mappings"]["properties"][field]
+        assert body["mappings"]["properties"]["error_code"]["type"] == "keyword"
+
+        # I termini tecnici sono marcati prima dello stemmer
+        analyzer = body["settings"]["analysis"]["analyzer"]["italian_custom"]
+        filters = analyzer["filter"]
+        assert filters.index("tech_keywords") < filters.index("italian_stemmer")
+        marker = body["settings"]["analysis"]["filter"]["tech_keywords"]
+        assert marker["type"] == "keyword_marker"
+        assert "database" in marker["keywords"]
+
+        # Il template condiviso non viene modificato
+        body["settings"]["analysis"]["filter"]["custom_synonym"]["synonyms"].clear()
+        assert lexical_search._build_index_config() != body
+
+    def test_index_config_elision_and_icu_folding(self, lexical_search):
+        """Test elisione degli articoli e icu_folding solo se configurato"""
+        settings = lexical_search.settings.lexical_search
+        analysis = lexical_search._build_index_config()["settings"]["analysis"]
+        filters = analysis["analyzer"]["italian_custom"]["filter"]
+        assert filters[0] == "italian_elision"
+        assert "dell" in analysis["filter"]["italian_elision"]["articles"]
+        assert "asciifolding" in filters
+
+        with patch.object(settings, "icu_folding", True):
+            analysis = lexical_search._build_index_config()["settings"]["analysis"]
+        for analyzer in ("italian_custom", "italian_search"):
+            filters = analysis["analyzer"][analyzer]["filter"]
+            assert "icu_folding" in filters
+            assert "asciifolding" not in filters
+        # Il template condiviso resta con asciifolding
+        filters = lexical_search._build_index_config()["settings"]["analysis"][
+            "analyzer"
+        ]["italian_search"]["filter"]
+        assert "asciifolding" in filters
+
+    @pytest.mark.asyncio
+    async def test_synonyms_from_file_reloadable(self, lexical_search):
+        """Test sinonimi da file aggiornabile e ricarica senza reindicizzare"""
+        assert await lexical_search.reload_synonyms() is False
+
+        lexical_search.settings.lexical_search.synonyms_path = (
+            "analysis/it_synonyms.txt"
+        )
+        try:
+            synonym_filter = lexical_search._build_synonym_filter()
+            assert synonym_filter["synonyms_path"] == "analysis/it_synonyms.txt"
+            assert synonym_filter["updateable"] is True
+            assert "synonyms" not in synonym_filter
+
+            client = lexical_search.client
+            client.transport.perform_request = AsyncMock()
+            generation = lexical_search._generation
+
+            assert await lexical_search.reload_synonyms() is True
+            client.transport.perform_request.assert_awaited_once_with(
+                "POST",
+                f"/_plugins/_refresh_search_analyzers/{lexical_search.index_name}",
+            )
+            assert lexical_search._generation == generation + 1
+        finally:
+            lexical_search.settings.lexical_search.synonyms_path = None
+
+    @pytest.mark.asyncio
+    async def test_client_shared_between_instances(self, lexical_search):
+        """Test che le istanze condividano il client fino all'ultima chiusura"""
+        client = lexical_search.client
+
+        other = LexicalSearch()
+        await other.initialize()
+        assert other.client is client
+
+        await other.close()
+        client.close.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_add_chunks_concurrent_bulk(self, lexical_search, sample_chunks_list):
+        """Test suddivisione dei chunk tra richieste bulk concorrenti"""
+        settings = lexical_search.settings.lexical_search
+        sent = []
+        build_threads = set()
+        build_actions = lexical_search._build_actions
+
+        def tracking_build(chunks):
+            build_threads.add(threading.get_ident())
+            return build_actions(chunks)
+
+        async def fake_streaming_bulk(client, actions, **kwargs):
+            docs = [action async for action in actions]
+            sent.append((docs, kwargs))
+            for i, doc in enumerate(docs):
+                # Il primo documento di ogni parte fallisce
+                yield i > 0, {"index": {"_id": doc["_id"], "status": 400}}
+
+        with (
+            patch.object(settings, "bulk_chunk_size", 1),
+            patch.object(settings, "bulk_concurrency", 2),
+            patch(
+                "src.rag_gestionale.retrieval.lexical_search.async_streaming_bulk",
+                side_effect=fake_streaming_bulk,
+            ) as mock_bulk,
+            patch.object(
+                lexical_search, "_build_actions", side_effect=tracking_build
+            ) as mock_build,
+            patch("src.rag_gestionale.retrieval.lexical_search.logger") as mock_logger,
+        ):
+            await lexical_search.add_chunks(sample_chunks_list)
+
+        # Uno streaming bulk per parte, azioni preparate fuori dal loop a blocchi
+        assert mock_bulk.call_count == 2
+        assert mock_build.call_count == len(sample_chunks_list)
+        assert threading.get_ident() not in build_threads
+        ids = [doc["_id"] for docs, _ in sent for doc in docs]
+        assert sorted(ids) == sorted(chunk.metadata.id for chunk in sample_chunks_list)
+        summary = mock_logger.info.call_args_list[-1].args[0]
+        assert summary == f"Indicizzati {len(sample_chunks_list) - 2} chunk, 2 falliti"
+        assert mock_logger.warning.call_count == 2
+        kwargs = sent[0][1]
+        assert kwargs["chunk_size"] == 1
+        assert kwargs["max_chunk_bytes"] == settings.bulk_max_chunk_bytes
+        assert kwargs["raise_on_error"] is False
+
+    @pytest.mark.asyncio
+    async def test_add_chunks_ingest_mode(self, lexical_search, sample_chunks_list):
+        """Test disattivazione refresh/repliche durante il bulk e ripristino"""
+        indices = lexical_search.client.indices
+        settings = lexical_search.settings.lexical_search
+
+        with patch(
+            "src.rag_gestionale.retrieval.lexical_search.async_streaming_bulk",
+            side_effect=RuntimeError("bulk fallito"),
+        ):
+            with pytest.raises(RuntimeError):
+                await lexical_search.add_chunks(sample_chunks_list)
+
+        # Ripristino anche in caso di errore
+        bodies = [
+            c.kwargs["body"]["index"] for c in indices.put_settings.call_args_list
+        ]
+        assert bodies[0]["refresh_interval"] == "-1"
+        assert bodies[0]["number_of_replicas"] == 0
+        assert bodies[0]["translog.flush_threshold_size"] == "1gb"
+        assert bodies[1]["refresh_interval"] == settings.refresh_interval
+        assert bodies[1]["number_of_replicas"] == settings.replicas
+        assert bodies[1]["translog.flush_threshold_size"] is None
+        indices.refresh.assert_awaited_once()
+        assert lexical_search_module._ingest_depths == {}
+
+    @pytest.mark.asyncio
+    async def test_ingest_mode_shared_between_instances(self, lexical_search):
+        """Test refresh ripristinato solo dall'ultima ingestione sull'indice"""
+        other = LexicalSearch()
+        other.client = lexical_search.client
+        put_settings = lexical_search.client.indices.put_settings
+
+        await lexical_search._enter_ingest_mode()
+        await other._enter_ingest_mode()
+        await lexical_search._exit_ingest_mode()
+        assert put_settings.await_count == 1
+
+        await other._exit_ingest_mode()
+        assert put_settings.await_count == 2
+        restored = put_settings.call_args.kwargs["body"]["index"]
+        assert restored["refresh_interval"] != "-1"
+        assert lexical_search_module._ingest_depths == {}
+
+    @pytest.mark.asyncio
+    async def test_search_uses_cache(self, lexical_search, sample_document_chunk):
+        """Test cache dei risultati e invalidazione dopo modifiche all'indice"""
+        client = lexical_search.client
+        client.search_template.return_value = {
+            "hits": {
+                "hits": [
+                    {
+                        "_source": lexical_search._chunk_to_document(
+                            sample_document_chunk
+                        ),
+                        "_score": 3.0,
+                    }
+                ]
+            }
+        }
+
+        first = await lexical_search.search("Fattura  Elettronica", top_k=5)
+        first[0].score = 0.1
+        first[0].images.append({"id": "img"})
+        second = await lexical_search.search("fattura elettronica", top_k=5)
+
+        assert client.search_template.await_count == 1
+        assert second[0].score == 3.0
+        assert second[0].images == []
+
+        # Parametri diversi: nuova ricerca
+        await lexical_search.search("fattura elettronica", top_k=10)
+        assert client.search_template.await_count == 2
+
+        # Dopo una modifica dell'indice la cache non è più valida
+        await lexical_search.delete_chunk(sample_document_chunk.metadata.id)
+        await lexical_search.search("fattura elettronica", top_k=5)
+        assert client.search_template.await_count == 3
+        assert len(lexical_search._search_cache) == 1
+
+        lexical_search.invalidate()
+        assert len(lexical_search._search_cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_concurrent_identical_searches_share_request(
+        self, lexical_search, sample_document_chunk
+    ):
+        """Test ricerche identiche concorrenti servite da una sola richiesta"""
+        client = lexical_search.client
+        release = asyncio.Event()
+
+        async def slow_search_template(**kwargs):
+            await release.wait()
+            return {
+                "hits": {
+                    "hits": [
+                        {
+                            "_source": lexical_search._chunk_to_document(
+                                sample_document_chunk
+                            ),
+                            "_score": 2.0,
+                        }
+                    ]
+                }
+            }
+
+        client.search_template.side_effect = slow_search_template
+
+        tasks = [
+            asyncio.create_task(lexical_search.search("fattura elettronica"))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+        assert client.search_template.await_count == 1
+        assert all(r[0].score == 2.0 for r in results)
+        # Ogni chiamante riceve la propria copia
+        assert results[0][0] is not results[1][0]
+        assert lexical_search._inflight_searches == {}
+
+    @pytest.mark.asyncio
+    async def test_search_loads_images_once_off_loop(
+        self, lexical_search, sample_document_chunk
+    ):
+        """Test immagini caricate una volta per ID, in thread, con un solo log"""
+        client = lexical_search.client
+        first = sample_document_chunk.model_copy(deep=True)
+        first.metadata.image_ids = ["abc_img_0", "abc_img_1"]
+        second = sample_document_chunk.model_copy(deep=True)
+        second.metadata.id = "other_chunk"
+        second.metadata.image_ids = ["abc_img_1", "missing_img_9"]
+        client.search_template.return_value = {
+            "hits": {
+                "hits": [
+                    {"_source": lexical_search._chunk_to_document(chunk), "_score": 1.0}
+                    for chunk in (first, second)
+                ]
+            }
+        }
+
+        loaded = []
+
+        def fake_load(image_id, storage_base):
+            loaded.append((image_id, threading.get_ident()))
+            return None if image_id.startswith("missing") else {"id": image_id}
+
+        with (
+            patch.object(lexical_search.settings.image_storage, "enabled", True),
+            patch(
+                "src.rag_gestionale.retrieval.lexical_search.load_image_metadata",
+                side_effect=fake_load,
+            ),
+            patch("src.rag_gestionale.retrieval.lexical_search.logger") as mock_logger,
+        ):
+            results = await lexical_search.search("fattura elettronica")
+
+        # Un solo log di riepilogo, a livello debug
+        mock_logger.info.assert_not_called()
+        mock_logger.opt.assert_called_once_with(lazy=True)
+        summary = mock_logger.opt.return_value.debug.call_args.args
+        assert [arg() for arg in summary[1:]] == [2, 2, 2]
+
+        assert sorted(image_id for image_id, _ in loaded) == [
+            "abc_img_0",
+            "abc_img_1",
+            "missing_img_9",
+        ]
+        assert threading.get_ident() not in {thread for _, thread in loaded}
+        assert [img["id"] for img in results[0].images] == ["abc_img_0", "abc_img_1"]
+        assert [img["id"] for img in results[1].images] == ["abc_img_1"]
+
+    @pytest.mark.asyncio
+    async def test_multi_search_single_msearch(
+        self, lexical_search, sample_document_chunk
+    ):
+        """Test più query in una sola _msearch, con risposte in ordine e cache"""
+        client = lexical_search.client
+        # Senza hit filter_path rimuove "hits"
+        client.search_template.return_value = {}
+        cached = await lexical_search.search("fattura elettronica")
+        document = lexical_search._chunk_to_document(sample_document_chunk)
+        client.msearch.return_value = {
+            "responses": [
+                {"hits": {"hits": [{"_source": document, "_score": 2.0}]}},
+                {"error": {"type": "search_phase_execution_exception"}},
+                {},
+            ]
+        }
+
+        results = await lexical_search.multi_search(
+            ["iva", "fattura elettronica", "errore", "iva", "registri"]
+        )
+
+        # Una sola richiesta per le query non in cache, ripetute incluse
+        client.msearch.assert_awaited_once()
+        body = client.msearch.call_args.kwargs["body"]
+        assert len(body) == 6
+        assert body[0]["index"] == lexical_search.index_name
+        assert body[1] == {
+            **lexical_search._build_search_query("iva"),
+            "size": 20,
+            "_source": list(body[1]["_source"]),
+        }
+
+        assert results[1] == cached == []
+        assert [r.chunk.metadata.id for r in results[0]] == [
+            sample_document_chunk.metadata.id
+        ]
+        assert results[3][0].score == 2.0 and results[3][0] is not results[0][0]
+        assert results[2] == results[4] == []
+
+        # In cache le risposte valide, non quelle in errore
+        await lexical_search.multi_search(["iva", "registri", "errore"])
+        assert len(client.msearch.call_args.kwargs["body"]) == 2
+
+    @pytest.mark.asyncio
+    async def test_search_requests_only_needed_fields(
+        self, lexical_search, sample_document_chunk
+    ):
+        """Test _source limitato ai campi usati e risposta filtrata"""
+        client = lexical_search.client
+        document = lexical_search._chunk_to_document(sample_document_chunk)
+        # Con filter_path una ricerca senza hit restituisce un oggetto vuoto
+        client.search.return_value = {}
+        lexical_search._search_template_ready = False
+
+        assert await lexical_search.search("nessun risultato") == []
+        kwargs = client.search.call_args.kwargs
+        assert set(document) <= set(kwargs["_source_includes"])
+        assert kwargs["filter_path"] == "hits.hits._source,hits.hits._score"
+        assert kwargs["request_cache"] is True
+        assert kwargs["preference"] == "_local"
+
+    @pytest.mark.asyncio
+    async def test_search_lite_source_fields(
+        self, lexical_search, sample_document_chunk
+    ):
+        """Test ricerca senza testo: campi ridotti e chunk con contenuto vuoto"""
+        client = lexical_search.client
+        document = lexical_search._chunk_to_document(sample_document_chunk)
+        lite_document = {
+            field: value
+            for field, value in document.items()
+            if field in LITE_SOURCE_FIELDS
+        }
+        client.search_template.return_value = {
+            "hits": {"hits": [{"_source": lite_document, "_score": 1.5}]}
+        }
+
+        results = await lexical_search.search(
+            "fattura", source_fields=LITE_SOURCE_FIELDS
+        )
+
+        params = client.search_template.call_args.kwargs["body"]["params"]
+        assert "content" not in params["source"]
+        assert "breadcrumbs" not in params["source"]
+        assert results[0].chunk.content == ""
+        assert results[0].chunk.metadata.id == sample_document_chunk.metadata.id
+
+        # Campi diversi, voce di cache diversa
+        await lexical_search.search("fattura")
+        assert client.search_template.await_count == 2
+        assert (
+            "content"
+            in client.search_template.call_args.kwargs["body"]["params"]["source"]
+        )
+
+    @pytest.mark.asyncio
+    async def test_search_uses_stored_template(self, lexical_search):
+        """Test template registrato all'avvio e ricerca con soli parametri"""
+        client = lexical_search.client
+        client.put_script.assert_awaited_once()
+        assert client.put_script.call_args.kwargs["id"] == "rag_bm25"
+        client.search_template.return_value = {}
+
+        await lexical_search.search("E001", top_k=7, filters={"module": "CONT"})
+
+        client.search.assert_not_awaited()
+        kwargs = client.search_template.call_args.kwargs
+        assert kwargs["params"] == {"request_cache": "true"}
+        assert kwargs["preference"] == "_local"
+        body = kwargs["body"]
+        assert body["id"] == "rag_bm25"
+        params = body["params"]
+        assert params["size"] == 7
+        assert params["error_code"] is True
+        assert params["filters"] == [{"term": {"module": "CONT"}}]
+
+    def test_search_template_matches_explicit_query(self, lexical_search):
+        """Test template Mustache equivalente alla query costruita in Python"""
+        for query, filters in (
+            ("E001", {"module": "CONT", "version": None}),
+            ('come configurare "l\'IVA"', None),
+            ("iva", None),
+        ):
+            params = lexical_search._search_params(query, filters)
+            rendered = _render_mustache(
+                SEARCH_TEMPLATE_SOURCE, {**params, "size": 5, "source": ["title"]}
+            )
+            expected = lexical_search._build_search_query(query, filters)
+            expected = json.loads(json.dumps(expected))
+            assert rendered == {**expected, "size": 5, "_source": ["title"]}
+
+    def test_early_termination_opt_in(self, lexical_search):
+        """Test terminate_after solo se configurato, anche nel template"""
+        assert "terminate_after" not in lexical_search._build_search_query(
+            "iva", top_k=5
+        )
+
+        with patch.object(
+            lexical_search.settings.lexical_search, "terminate_after_factor", 10
+        ):
+            assert "terminate_after" not in lexical_search._build_search_query("iva")
+            small = lexical_search._build_search_query("iva", top_k=5)
+            large = lexical_search._build_search_query("iva", top_k=50)
+            params = lexical_search._search_params("iva", top_k=50)
+
+        assert small["terminate_after"] == 200
+        assert large["terminate_after"] == 500
+        assert small["track_total_hits"] is False
+        rendered = _render_mustache(
+            SEARCH_TEMPLATE_SOURCE, {**params, "size": 50, "source": ["title"]}
+        )
+        expected = json.loads(json.dumps(large))
+        assert rendered == {**expected, "size": 50, "_source": ["title"]}
+
+    @pytest.mark.asyncio
+    async def test_search_paginated_with_pit(
+        self, lexical_search, sample_document_chunk
+    ):
+        """Test paginazione con point-in-time e search_after per top_k elevati"""
+        client = lexical_search.client
+        client.create_pit = AsyncMock(return_value={"pit_id": "pit-1"})
+        client.delete_pit = AsyncMock()
+        document = lexical_search._chunk_to_document(sample_document_chunk)
+
+        def page(count, offset):
+            return {
+                "pit_id": "pit-2",
+                "hits": {
+                    "hits": [
+                        {"_source": document, "_score": 1.0, "sort": [1.0, str(i)]}
+                        for i in range(offset, offset + count)
+                    ]
+                },
+            }
+
+        client.search.side_effect = [page(200, 0), page(200, 200), page(50, 400)]
+
+        results = await lexical_search.search("fattura elettronica", top_k=1500)
+
+        assert len(results) == 450
+        calls = client.search.call_args_list
+        assert len(calls) == 3
+        first_body = calls[0].kwargs["body"]
+        assert "rescore" not in first_body
+        assert first_body["track_total_hits"] is False
+        assert first_body["sort"] == [{"_score": "desc"}, {"chunk_id": "asc"}]
+        assert "index" not in calls[0].kwargs
+        assert calls[1].kwargs["body"]["pit"]["id"] == "pit-2"
+        assert calls[2].kwargs["body"]["search_after"] == [1.0, "399"]
+        client.delete_pit.assert_awaited_once_with(body={"pit_id": ["pit-2"]})
+
+    @pytest.mark.asyncio
+    async def test_delete_chunks_by_url_single_request(self, lexical_search):
+        """Test cancellazione per URL senza count, attesa o in background"""
+        client = lexical_search.client
+        client.count = AsyncMock()
+        client.delete_by_query = AsyncMock(return_value={"deleted": 7})
+        generation = lexical_search._generation
+
+        deleted = await lexical_search.delete_chunks_by_url("https://example.com/doc")
+
+        assert deleted == 7
+        client.count.assert_not_awaited()
+        kwargs = client.delete_by_query.call_args.kwargs
+        assert kwargs["wait_for_completion"] is True
+        assert kwargs["slices"] == "auto"
+        assert kwargs["conflicts"] == "proceed"
+        assert kwargs["refresh"] is True
+        assert lexical_search._generation == generation + 1
+
+        # Nessun chunk eliminato: cache invariata
+        client.delete_by_query.return_value = {"deleted": 0}
+        assert await lexical_search.delete_chunks_by_url("https://example.com") == 0
+        assert lexical_search._generation == generation + 1
+
+        client.delete_by_query.return_value = {"task": "node:1"}
+        task_id = await lexical_search.delete_chunks_by_url(
+            "https://example.com/doc", wait=False
+        )
+        assert task_id == "node:1"
+        kwargs = client.delete_by_query.call_args.kwargs
+        assert kwargs["wait_for_completion"] is False
+        assert kwargs["refresh"] is False
+        assert lexical_search._generation == generation + 2
+
+    @pytest.mark.asyncio
+    async def test_delete_chunk_refresh_before_invalidate(self, lexical_search):
+        """Test chunk eliminato non più ricercabile prima dell'invalidazione"""
+        events = []
+
+        async def delete(**kwargs):
+            events.append(("delete", kwargs["refresh"]))
+
+        lexical_search.client.delete = AsyncMock(side_effect=delete)
+        with patch.object(
+            lexical_search,
+            "invalidate",
+            side_effect=lambda: events.append("invalidate"),
+        ):
+            assert await lexical_search.delete_chunk("chunk_1") is True
+
+        assert events == [("delete", True), "invalidate"]
+
+    @pytest.mark.asyncio
+    async def test_delete_chunks_by_url_refresh_before_invalidate(self, lexical_search):
+        """Test cancellazione visibile alle ricerche prima dell'invalidazione"""
+        events = []
+
+        async def delete_by_query(**kwargs):
+            events.append(("delete_by_query", kwargs["refresh"]))
+            return {"deleted": 2}
+
+        lexical_search.client.delete_by_query = AsyncMock(side_effect=delete_by_query)
+        with patch.object(
+            lexical_search,
+            "invalidate",
+            side_effect=lambda: events.append("invalidate"),
+        ):
+            await lexical_search.delete_chunks_by_url("https://example.com/doc")
+
+        assert events == [("delete_by_query", True), "invalidate"]
+
+    @pytest.mark.asyncio
+    async def test_get_chunks_by_ids_single_request(
+        self, lexical_search, sample_document_chunk
+    ):
+        """Test recupero di più chunk con una sola mget, ordine preservato"""
+        client = lexical_search.client
+        document = lexical_search._chunk_to_document(sample_document_chunk)
+        client.mget = AsyncMock(
+            return_value={
+                "docs": [
+                    {"_id": "missing", "found": False},
+                    {"_id": document["chunk_id"], "found": True, "_source": document},
+                ]
+            }
+        )
+
+        chunks = await lexical_search.get_chunks_by_ids(
+            ["missing", document["chunk_id"]]
+        )
+
+        assert chunks[0] is None
+        assert chunks[1].metadata.id == sample_document_chunk.metadata.id
+        client.mget.assert_awaited_once()
+        assert client.mget.call_args.kwargs["body"] == {
+            "ids": ["missing", document["chunk_id"]]
+        }
+        assert await lexical_search.get_chunks_by_ids([]) == []
+
+    def test_chunk_to_document_skips_empty_fields(
+        self, lexical_search, sample_document_chunk
+    ):
+        """Test campi opzionali vuoti non indicizzati, conversione invariata"""
+        chunk = sample_document_chunk.model_copy(deep=True)
+        chunk.metadata.param_name = None
+        chunk.metadata.error_code = None
+        chunk.metadata.breadcrumbs = []
+        chunk.metadata.image_ids = []
+
+        document = lexical_search._chunk_to_document(chunk)
+
+        for field in ("param_name", "error_code", "breadcrumbs", "image_ids"):
+            assert field not in document
+
+        restored = lexical_search._document_to_chunk(document)
+        assert restored.metadata.param_name is None
+        assert restored.metadata.breadcrumbs == []
+        assert restored.metadata.image_ids == []
+        assert restored.content == chunk.content
+
+    def test_breadcrumbs_indexed_as_array(self, lexical_search, sample_document_chunk):
+        """Test breadcrumbs come array, con lettura dei documenti già indicizzati"""
+        chunk = sample_document_chunk.model_copy(deep=True)
+        chunk.metadata.breadcrumbs = ["Contabilità", "Fatture", "Emissione"]
+
+        document = lexical_search._chunk_to_document(chunk)
+        assert document["breadcrumbs"] == ["Contabilità", "Fatture", "Emissione"]
+        restored = lexical_search._document_to_chunk(document)
+        assert restored.metadata.breadcrumbs == chunk.metadata.breadcrumbs
+
+        # Formato precedente: stringa unita con " > "
+        document["breadcrumbs"] = "Contabilità > Fatture > Emissione"
+        restored = lexical_search._document_to_chunk(document)
+        assert restored.metadata.breadcrumbs == chunk.metadata.breadcrumbs
+
+    def test_document_to_chunk_matches_validated_model(
+        self, lexical_search, sample_document_chunk
+    ):
+        """Test chunk senza validazione identico a quello validato da pydantic"""
+        document = lexical_search._chunk_to_document(sample_document_chunk)
+
+        restored = lexical_search._document_to_chunk(document)
+        validated = DocumentChunk.model_validate(restored.model_dump())
+
+        assert restored.model_dump() == validated.model_dump()
+        assert restored.metadata.updated_at == (
+            sample_document_chunk.metadata.updated_at
+        )
+        assert restored.metadata.child_chunk_ids == []
+
+    @pytest.mark.asyncio
+    async def test_add_empty_chunks(self, lexical_search):
+        """Test aggiunta lista vuota di chunk"""
+        with patch(
+            "src.rag_gestionale.retrieval.lexical_search.async_streaming_bulk",
+        ) as mock_bulk:
+            await lexical_search.add_chunks([])
+
+        mock_bulk.assert_not_called()
+
+    def test_build_search_query_error_code(self, lexical_search):
+        """Test clausola term sul codice errore solo se la query è un codice"""
+        body = lexical_search._build_search_query(" err-1234 ")
+        code_query = _scoring_queries(body)[1]["constant_score"]
+        assert code_query["filter"] == {"term": {"error_code": "ERR-1234"}}
+        # Nessuna espansione fuzzy per i codici
+        assert "rescore" not in body
+
+        body = lexical_search._build_search_query("come configurare l'IVA")
+        assert len(_scoring_queries(body)) == 1
+        # Conversione in maiuscolo solo per i codici
+        params = lexical_search._search_params("fattura")
+        assert params["error_code"] is False
+        assert params["error_code_value"] == ""
+
+    def test_build_search_query_dis_max(self, lexical_search):
+        """Test codice errore e testo combinati con dis_max, filtri separati"""
+        body = lexical_search._build_search_query("E001", filters={"module": "CONT"})
+        bool_query = body["query"]["bool"]
+
+        assert "should" not in bool_query
+        assert bool_query["must"]["dis_max"]["tie_breaker"] == 0.1
+        assert bool_query["filter"] == [{"term": {"module": "CONT"}}]
+
+    def test_build_search_query_boost_fields(self, lexical_search):
+        """Test campi di default precalcolati e override dei boost"""
+        first = _scoring_queries(lexical_search._build_search_query("fattura"))
+        second = _scoring_queries(lexical_search._build_search_query("cliente"))
+        fields = first[0]["multi_match"]["fields"]
+        assert second[0]["multi_match"]["fields"] is fields
+        assert fields is lexical_search._default_fields
+
+        body = lexical_search._build_search_query("E001", boost_params={"title": 3.0})
+        queries = _scoring_queries(body)
+        assert queries[0]["multi_match"]["fields"][0] == "title^3.0"
+        assert queries[1]["constant_score"]["boost"] == (
+            lexical_search.settings.retrieval.error_code_boost
+        )
+
+    def test_build_search_query_fuzzy_rescore(self, lexical_search):
+        """Test query esatta cross_fields con fuzziness solo nel rescore"""
+        body = lexical_search._build_search_query("fatura elettronica")
+        multi_match = _scoring_queries(body)[0]["multi_match"]
+        assert multi_match["type"] == "cross_fields"
+        assert "fuzziness" not in multi_match
+
+        rescore = body["rescore"]
+        assert rescore["window_size"] == 50
+        fuzzy = rescore["query"]["rescore_query"]["multi_match"]
+        assert fuzzy["fuzziness"] == "AUTO"
+        assert fuzzy["prefix_length"] == 2
+        assert fuzzy["fields"] == multi_match["fields"][:2]
+        assert fuzzy["fields"][1] == "content"
+        assert rescore["query"]["rescore_query_weight"] == 0.6
+
+    def test_build_search_query_short_without_fuzziness(self, lexical_search):
+        """Test niente rescore fuzzy su query brevi"""
+        body = lexical_search._build_search_query("iva")
+        assert "rescore" not in body
+
+
+def _render_mustache(template, params):
+    """Rendering del sottoinsieme Mustache usato dal search template"""
+    rendered = re.sub(
+        r"\{\{#toJson\}\}(\w+)\{\{/toJson\}\}",
+        lambda m: json.dumps(params[m.group(1)]),
+        template,
+    )
+    rendered = re.sub(
+        r"\{\{#(\w+)\}\}(.*?)\{\{/\1\}\}",
+        lambda m: m.group(2) if params[m.group(1)] else "",
+        rendered,
+        flags=re.DOTALL,
+    )
+    rendered = re.sub(
+        r"\{\{(\w+)\}\}", lambda m: json.dumps(params[m.group(1)]), rendered
+    )
+    return json.loads(rendered)
+
+
+def _scoring_queries(body):
+    """Sottoquery che concorrono allo score"""
+    return body["query"]["bool"]["must"]["dis_max"]["queries"]
+
+
+@pytest.mark.unit
+@pytest.mark.skipif(not HAS_ORJSON, reason="orjson non installato")
+def test_orjson_serializer_matches_json(sample_document_chunk):
+    """Test stesso output del serializer standard, con tipi numpy e accenti"""
+    lexical = LexicalSearch()
+    document = lexical._chunk_to_document(sample_document_chunk)
+    document["title"] = "Contabilità"
+    document["section_level"] = np.int64(2)
+
+    serializer = OrjsonSerializer()
+    encoded = serializer.dumps(document)
+
+    assert encoded == JSONSerializer().dumps(document)
+    assert serializer.loads(encoded)["title"] == "Contabilità"
+    assert serializer.dumps('{"index":{}}') == '{"index":{}}'
@@ -91,6 +91,23 @@ class TestPDFSection:
 
         assert section.content_type == ContentType.FAQ
 
+    def test_classification_is_lazy(self):
+        """Test che la classificazione usi il contenuto finale della sezione"""
+        section = PDFSection(
+            title="Messaggi",
+            content="",
+            level=1,
+            page_start=1,
+            page_end=1,
+        )
+        section.content = "Il sistema mostra il codice ERR-042 in fase di stampa"
+
+        assert section.error_codes == ["ERR-042"]
+        assert section.content_type == ContentType.ERROR
+
+        section.content_type = ContentType.TABLE
+        assert section.content_type == ContentType.TABLE
+
 
 @pytest.mark.unit
 class TestPDFParser:
@@ -118,6 +135,25 @@ class TestPDFParser:
         assert "source_url" in metadata
         assert "page_count" in metadata
 
+    def test_parse_many(self, temp_pdf_file, tmp_path):
+        """Test parsing parallelo di più PDF"""
+        import shutil
+
+        second_pdf = tmp_path / "second.pdf"
+        shutil.copyfile(temp_pdf_file, second_pdf)
+        paths = [str(temp_pdf_file), str(second_pdf)]
+
+        results = PDFParser.parse_many(paths, workers=2)
+
+        assert len(results) == 2
+        assert [metadata["source_url"] for _, metadata in results] == [
+            f"file://{path}" for path in paths
+        ]
+
+    def test_parse_many_empty(self):
+        """Test parsing parallelo senza file"""
+        assert PDFParser.parse_many([]) == []
+
     def test_extract_metadata(self, parser, temp_pdf_file):
         """Test estrazione metadati PDF"""
         import fitz
@@ -209,6 +245,133 @@ class TestPDFParser:
         finally:
             doc.close()
 
+    def test_extract_sections_detects_headings(self, parser):
+        """Test che i blocchi con font di heading aprano nuove sezioni"""
+        import fitz
+
+        doc = fitz.open()
+        try:
+            page = doc.new_page()
+            page.insert_text((72, 72), "1. Configurazione", fontsize=20)
+            page.insert_text((72, 120), "Testo descrittivo del modulo. " * 3)
+
+            heading_fonts = {("helvetica", 20.0, 0): 1}
+            sections = parser._extract_sections(doc, heading_fonts)
+
+            assert len(sections) == 1
+            assert sections[0].title == "1. Configurazione"
+            assert sections[0].level == 1
+            assert "Testo descrittivo" in sections[0].content
+        finally:
+            doc.close()
+
+    def test_extract_sections_body_only_page(self, parser):
+        """Test che le pagine senza font di heading proseguano la sezione"""
+        import fitz
+
+        doc = fitz.open()
+        try:
+            first = doc.new_page()
+            first.insert_text((72, 72), "2. Stampa", fontname="tibo", fontsize=20)
+            first.insert_text((72, 120), "Prima parte della procedura di stampa.")
+            second = doc.new_page()
+            second.insert_text((72, 72), "Seconda parte della procedura di stampa.")
+
+            heading_fonts = {("times-bold", 20.0, 20): 1}
+
+            assert parser._page_may_have_headings(doc[0], {"times-bold"})
+            assert not parser._page_may_have_headings(doc[1], {"times-bold"})
+
+            sections = parser._extract_sections(doc, heading_fonts)
+
+            assert len(sections) == 1
+            assert sections[0].title == "2. Stampa"
+            assert sections[0].page_end == 2
+            assert "Seconda parte" in sections[0].content
+        finally:
+            doc.close()
+
+    def test_find_table_pages(self, parser):
+        """Test che solo le pagine con linee disegnate siano candidate"""
+        import fitz
+
+        doc = fitz.open()
+        try:
+            doc.new_page().insert_text((72, 72), "Pagina solo testo")
+            table_page = doc.new_page()
+            table_page.draw_rect(fitz.Rect(72, 72, 300, 200))
+            table_page.draw_line(fitz.Point(72, 136), fitz.Point(300, 136))
+
+            assert parser._find_table_pages(doc) == [2]
+        finally:
+            doc.close()
+
+    def test_find_table_pages_ignores_rules(self, parser):
+        """Test che le sole righe orizzontali non rendano la pagina candidata"""
+        import fitz
+
+        doc = fitz.open()
+        try:
+            page = doc.new_page()
+            page.draw_line(fitz.Point(72, 40), fitz.Point(520, 40))
+            page.draw_line(fitz.Point(72, 800), fitz.Point(520, 800))
+            grid_page = doc.new_page()
+            grid_page.draw_line(fitz.Point(72, 100), fitz.Point(300, 100))
+            grid_page.draw_line(fitz.Point(72, 100), fitz.Point(72, 200))
+
+            assert parser._find_table_pages(doc) == [2]
+        finally:
+            doc.close()
+
+    def test_build_page_index(self, parser):
+        """Test indice pagina -> sezione"""
+        sections = [
+            PDFSection("A", "", 1, page_start=1, page_end=2),
+            PDFSection("B", "", 1, page_start=2, page_end=3),
+            PDFSection("C", "", 1, page_start=5, page_end=5),
+        ]
+
+        page_index = parser._build_page_index(sections)
+
+        assert page_index == [-1, 0, 0, 1, -1, 2]
+        assert parser._build_page_index([]) == [-1]
+
+    def test_extract_tables_assigns_section_by_page(self, parser):
+        """Test associazione delle tabelle camelot alla sezione della pagina"""
+        from unittest.mock import MagicMock, patch
+
+        import pandas as pd
+
+        sections = [
+            PDFSection("A", "", 1, page_start=1, page_end=2),
+            PDFSection("B", "", 1, page_start=3, page_end=4),
+        ]
+        table = MagicMock()
+        table.df = pd.DataFrame({"Campo": ["Valore"]})
+        table.parsing_report = {"page": 4}
+
+        with patch(
+            "src.rag_gestionale.ingest.pdf_parser.camelot.read_pdf",
+            return_value=[table],
+        ) as mock_read:
+            parser._extract_tables("dummy.pdf", sections, table_pages=[4])
+
+        mock_read.assert_called_once_with("dummy.pdf", pages="4", flavor="lattice")
+        assert sections[0].tables == []
+        assert len(sections[1].tables) == 1
+        assert sections[1].content_type == ContentType.TABLE
+
+    def test_extract_tables_without_candidate_pages(self, parser):
+        """Test che camelot non venga invocato senza pagine candidate"""
+        from unittest.mock import patch
+
+        with patch(
+            "src.rag_gestionale.ingest.pdf_parser.camelot.read_pdf"
+        ) as mock_read:
+            parser._extract_tables("dummy.pdf", [], table_pages=[])
+
+        mock_read.assert_not_called()
+
     def test_table_to_markdown_simple(self, parser):
         """Test conversione tabella in Markdown"""
         import pandas as pd
@@ -242,6 +405,26 @@ class TestPDFParser:
         # Il pipe nei dati dovrebbe essere escaped
         assert "\\|" in markdown or "|" in markdown
 
+    def test_table_to_markdown_skips_empty_rows(self, parser):
+        """Test che righe vuote vengano scartate e le celle ripulite"""
+        import pandas as pd
+
+        df = pd.DataFrame(
+            {
+                "A": [" x|y ", None, ""],
+                "B": ["1", None, "2"],
+            }
+        )
+
+        markdown = parser._table_to_markdown(df)
+
+        assert markdown.split("\n") == [
+            "| A | B |",
+            "| --- | --- |",
+            "| x\\|y | 1 |",
+            "|  | 2 |",
+        ]
+
     def test_table_to_markdown_empty(self, parser):
         """Test conversione tabella vuota"""
         import pandas as pd
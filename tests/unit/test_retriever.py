@@ -6,10 +6,12 @@ from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
+from src.rag_gestionale.core.cache import TTLCache
 from src.rag_gestionale.core.models import QueryType, SearchResult
 from src.rag_gestionale.retrieval.hybrid_retriever import (
     HybridRetriever,
     QueryClassifier,
+    _ScoreBatch,
 )
 
 
@@ -35,6 +37,43 @@ class TestQueryClassifier:
             result = classifier.classify_query(query)
             assert result == QueryType.ERROR, f"Failed for query: {query}"
 
+    def test_classify_error_code_case_sensitive(self, classifier):
+        """Test che i codici errore siano riconosciuti solo in maiuscolo"""
+        assert classifier.classify_query("ERR-042 in chiusura") == QueryType.ERROR
+        assert classifier.classify_query("migrazione sql2019") == QueryType.GENERAL
+
+    def test_classify_priority(self, classifier):
+        """Test che gli errori abbiano priorità anche se compaiono dopo"""
+        query = "come impostare la stampa se compare un errore"
+        assert classifier.classify_query(query) == QueryType.ERROR
+
+    def test_classify_procedure_requires_word_after_verb(self, classifier):
+        """Test del pattern lineare "configurare/impostare" seguito da una parola"""
+        assert classifier.classify_query("impostare (stampante)") == QueryType.PROCEDURE
+        assert classifier.classify_query("impostare !!") == QueryType.GENERAL
+        # Input lungo senza match: nessun backtracking esponenziale
+        assert classifier.classify_query("configurare " + "! " * 5000) == (
+            QueryType.GENERAL
+        )
+
+    def test_classify_hyperscan_matches_re(self, classifier):
+        """Test che il backend Hyperscan classifichi come quello re"""
+        pytest.importorskip("hyperscan")
+        re_classifier = QueryClassifier()
+        re_classifier._hs_database = None
+
+        queries = [
+            "errore ERR-001",
+            "migrazione sql2019",
+            "come impostare il parametro IVA",
+            "procedura di chiusura",
+            "cos'è il gestionale",
+        ]
+        for query in queries:
+            assert classifier.classify_query(query) == re_classifier.classify_query(
+                query
+            )
+
     def test_classify_parameter_query(self, classifier):
         """Test classificazione query parametro"""
         queries = [
@@ -176,6 +215,43 @@ class TestHybridRetriever:
 
         assert isinstance(results, list)
 
+    @pytest.mark.asyncio
+    async def test_search_coalesces_identical_queries(self, retriever):
+        """Test che query identiche concorrenti condividano la stessa ricerca"""
+        import asyncio
+
+        first, second = await asyncio.gather(
+            retriever.search("parametro IVA", top_k=5, filters={"module": "A"}),
+            retriever.search("parametro IVA", top_k=5, filters={"module": "A"}),
+        )
+
+        assert retriever.vector_store.search.await_count == 1
+        assert retriever.lexical_search.search.await_count == 1
+        assert first == second
+        assert first is not second
+        assert retriever._inflight == {}
+
+        # Filtri diversi: ricerca separata
+        await asyncio.gather(
+            retriever.search("parametro IVA", top_k=5, filters={"module": "A"}),
+            retriever.search("parametro IVA", top_k=5, filters={"module": "B"}),
+        )
+        assert retriever.vector_store.search.await_count == 3
+
+    @pytest.mark.asyncio
+    async def test_search_classifies_during_vector_search(self, retriever):
+        """Test che la ricerca densa parta prima della classificazione"""
+        results = await retriever.search("come configurare il parametro", top_k=5)
+
+        assert isinstance(results, list)
+        vector_kwargs = retriever.vector_store.search.call_args.kwargs
+        assert vector_kwargs["top_k"] == retriever._max_k_dense
+        # I boost lessicali seguono il tipo classificato
+        lexical_kwargs = retriever.lexical_search.search.call_args.kwargs
+        assert lexical_kwargs["boost_params"] is retriever._get_boost_params(
+            QueryType.PARAMETER
+        )
+
     @pytest.mark.asyncio
     async def test_search_auto_classification(self, retriever):
         """Test classificazione automatica query"""
@@ -195,6 +271,19 @@ class TestHybridRetriever:
         assert retriever.vector_store.add_chunks.called
         assert retriever.lexical_search.add_chunks.called
 
+    def test_combine_results_section_ids(self, retriever, sample_chunks_list):
+        """Test id di sezione uguali solo per chunk della stessa sezione"""
+        results = [
+            SearchResult(chunk=chunk, score=0.5, explanation="", images=[])
+            for chunk in sample_chunks_list
+        ]
+        batch = retriever._combine_results(results, [])
+
+        sections = [r.chunk.metadata.section_path or "unknown" for r in batch.refs]
+        ids_by_section = dict(zip(sections, batch.section_ids.tolist(), strict=True))
+        assert len(set(ids_by_section.values())) == len(ids_by_section)
+        assert batch.section_ids.tolist() == [ids_by_section[s] for s in sections]
+
     @pytest.mark.asyncio
     async def test_delete_chunks_by_url(self, retriever):
         """Test eliminazione chunk per URL"""
@@ -215,6 +304,21 @@ class TestHybridRetriever:
         # Con i mock dovrebbe ritornare None
         assert chunk is None
 
+    @pytest.mark.asyncio
+    async def test_get_chunks_by_ids(
+        self, retriever, mock_vector_store, mock_lexical_search, sample_chunks_list
+    ):
+        """Test recupero in batch con fallback sul vector store"""
+        first, second = sample_chunks_list[:2]
+        mock_lexical_search.get_chunks_by_ids = AsyncMock(return_value=[first, None])
+        mock_vector_store.get_chunks_by_ids = AsyncMock(return_value=[second])
+
+        chunks = await retriever.get_chunks_by_ids(["id_1", "id_2"])
+
+        assert chunks == [first, second]
+        mock_lexical_search.get_chunks_by_ids.assert_awaited_once_with(["id_1", "id_2"])
+        mock_vector_store.get_chunks_by_ids.assert_awaited_once_with(["id_2"])
+
     @pytest.mark.asyncio
     async def test_delete_chunk(self, retriever):
         """Test eliminazione singolo chunk"""
@@ -276,6 +380,15 @@ class TestHybridRetriever:
         assert "param_name" in boosts
         assert boosts["param_name"] > 1.0
 
+    def test_get_boost_params_read_only(self, retriever):
+        """Test che i boost siano precalcolati e non modificabili"""
+        boosts = retriever._get_boost_params(QueryType.GENERAL)
+
+        assert boosts is retriever._get_boost_params(QueryType.GENERAL)
+        assert boosts["title"] == retriever.settings.retrieval.title_boost
+        with pytest.raises(TypeError):
+            boosts["title"] = 10.0
+
     def test_get_boost_params_procedure(self, retriever):
         """Test boost per query procedura"""
         boosts = retriever._get_boost_params(QueryType.PROCEDURE)
@@ -288,7 +401,9 @@ class TestHybridRetriever:
         vector_results = sample_search_results[:2]
         lexical_results = sample_search_results[1:3]
 
-        combined = retriever._combine_results(vector_results, lexical_results)
+        combined = retriever._combine_results(
+            vector_results, lexical_results
+        ).materialize()
 
         assert len(combined) >= 2
         # Dovrebbe contenere risultati da entrambe le sorgenti
@@ -297,6 +412,58 @@ class TestHybridRetriever:
         for i in range(len(combined) - 1):
             assert combined[i].score >= combined[i + 1].score
 
+    def test_combine_results_scores(self, retriever, sample_chunks_list):
+        """Test normalizzazione e fusione pesata degli score"""
+        chunk_a, chunk_b, chunk_c = sample_chunks_list[:3]
+        vector_results = [
+            SearchResult(chunk=chunk_a, score=1.0, explanation="", images=[]),
+            SearchResult(chunk=chunk_b, score=0.5, explanation="", images=[]),
+        ]
+        lexical_results = [
+            SearchResult(
+                chunk=chunk_b, score=2.0, explanation="", images=[{"id": "img1"}]
+            ),
+            SearchResult(chunk=chunk_c, score=1.0, explanation="", images=[]),
+        ]
+
+        combined = retriever._combine_results(
+            vector_results, lexical_results
+        ).materialize()
+
+        assert [r.chunk.metadata.id for r in combined] == [
+            chunk_a.metadata.id,
+            chunk_b.metadata.id,
+            chunk_c.metadata.id,
+        ]
+        # alpha = 0.7: 0.7 * 1.0 | 0.7 * 0.5 + 0.3 * 1.0 | 0.3 * 0.5
+        assert [r.score for r in combined] == pytest.approx([0.7, 0.65, 0.15])
+        assert [r.explanation.split(":")[0] for r in combined] == [
+            "Vector",
+            "Hybrid",
+            "Lexical",
+        ]
+        assert combined[1].images == [{"id": "img1"}]
+
+    def test_combine_results_limit(self, retriever, sample_chunks_list):
+        """Test che limit restituisca solo i migliori risultati, in ordine"""
+        chunk_a, chunk_b, chunk_c = sample_chunks_list[:3]
+        vector_results = [
+            SearchResult(chunk=chunk_a, score=0.2, explanation="", images=[]),
+            SearchResult(chunk=chunk_b, score=1.0, explanation="", images=[]),
+        ]
+        lexical_results = [
+            SearchResult(chunk=chunk_c, score=1.0, explanation="", images=[]),
+        ]
+
+        combined = retriever._combine_results(
+            vector_results, lexical_results, limit=2
+        ).materialize()
+
+        assert [r.chunk.metadata.id for r in combined] == [
+            chunk_b.metadata.id,
+            chunk_c.metadata.id,
+        ]
+
     def test_combine_results_deduplication(self, retriever, sample_search_results):
         """Test deduplicazione nella combinazione risultati"""
         # Stesso risultato in entrambe le liste
@@ -304,7 +471,9 @@ class TestHybridRetriever:
         vector_results = [same_result]
         lexical_results = [same_result]
 
-        combined = retriever._combine_results(vector_results, lexical_results)
+        combined = retriever._combine_results(
+            vector_results, lexical_results
+        ).materialize()
 
         # Dovrebbe contenere solo un risultato (deduplicato)
         assert len(combined) == 1
@@ -314,19 +483,144 @@ class TestHybridRetriever:
         """Test reranking con cross-encoder"""
         query = "test query"
 
-        reranked = await retriever._rerank_results(query, sample_search_results)
+        reranked = (
+            await retriever._rerank_results(
+                query, _ScoreBatch.from_results(sample_search_results)
+            )
+        ).materialize()
 
         assert len(reranked) == len(sample_search_results)
         # Dovrebbe aver aggiornato gli score
         assert all("Reranked" in r.explanation for r in reranked)
 
+    @pytest.mark.asyncio
+    async def test_rerank_length_sorted_batches(self, retriever, sample_chunks_list):
+        """Test che le coppie siano ordinate per lunghezza e gli score riallineati"""
+        import numpy as np
+
+        results = [
+            SearchResult(chunk=chunk, score=0.5, explanation="", images=[])
+            for chunk in sample_chunks_list[:3]
+        ]
+        results[0].chunk.content = "x" * 150
+        results[1].chunk.content = "x"
+        results[2].chunk.content = "x" * 50
+        # Il reranker assegna come score la lunghezza della coppia
+        retriever.reranker.predict = MagicMock(
+            side_effect=lambda pairs, **kwargs: np.array(
+                [len(q) + len(d) for q, d in pairs], dtype=float
+            )
+        )
+
+        reranked = (
+            await retriever._rerank_results("query", _ScoreBatch.from_results(results))
+        ).materialize()
+
+        sent_pairs = retriever.reranker.predict.call_args.args[0]
+        lengths = [len(q) + len(d) for q, d in sent_pairs]
+        assert lengths == sorted(lengths)
+        assert retriever.reranker.predict.call_args.kwargs["batch_size"] == 32
+        # Score più alto al documento più lungo
+        assert reranked[0].chunk.content == "x" * 150
+        assert reranked[-1].chunk.content == "x"
+
+    @pytest.mark.asyncio
+    async def test_rerank_uses_cache(self, retriever, sample_chunks_list):
+        """Test che le coppie già valutate non vengano rivalutate"""
+        import numpy as np
+
+        def make_results():
+            return _ScoreBatch.from_results(
+                [
+                    SearchResult(chunk=chunk, score=0.5, explanation="", images=[])
+                    for chunk in sample_chunks_list[:3]
+                ]
+            )
+
+        retriever.reranker.predict = MagicMock(
+            side_effect=lambda pairs, **kwargs: np.linspace(0.1, 0.9, len(pairs))
+        )
+
+        first = (await retriever._rerank_results("query", make_results())).refs
+        second = (await retriever._rerank_results("query", make_results())).refs
+
+        assert retriever.reranker.predict.call_count == 1
+        assert [r.chunk.metadata.id for r in first] == [
+            r.chunk.metadata.id for r in second
+        ]
+        assert [r.score for r in first] == pytest.approx([r.score for r in second])
+
+        # Query diversa: nuova valutazione
+        await retriever._rerank_results("altra query", make_results())
+        assert retriever.reranker.predict.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_rerank_runs_on_dedicated_thread(self, retriever, sample_chunks_list):
+        """Test che l'inferenza del reranker usi il thread dedicato"""
+        import threading
+
+        import numpy as np
+
+        threads = []
+
+        def predict(pairs, **kwargs):
+            threads.append(threading.current_thread().name)
+            return np.zeros(len(pairs))
+
+        retriever.reranker.predict = MagicMock(side_effect=predict)
+        results = [
+            SearchResult(chunk=chunk, score=0.5, explanation="", images=[])
+            for chunk in sample_chunks_list[:2]
+        ]
+
+        await retriever._rerank_results("query", _ScoreBatch.from_results(results))
+
+        assert threads and threads[0].startswith("reranker")
+
+    def test_is_ranking_settled(self, retriever, sample_chunks_list):
+        """Test che il reranking venga saltato con pochi candidati o distacco ampio"""
+
+        def make_results(scores):
+            return _ScoreBatch.from_results(
+                [
+                    SearchResult(
+                        chunk=sample_chunks_list[i % len(sample_chunks_list)],
+                        score=score,
+                        explanation="",
+                        images=[],
+                    )
+                    for i, score in enumerate(scores)
+                ]
+            )
+
+        # Solo due candidati oltre top_k
+        assert retriever._is_ranking_settled(make_results([0.9, 0.8, 0.7, 0.6]), 2)
+        # Distacco oltre la soglia (0.35) tra primo e top_k-esimo
+        assert retriever._is_ranking_settled(
+            make_results([0.9, 0.5, 0.4, 0.3, 0.2, 0.1]), 2
+        )
+        # Classifica incerta: serve il reranking
+        assert not retriever._is_ranking_settled(
+            make_results([0.9, 0.8, 0.7, 0.6, 0.5, 0.4]), 2
+        )
+
+    def test_needs_rerank(self, retriever):
+        """Test che i lookup letterali saltino il reranking"""
+        assert not retriever._needs_rerank("ERR-042", QueryType.ERROR)
+        assert not retriever._needs_rerank('"chiusura esercizio"', QueryType.GENERAL)
+        assert not retriever._needs_rerank("errore ERR-042 in stampa", QueryType.ERROR)
+        assert retriever._needs_rerank("non funziona la stampa", QueryType.ERROR)
+        assert retriever._needs_rerank("come creare una fattura", QueryType.PROCEDURE)
+
     @pytest.mark.asyncio
     async def test_rerank_empty_results(self, retriever):
         """Test reranking con lista vuota"""
         query = "test query"
         results = []
 
-        reranked = await retriever._rerank_results(query, results)
+        reranked = await retriever._rerank_results(
+            query, _ScoreBatch.from_results(results)
+        )
 
         assert len(reranked) == 0
 
@@ -336,7 +630,9 @@ class TestHybridRetriever:
         for result in sample_search_results:
             result.chunk.metadata.section_path = "same/section"
 
-        diversified = retriever._diversify_results(sample_search_results)
+        diversified = retriever._diversify_results(
+            _ScoreBatch.from_results(sample_search_results)
+        ).refs
 
         # Dovrebbe limitare risultati dalla stessa sezione
         assert len(diversified) <= len(sample_search_results)
@@ -349,11 +645,35 @@ class TestHybridRetriever:
         for i, result in enumerate(sample_search_results):
             result.chunk.metadata.section_path = f"section/{i}"
 
-        diversified = retriever._diversify_results(sample_search_results)
+        diversified = retriever._diversify_results(
+            _ScoreBatch.from_results(sample_search_results)
+        ).refs
 
         # Tutti i risultati dovrebbero essere mantenuti
         assert len(diversified) == len(sample_search_results)
 
+    def test_diversify_results_top_k(self, retriever, sample_chunks_list):
+        """Test limite top_k e riempimento con i risultati in eccesso per sezione"""
+        for chunk, section in zip(
+            sample_chunks_list, ["a", "a", "a", "b"], strict=True
+        ):
+            chunk.metadata.section_path = section
+        results = [
+            SearchResult(chunk=chunk, score=0.5, explanation="", images=[])
+            for chunk in sample_chunks_list
+        ]
+
+        batch = _ScoreBatch.from_results(results)
+
+        assert retriever._diversify_results(batch, top_k=2).refs == results[:2]
+        # Il terzo risultato della sezione "a" arriva solo come riempimento
+        assert retriever._diversify_results(batch, top_k=4).refs == [
+            results[0],
+            results[1],
+            results[3],
+            results[2],
+        ]
+
     @pytest.mark.asyncio
     async def test_get_candidates(self, retriever):
         """Test ottenimento candidati da entrambi i sistemi"""
@@ -367,3 +687,115 @@ class TestHybridRetriever:
 
         assert isinstance(vector_results, list)
         assert isinstance(lexical_results, list)
+
+
+@pytest.mark.unit
+class TestOnnxCrossEncoder:
+    """Test per il reranker ONNX"""
+
+    @pytest.fixture
+    def tokenizer(self):
+        """Tokenizer Rust minimale in memoria"""
+        from tokenizers import Tokenizer
+        from tokenizers.models import WordLevel
+        from tokenizers.pre_tokenizers import Whitespace
+        from tokenizers.processors import TemplateProcessing
+
+        vocab = {"[PAD]": 0, "[UNK]": 1, "[CLS]": 2, "[SEP]": 3, "q": 4, "a": 5}
+        tokenizer = Tokenizer(WordLevel(vocab, unk_token="[UNK]"))
+        tokenizer.pre_tokenizer = Whitespace()
+        tokenizer.post_processor = TemplateProcessing(
+            single="[CLS] $A [SEP]",
+            pair="[CLS] $A [SEP] $B:1 [SEP]:1",
+            special_tokens=[("[CLS]", 2), ("[SEP]", 3)],
+        )
+        return tokenizer
+
+    def test_predict_batches_and_sigmoid(self, tokenizer):
+        """Test che predict suddivida in batch e restituisca la sigmoide dei logits"""
+        import numpy as np
+
+        from src.rag_gestionale.retrieval.onnx_reranker import (
+            OnnxCrossEncoder,
+            _resolve_pad_id,
+        )
+
+        encoder = OnnxCrossEncoder.__new__(OnnxCrossEncoder)
+        encoder.tokenizer = tokenizer
+        encoder.pad_id = _resolve_pad_id(tokenizer)
+        encoder.input_names = ["input_ids", "attention_mask"]
+        encoder._doc_cache = TTLCache(maxsize=100, ttl=60)
+        logits = iter([np.array([[0.0], [2.0]]), np.array([[-2.0]])])
+        encoder.session = MagicMock()
+        encoder.session.run.side_effect = lambda outputs, feeds: [next(logits)]
+
+        pairs = [["q", "a"], ["q", "a a a"], ["q", "a"]]
+        scores = encoder.predict(pairs, batch_size=2)
+
+        assert encoder.pad_id == 0
+        assert encoder.session.run.call_count == 2
+        feeds = encoder.session.run.call_args_list[0].args[1]
+        assert set(feeds) == {"input_ids", "attention_mask"}
+        assert feeds["input_ids"].dtype == np.int64
+        # Padding alla sequenza più lunga del batch
+        assert feeds["input_ids"].tolist() == [
+            [2, 4, 3, 5, 3, 0, 0],
+            [2, 4, 3, 5, 5, 5, 3],
+        ]
+        assert feeds["attention_mask"].sum(axis=1).tolist() == [5, 7]
+        np.testing.assert_allclose(scores, 1.0 / (1.0 + np.exp(-np.array([0, 2, -2]))))
+
+    def test_encode_pairs_reuses_documents(self, tokenizer):
+        """Test che la tokenizzazione dei documenti sia riusata tra query"""
+        from src.rag_gestionale.retrieval.onnx_reranker import OnnxCrossEncoder
+
+        tokenizer.enable_truncation(max_length=6)
+        encoder = OnnxCrossEncoder.__new__(OnnxCrossEncoder)
+        encoder.tokenizer = tokenizer
+        encoder._doc_cache = TTLCache(maxsize=100, ttl=60)
+
+        pairs = [["q q", "a a a a a"], ["q q", "a"], ["q", "a"]]
+        encodings = encoder._encode_pairs(pairs)
+
+        assert len(encoder._doc_cache) == 2
+        cached = encoder._doc_cache.get("a")
+        # Stesso risultato della codifica diretta della coppia, troncamento incluso
+        for (query, doc), encoding in zip(pairs, encodings, strict=True):
+            expected = tokenizer.encode(query, doc)
+            assert encoding.ids == expected.ids
+            assert encoding.type_ids == expected.type_ids
+
+        encoder._encode_pairs([["q", "a"]])
+        assert encoder._doc_cache.get("a") is cached
+
+
+@pytest.mark.unit
+class TestSearchDocuments:
+    """Test per l'utility search_documents"""
+
+    @pytest.mark.asyncio
+    async def test_retriever_initialized_once(self):
+        """Test che il retriever condiviso venga inizializzato una sola volta"""
+        import asyncio
+
+        from src.rag_gestionale.retrieval import hybrid_retriever
+
+        instance = MagicMock()
+        instance.initialize = AsyncMock()
+        instance.search = AsyncMock(return_value=[])
+        instance.close = AsyncMock()
+
+        with patch.object(
+            hybrid_retriever, "HybridRetriever", return_value=instance
+        ) as mock_cls:
+            await asyncio.gather(
+                hybrid_retriever.search_documents("query uno"),
+                hybrid_retriever.search_documents("query due"),
+            )
+            await hybrid_retriever.close_retriever()
+
+        assert mock_cls.call_count == 1
+        instance.initialize.assert_awaited_once()
+        assert instance.search.await_count == 2
+        instance.close.assert_awaited_once()
+        assert hybrid_retriever._retriever is None
@@ -2,11 +2,19 @@
 Unit tests per il modulo VectorStore
 """
 
+import asyncio
+import threading
+import uuid
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import numpy as np
 import pytest
+from PIL import Image
+from qdrant_client.http import models
 
 from src.rag_gestionale.core.models import DocumentChunk, SearchResult
+from src.rag_gestionale.retrieval.embedding_cache import EmbeddingCache
+from src.rag_gestionale.retrieval.image_metadata import clear_image_dir_cache
 from src.rag_gestionale.retrieval.vector_store import VectorStore
 
 
@@ -26,7 +34,7 @@ class TestVectorStore:
                 "src.rag_gestionale.retrieval.vector_store.AsyncQdrantClient"
             ) as mock_async_client,
             patch(
-                "src.rag_gestionale.retrieval.vector_store.SentenceTransformer"
+                "src.rag_gestionale.retrieval.embedding_model.SentenceTransformer"
             ) as mock_st,
         ):
             mock_async_client.return_value = mock_qdrant_client
@@ -55,6 +63,45 @@ class TestVectorStore:
         # Verifica che upsert sia stato chiamato
         assert vector_store.async_client.upsert.called
 
+    @pytest.mark.asyncio
+    async def test_add_chunks_concurrent_batches(
+        self, vector_store, sample_document_chunk
+    ):
+        """Test upsert in batch concorrenti, al massimo upsert_concurrency"""
+        chunks = []
+        for i in range(25):
+            chunk = sample_document_chunk.model_copy(deep=True)
+            chunk.metadata.id = f"chunk_{i}"
+            chunks.append(chunk)
+
+        in_flight = peak = 0
+
+        async def fake_upsert(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+        settings = vector_store.settings.vector_store
+        vector_store.async_client.upsert.side_effect = fake_upsert
+        with (
+            patch.object(settings, "upsert_batch_size", 5),
+            patch.object(settings, "upsert_concurrency", 2),
+            patch.object(
+                vector_store,
+                "_generate_embeddings_batch",
+                AsyncMock(return_value=np.ones((25, 4), dtype=np.float32)),
+            ),
+        ):
+            await vector_store.add_chunks(chunks)
+
+        calls = vector_store.async_client.upsert.call_args_list
+        assert [len(call.kwargs["points"]) for call in calls] == [5] * 5
+        # Solo l'ultimo batch, inviato dopo gli altri, attende l'applicazione
+        assert [call.kwargs["wait"] for call in calls] == [False] * 4 + [True]
+        assert peak == 2
+
     @pytest.mark.asyncio
     async def test_add_empty_chunks(self, vector_store):
         """Test aggiunta lista vuota di chunk"""
@@ -74,6 +121,129 @@ class TestVectorStore:
         # Con il mock dovrebbe ritornare lista vuota
         assert len(results) == 0
 
+    @pytest.mark.asyncio
+    async def test_collection_created_with_int8_quantization(self, vector_store):
+        """Test collection con vettori int8 in RAM e originali su disco"""
+        client = vector_store.async_client
+        client.get_collection.side_effect = Exception("not found")
+
+        await vector_store._ensure_collection_exists()
+
+        kwargs = client.create_collection.call_args.kwargs
+        assert kwargs["vectors_config"].on_disk is True
+        scalar = kwargs["quantization_config"].scalar
+        assert scalar.type == models.ScalarType.INT8
+        assert scalar.always_ram is True
+
+        await vector_store.search("fattura", top_k=5)
+        search_params = client.query_points.call_args.kwargs["search_params"]
+        assert search_params.quantization.rescore is True
+        assert search_params.quantization.oversampling == 2.0
+
+    @pytest.mark.asyncio
+    async def test_search_hnsw_ef_scales_with_top_k(self, vector_store):
+        """Test hnsw_ef pari a 4 * top_k, con hnsw_ef_search come minimo"""
+        client = vector_store.async_client
+
+        await vector_store.search("fattura", top_k=5)
+        assert client.query_points.call_args.kwargs["search_params"].hnsw_ef == 64
+
+        await vector_store.search("fattura", top_k=50)
+        assert client.query_points.call_args.kwargs["search_params"].hnsw_ef == 200
+
+    @pytest.mark.asyncio
+    async def test_payload_indexes_for_filter_fields(self, vector_store):
+        """Test indici del payload creati solo se mancanti"""
+        client = vector_store.async_client
+        client.create_payload_index.reset_mock()
+        client.get_collection.return_value = MagicMock(
+            payload_schema={"module": MagicMock(), "version": MagicMock()}
+        )
+
+        await vector_store._ensure_collection_exists()
+
+        created = {
+            call.kwargs["field_name"]: call.kwargs["field_schema"]
+            for call in client.create_payload_index.call_args_list
+        }
+        assert created == {
+            "content_type": models.PayloadSchemaType.KEYWORD,
+            "source_url": models.PayloadSchemaType.KEYWORD,
+            "section_level": models.PayloadSchemaType.INTEGER,
+        }
+        client.create_collection.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_search_loads_shared_images_once(
+        self, vector_store, mock_qdrant_client, sample_chunks_list
+    ):
+        """Test immagini di tutte le hit caricate con una sola lettura per ID"""
+        first, second = (
+            chunk.model_copy(deep=True) for chunk in sample_chunks_list[:2]
+        )
+        first.metadata.image_ids = ["abc_img_0", "abc_img_1"]
+        second.metadata.image_ids = ["abc_img_1"]
+        mock_qdrant_client.query_points.return_value = MagicMock(
+            points=[
+                MagicMock(payload=vector_store._chunk_to_payload(chunk), score=0.9)
+                for chunk in (first, second)
+            ]
+        )
+
+        with patch.object(
+            vector_store,
+            "_load_images_metadata",
+            AsyncMock(return_value=[{"id": "abc_img_0"}, {"id": "abc_img_1"}]),
+        ) as mock_load:
+            results = await vector_store.search("fattura", top_k=2)
+
+        mock_load.assert_awaited_once_with(["abc_img_0", "abc_img_1"])
+        assert [img["id"] for img in results[0].images] == ["abc_img_0", "abc_img_1"]
+        assert [img["id"] for img in results[1].images] == ["abc_img_1"]
+
+    @pytest.mark.asyncio
+    async def test_search_many_single_batch(
+        self, vector_store, mock_qdrant_client, sample_chunks_list
+    ):
+        """Test più query con un solo encode e una sola query_batch_points"""
+        first, second = sample_chunks_list[:2]
+        encode = vector_store.embedding_model.encode
+        encode.side_effect = lambda texts, **kwargs: np.ones(
+            (len(texts), 4), dtype=np.float32
+        )
+        encode.reset_mock()
+        mock_qdrant_client.query_batch_points = AsyncMock(
+            return_value=[
+                MagicMock(points=points)
+                for points in (
+                    [
+                        MagicMock(
+                            payload=vector_store._chunk_to_payload(first), score=0.8
+                        )
+                    ],
+                    [],
+                    [
+                        MagicMock(
+                            payload=vector_store._chunk_to_payload(second), score=0.7
+                        )
+                    ],
+                )
+            ]
+        )
+
+        results = await vector_store.search_many(
+            ["iva", "fattura", "iva"], top_k=3, filters={"module": "CONT"}
+        )
+
+        encode.assert_called_once()
+        assert encode.call_args.args[0] == ["iva", "fattura"]
+        requests = mock_qdrant_client.query_batch_points.call_args.kwargs["requests"]
+        assert len(requests) == 3
+        assert requests[0].limit == 3 and requests[0].filter is not None
+        assert [len(query_results) for query_results in results] == [1, 0, 1]
+        assert results[2][0].chunk.metadata.id == second.metadata.id
+        assert await vector_store.search_many([]) == []
+
     @pytest.mark.asyncio
     async def test_search_with_filters(self, vector_store):
         """Test ricerca con filtri sui metadati"""
@@ -137,6 +307,71 @@ class TestVectorStore:
 
         assert chunk is None
 
+    @pytest.mark.asyncio
+    async def test_get_chunks_by_ids(
+        self, vector_store, mock_qdrant_client, sample_chunks_list
+    ):
+        """Test recupero di più chunk con una sola retrieve, ordine preservato"""
+        first, second = sample_chunks_list[:2]
+        # Punti restituiti in ordine diverso da quello richiesto
+        mock_qdrant_client.retrieve.return_value = [
+            MagicMock(payload=vector_store._chunk_to_payload(chunk))
+            for chunk in (second, first)
+        ]
+
+        chunks = await vector_store.get_chunks_by_ids(
+            [first.metadata.id, "missing", second.metadata.id]
+        )
+
+        mock_qdrant_client.retrieve.assert_awaited_once()
+        assert [chunk.metadata.id if chunk else None for chunk in chunks] == [
+            first.metadata.id,
+            None,
+            second.metadata.id,
+        ]
+        assert await vector_store.get_chunks_by_ids([]) == []
+
+    @pytest.mark.asyncio
+    async def test_load_images_metadata(self, vector_store, tmp_path):
+        """Test metadata immagini dal listing della directory sorgente"""
+        (tmp_path / "abc").mkdir()
+        Image.new("RGB", (4, 3)).save(tmp_path / "abc" / "img_0.png")
+        clear_image_dir_cache()
+        settings = vector_store.settings.image_storage
+
+        with (
+            patch.object(settings, "enabled", True),
+            patch.object(settings, "storage_base_path", str(tmp_path)),
+        ):
+            images = await vector_store._load_images_metadata(
+                ["abc_img_0", "abc_img_1", "non_valido"]
+            )
+
+        assert [image["id"] for image in images] == ["abc_img_0"]
+        assert images[0]["width"] == 4
+        clear_image_dir_cache()
+
+    @pytest.mark.asyncio
+    async def test_load_images_metadata_off_loop(self, vector_store):
+        """Test letture in thread separati, nell'ordine degli ID"""
+        threads = []
+
+        def fake_load(image_id, storage_base):
+            threads.append(threading.get_ident())
+            return None if image_id == "missing" else {"id": image_id}
+
+        with (
+            patch.object(vector_store.settings.image_storage, "enabled", True),
+            patch(
+                "src.rag_gestionale.retrieval.vector_store.load_image_metadata",
+                side_effect=fake_load,
+            ),
+        ):
+            images = await vector_store._load_images_metadata(["b", "missing", "a"])
+
+        assert [image["id"] for image in images] == ["b", "a"]
+        assert threading.get_ident() not in threads
+
     @pytest.mark.asyncio
     async def test_delete_chunk(self, vector_store, mock_qdrant_client):
         """Test eliminazione singolo chunk"""
@@ -147,6 +382,19 @@ class TestVectorStore:
         assert success is True
         assert mock_qdrant_client.delete.called
 
+    @pytest.mark.asyncio
+    async def test_point_ids_stable_uuid(self, vector_store, mock_qdrant_client):
+        """Test stesso ID UUIDv5 in lettura e cancellazione, in ogni processo"""
+        chunk_id = "test_chunk_001"
+        expected = str(uuid.uuid5(uuid.NAMESPACE_URL, chunk_id))
+
+        await vector_store.get_chunk_by_id(chunk_id)
+        await vector_store.delete_chunk(chunk_id)
+
+        assert mock_qdrant_client.retrieve.call_args.kwargs["ids"] == [expected]
+        selector = mock_qdrant_client.delete.call_args.kwargs["points_selector"]
+        assert selector.points == [expected]
+
     @pytest.mark.asyncio
     async def test_update_chunk(self, vector_store, sample_document_chunk):
         """Test aggiornamento chunk esistente"""
@@ -177,8 +425,41 @@ class TestVectorStore:
 
         embeddings = await vector_store._generate_embeddings_batch(texts)
 
-        assert embeddings is not None
-        # Il mock ritorna un singolo vettore, ma nella realtà ne ritornerebbe 3
+        assert embeddings.shape == (3, 384)
+
+    @pytest.mark.asyncio
+    async def test_generate_embeddings_batch_dedup(self, vector_store):
+        """Test testi duplicati codificati una sola volta"""
+        encode = vector_store.embedding_model.encode
+        encode.side_effect = lambda texts, **kwargs: np.arange(
+            len(texts) * 2, dtype=np.float32
+        ).reshape(len(texts), 2)
+
+        embeddings = await vector_store._generate_embeddings_batch(["a", "b", "a"])
+
+        assert encode.call_args.args[0] == ["a", "b"]
+        assert embeddings.shape == (3, 2)
+        np.testing.assert_array_equal(embeddings[0], embeddings[2])
+
+    @pytest.mark.asyncio
+    async def test_generate_embeddings_batch_persistent_cache(
+        self, vector_store, tmp_path
+    ):
+        """Test embedding in cache su disco non ricalcolati"""
+        vector_store._embedding_cache = EmbeddingCache(
+            str(tmp_path / "embeddings.sqlite"), namespace="test"
+        )
+        encode = vector_store.embedding_model.encode
+        encode.side_effect = lambda texts, **kwargs: np.ones(
+            (len(texts), 2), dtype=np.float32
+        )
+
+        await vector_store._generate_embeddings_batch(["a", "b"])
+        embeddings = await vector_store._generate_embeddings_batch(["b", "c", "a"])
+
+        assert encode.call_count == 2
+        assert encode.call_args.args[0] == ["c"]
+        assert embeddings.shape == (3, 2)
 
     @pytest.mark.asyncio
     async def test_generate_embedding_single(self, vector_store):
@@ -189,6 +470,24 @@ class TestVectorStore:
 
         assert embedding is not None
 
+    @pytest.mark.asyncio
+    async def test_generate_embedding_cached(self, vector_store):
+        """Test embedding di query ripetute calcolato una sola volta"""
+        encode = vector_store.embedding_model.encode
+        encode.side_effect = lambda texts, **kwargs: np.ones(
+            (len(texts), 4), dtype=np.float32
+        )
+        encode.reset_mock()
+
+        first = await vector_store._generate_embedding("fattura  elettronica")
+        again = await vector_store._generate_embedding(" fattura elettronica ")
+        other = await vector_store._generate_embedding("Fattura elettronica")
+
+        assert again is first
+        assert other is not first
+        assert encode.call_count == 2
+        assert encode.call_args_list[0].args[0] == ["fattura elettronica"]
+
     def test_chunk_to_payload(self, vector_store, sample_document_chunk):
         """Test conversione chunk in payload Qdrant"""
         payload = vector_store._chunk_to_payload(sample_document_chunk)
@@ -229,6 +528,16 @@ class TestVectorStore:
             == sample_document_chunk.metadata.content_type
         )
 
+    def test_payload_round_trip(self, vector_store, sample_parameter_chunk):
+        """Test payload JSON senza campi None e chunk ricostruito identico"""
+        payload = vector_store._chunk_to_payload(sample_parameter_chunk)
+
+        assert "id" not in payload
+        assert None not in payload.values()
+        assert isinstance(payload["updated_at"], str)
+        restored = vector_store._payload_to_chunk(payload)
+        assert restored == sample_parameter_chunk
+
     def test_build_filter_module(self, vector_store):
         """Test costruzione filtro per modulo"""
         filters = {"module": "Fatturazione"}